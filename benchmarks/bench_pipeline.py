@@ -0,0 +1,194 @@
+'''
+Pipeline benchmarks on synthetic data (no Maya needed).
+
+Times every stage separately for each vertex count / sample count / file
+format combination and writes the results to json, so runs of different
+versions can be compared:
+
+  python benchmarks/bench_pipeline.py --vtx_num 1000 --vtx_num 10000 --samples 100 --out bench.json
+'''
+import os
+import sys
+import json
+import time
+import click
+import shutil
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import torch
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'py'))
+
+import bshapegen.vtx_io as vtx_io
+import bshapegen.synthetic as synthetic
+import bshapegen.build_model as build_model
+import bshapegen.infer_model as infer_model
+
+
+def git_version():
+  '''short commit of the checkout, '' outside git'''
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                   cwd=ROOT_DIR,
+                                   stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return ''
+
+
+class Timer(object):
+  '''collect best-of-repeat wall times per stage'''
+  def __init__(self, repeat=3):
+    self.repeat = repeat
+    self.timings = {}
+
+
+  def run(self, stage, func, repeat=None):
+    best = None
+    for i in range(repeat or self.repeat):
+      start_time = time.perf_counter()
+      result = func()
+      seconds = time.perf_counter() - start_time
+      best = seconds if best is None else min(best, seconds)
+    self.timings[stage] = best
+    return result
+
+
+def bench_case(work_dir, vtx_num=8, samples=100, ext='.npy', epochs=5,
+               neuron_num=512, batch_size=0, predict_num=10, repeat=3):
+  '''time all stages for one data size and file format'''
+  timer = Timer(repeat=repeat)
+
+  neutral, pose = synthetic.make_samples(samples+predict_num, vtx_num=vtx_num, seed=0)
+  train_neutral, predict_neutral = neutral[:samples], neutral[samples:]
+  train_pose = pose[:samples]
+
+  # the maya export writes python lists, time that path
+  neutral_rows = train_neutral.tolist()
+  pose_rows = train_pose.tolist()
+  input_path = os.path.join(work_dir, 'model_input_data'+ext)
+  output_path = os.path.join(work_dir, 'model_output_data'+ext)
+
+  def _write():
+    vtx_io.write_vtx(input_path, neutral_rows)
+    vtx_io.write_vtx(output_path, pose_rows)
+  timer.run('write', _write)
+
+  def _load():
+    # np.array forces memory-mapped pages to be read
+    return (np.array(vtx_io.load_vtx(input_path)),
+            np.array(vtx_io.load_vtx(output_path)))
+  inputs, outputs = timer.run('load', _load)
+
+  def _norm():
+    return build_model.featNorm(inputs), build_model.featNorm(outputs)
+  inputNormalization, outputNormalization = timer.run('normalize', _norm)
+
+  inputs_norm = torch.from_numpy(inputNormalization[0])
+  outputs_norm = torch.from_numpy(outputNormalization[0])
+  def _train():
+    return build_model.train_model(inputs_norm,
+                                   outputs_norm,
+                                   neuron_num=neuron_num,
+                                   epochs=epochs,
+                                   batch_size=batch_size,
+                                   seed=0)
+  model, train_loss, val_loss = timer.run('train', _train, repeat=1)
+  model.eval()
+
+  stats = [torch.FloatTensor(stat).reshape(1,-1) for stat in (inputNormalization[1],
+                                                              inputNormalization[2],
+                                                              outputNormalization[1],
+                                                              outputNormalization[2])]
+
+  timer.run('infer_single', lambda: infer_model.run_model(model, predict_neutral[:1], *stats), repeat=repeat*10)
+  predicted = timer.run('infer_batch', lambda: infer_model.run_model(model, predict_neutral, *stats))
+
+  # the maya import reads the predicted file without numpy
+  predict_path = os.path.join(work_dir, 'predict_output_data'+ext)
+  vtx_io.write_vtx(predict_path, predicted)
+  timer.run('import_parse', lambda: vtx_io.read_vtx(predict_path))
+
+  rows, cols = synthetic.grid_size(vtx_num)
+  return {'vtx_num':rows*cols,
+          'samples':samples,
+          'format':ext,
+          'epochs':epochs,
+          'neuron_num':neuron_num,
+          'batch_size':batch_size,
+          'predict_num':predict_num,
+          'timings_s':timer.timings,
+          'epochs_per_s':epochs / timer.timings['train'],
+          'infer_rows_per_s':predict_num / timer.timings['infer_batch'],
+          'final_loss':train_loss[-1],
+          'final_val_loss':val_loss[-1] if val_loss else None}
+
+
+@click.command()
+@click.option('--vtx_num', multiple=True, type=int, default=[8, 1000, 10000], help='vertices per mesh (repeatable)')
+@click.option('--samples', multiple=True, type=int, default=[100], help='training samples (repeatable)')
+@click.option('--format', 'formats', multiple=True, type=click.Choice(['.npy', '.m']), default=['.npy', '.m'], help='file formats (repeatable)')
+@click.option('--epochs', default=5, help='training epochs per case')
+@click.option('--neuron_num', default=512, help='512,1024,etc..')
+@click.option('--batch_size', default=0, help='0 = full batch')
+@click.option('--predict_num', default=10, help='meshes in the batched inference stage')
+@click.option('--repeat', default=3, help='best of repeat timings per stage')
+@click.option('--threads', default=0, help='torch threads, 0 = torch default')
+@click.option('--out', 'out_json', default='bench_results.json', type=click.Path(exists=False), help='results json')
+def bench(vtx_num=[8, 1000, 10000],
+          samples=[100],
+          formats=['.npy', '.m'],
+          epochs=5,
+          neuron_num=512,
+          batch_size=0,
+          predict_num=10,
+          repeat=3,
+          threads=0,
+          out_json='bench_results.json'):
+  if threads:
+    torch.set_num_threads(threads)
+
+  results = {'version':git_version(),
+             'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'platform':platform.platform(),
+             'python':platform.python_version(),
+             'numpy':np.__version__,
+             'torch':torch.__version__,
+             'torch_threads':torch.get_num_threads(),
+             'cases':[]}
+
+  # warm up torch so the first case doesn't pay its lazy init
+  build_model.train_model(torch.zeros((4, 3)), torch.zeros((4, 3)), neuron_num=8, epochs=1)
+
+  work_dir = tempfile.mkdtemp(prefix='bsg_bench_')
+  try:
+    for _vtx_num in vtx_num:
+      for _samples in samples:
+        for ext in formats:
+          case = bench_case(work_dir,
+                            vtx_num=_vtx_num,
+                            samples=_samples,
+                            ext=ext,
+                            epochs=epochs,
+                            neuron_num=neuron_num,
+                            batch_size=batch_size,
+                            predict_num=predict_num,
+                            repeat=repeat)
+          results['cases'].append(case)
+          print('[vtx %d] [samples %d] [%s] %s'
+                % (case['vtx_num'],
+                   case['samples'],
+                   ext,
+                   ' '.join('%s=%0.4fs' % item for item in case['timings_s'].items())))
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+  with open(out_json, 'w') as fp:
+    json.dump(results, fp, indent=2)
+  print('Saved:', out_json)
+
+
+if __name__ == '__main__':
+  bench()
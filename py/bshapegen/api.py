@@ -0,0 +1,20 @@
+'''
+In-process train/predict on NumPy arrays, for pipeline tools running in a
+torch-enabled Python. No temp files and no subprocess; arrays are handed to
+torch with torch.from_numpy where possible:
+
+  import bshapegen.api as bsg
+
+  bundle = bsg.train(neutral_rows, pose_rows, epochs=150, seed=0)
+  predicted = bundle.predict(new_neutral_rows)
+  bundle.save('model.pt', 'in_mean.npy', 'in_std.npy', 'out_mean.npy', 'out_std.npy')
+
+  bundle = bsg.ModelBundle.load('model.pt', 'in_mean.npy', 'in_std.npy', 'out_mean.npy', 'out_std.npy')
+
+build_model.py and infer_model.py are the command line wrappers of the same
+functions. train() takes the make_model options as keyword arguments.
+'''
+from bshapegen.build_model import train
+from bshapegen.infer_model import ModelBundle
+
+__all__ = ['train', 'ModelBundle']
@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import torch
 import click
@@ -6,22 +7,320 @@ import time
 import numpy as np
 import torch.nn as nn
 
+# allow running as a script (python build_model.py) as well as a module
+if __package__ in (None, ''):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def featNorm(features):
+import bshapegen.pca as pca
+import bshapegen.timing as timing
+import bshapegen.vtx_io as vtx_io
+import bshapegen.metrics as metrics_log
+import bshapegen.profiling as profiling
+import bshapegen.quantize as quantize
+import bshapegen.threads as threads_config
+import bshapegen.train_cache as train_cache
+import bshapegen.shards as shards
+import bshapegen.norm_stats as norm_stats
+import bshapegen.export_model as export_model
+import bshapegen.infer_model as infer_model
+import bshapegen.utils as utils
+
+# training precisions, bf16 runs forward/loss under cpu autocast
+PRECISIONS = ['fp32', 'bf16']
+
+
+def featNorm(features, chunk_rows=4096):
   '''Normalize features by mean and standard deviation.
+  Stats are accumulated in float64 chunk_rows rows at a time (see
+  norm_stats.RunningStats), normalized features are float32.
   Returns tuple (normalizedFeatures, mean, standardDeviation).
   '''
-  mean = np.mean(features, axis=0)
-  std = np.std(features - mean, axis=0)
-  feats_norm = (features - mean) / (std + np.finfo(np.float32).eps)
-  return (feats_norm, mean, std)
+  stats = norm_stats.chunk_stats(features, chunk_rows)
+  feats_norm = np.empty(features.shape, dtype=np.float32)
+  for i in range(0, len(features), chunk_rows):
+    feats_norm[i:i+chunk_rows] = stats.normalize(features[i:i+chunk_rows])
+  return (feats_norm, stats.mean, stats.std)
 
 
 def featDenorm(features_norm, mean, std):
   '''Denormalize features by mean and standard deviation
   '''
-  features = (features_norm * std) + mean
-  return features
+  return norm_stats.denormalize(features_norm, mean, std)
+
+
+class ShuffledBatches(object):
+  '''
+  Iterate (inputs, outputs) training batches.
+  batch_size 0 yields the full dataset once per epoch (no copy, the
+  gradient of a full batch does not depend on the order). Otherwise rows are
+  shuffled with a torch.randperm every epoch and gathered into preallocated
+  (pinned when cuda is available) batch buffers, or loaded by num_workers
+  DataLoader workers.
+  '''
+  def __init__(self,
+               inputs,
+               outputs,
+               batch_size=0,
+               num_workers=0):
+    self.inputs = inputs
+    self.outputs = outputs
+    self.row_num = len(inputs)
+    self.batch_size = min(batch_size, self.row_num) if batch_size > 0 else 0
+    self.loader = None
+
+    if not self.batch_size:
+      return
+
+    pin_memory = torch.cuda.is_available()
+
+    if num_workers > 0:
+      # workers fetch whole batches through a batch sampler
+      dataset = torch.utils.data.TensorDataset(inputs, outputs)
+      sampler = torch.utils.data.BatchSampler(torch.utils.data.RandomSampler(dataset),
+                                              batch_size=self.batch_size,
+                                              drop_last=False)
+      self.loader = torch.utils.data.DataLoader(dataset,
+                                                sampler=sampler,
+                                                batch_size=None,
+                                                num_workers=num_workers,
+                                                pin_memory=pin_memory,
+                                                persistent_workers=True)
+    else:
+      self.inputs_buf = torch.empty((self.batch_size,)+tuple(inputs.shape[1:]),
+                                    dtype=inputs.dtype,
+                                    pin_memory=pin_memory)
+      self.outputs_buf = torch.empty((self.batch_size,)+tuple(outputs.shape[1:]),
+                                     dtype=outputs.dtype,
+                                     pin_memory=pin_memory)
+
+
+  def __len__(self):
+    if not self.batch_size:
+      return 1
+    return (self.row_num + self.batch_size - 1) // self.batch_size
+
+
+  def __iter__(self):
+    if not self.batch_size:
+      yield self.inputs, self.outputs
+      return
+
+    if self.loader is not None:
+      for batch in self.loader:
+        yield batch
+      return
+
+    shuffle_ids = torch.randperm(self.row_num)
+    for i in range(0, self.row_num, self.batch_size):
+      batch_ids = shuffle_ids[i:i+self.batch_size]
+      inputs_batch = self.inputs_buf[:len(batch_ids)]
+      outputs_batch = self.outputs_buf[:len(batch_ids)]
+      torch.index_select(self.inputs, 0, batch_ids, out=inputs_batch)
+      torch.index_select(self.outputs, 0, batch_ids, out=outputs_batch)
+      yield inputs_batch, outputs_batch
+
+
+def batch_loss(model, batches, loss_func):
+  '''
+  sample weighted mean loss over (inputs, outputs) batches
+  '''
+  model.eval()
+  total_loss = 0.0
+  row_num = 0
+  with torch.no_grad(): # validation should not mess with weights
+    for inputs_batch, outputs_batch in batches:
+      pred = model(inputs_batch)
+      total_loss += loss_func(pred, outputs_batch).item() * len(inputs_batch)
+      row_num += len(inputs_batch)
+  return total_loss / max(row_num, 1)
+
+
+def save_checkpoint(path, state):
+  '''torch.save to a temp file first, a crash mid-write keeps the old checkpoint'''
+  tmp_path = path + '.tmp'
+  torch.save(state, tmp_path)
+  os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+  return torch.load(path, weights_only=False)
+
+
+def train_epochs(model,
+                 batches,
+                 val_batches,
+                 loss_func,
+                 optimizer,
+                 epochs=10,
+                 patience=0,
+                 checkpoint_path='',
+                 checkpoint_every=10,
+                 resume=False,
+                 precision='fp32',
+                 metrics=None,
+                 profiler=None):
+  '''
+  Epoch loop shared by in-memory and streamed training data.
+  batches/val_batches are re-iterable (inputs, outputs) batches,
+  val_batches None skips validation.
+  With validation the best validation epoch weights are restored at the
+  end, patience > 0 stops after that many epochs without improvement.
+  checkpoint_path saves model/optimizer state and loss history every
+  checkpoint_every epochs (and on the last one), resume continues from it.
+  precision 'bf16' runs the forward pass and loss under bfloat16 autocast,
+  weights, optimizer state and validation stay float32.
+  metrics (metrics.MetricsLogger) gets an 'epoch' record per epoch with the
+  time split and memory, and a 'summary' record at the end.
+  profiler (profiling.Profiler) records the training steps, one per batch.
+  Returns tuple (train_loss_history, validation_loss_history)
+  '''
+  train_loss_h = []
+  val_loss_h = []
+  best_val_loss = float('inf')
+  best_epoch = 0
+  best_state = None
+  start_epoch = 1
+  stopped = False
+
+  if resume and checkpoint_path and os.path.exists(checkpoint_path):
+    checkpoint = load_checkpoint(checkpoint_path)
+    model.load_state_dict(checkpoint['model'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    torch.set_rng_state(checkpoint['rng_state'])
+    train_loss_h = checkpoint['train_loss']
+    val_loss_h = checkpoint['val_loss']
+    best_val_loss = checkpoint['best_val_loss']
+    best_epoch = checkpoint['best_epoch']
+    best_state = checkpoint['best_model']
+    start_epoch = checkpoint['epoch'] + 1
+    stopped = checkpoint['stopped']
+    print("Resumed from %s at epoch %d" % (checkpoint_path, checkpoint['epoch']))
+  elif resume:
+    print("No checkpoint at %s, training from epoch 1" % checkpoint_path)
+
+  if profiler:
+    profiler.start()
+
+  train_start = time.perf_counter()
+  total_rows = 0
+  # last epoch that ran, a resumed run that had already stopped runs none
+  last_epoch = start_epoch - 1
+  for epoch in range(start_epoch,epochs+1): # count epochs starting with 1
+    if stopped:
+      break
+    last_epoch = epoch
+
+    epoch_start = time.perf_counter()
+    # seconds spent per step phase, data is waiting on the batch iterator
+    times = {'data_s':0.0, 'forward_s':0.0, 'backward_s':0.0, 'optimizer_s':0.0}
+
+    model.train()
+    epoch_loss = 0.0
+    row_num = 0
+    tic = time.perf_counter()
+    for inputs_batch, outputs_batch in batches:
+      t_forward = time.perf_counter()
+      times['data_s'] += t_forward - tic
+      optimizer.zero_grad()
+      # feed-forward and backpropagate
+      with torch.autocast('cpu', dtype=torch.bfloat16, enabled=precision == 'bf16'):
+        pred = model(inputs_batch)
+        #
+        loss = loss_func(pred, outputs_batch)
+      t_backward = time.perf_counter()
+      times['forward_s'] += t_backward - t_forward
+      loss.backward()
+      t_optimizer = time.perf_counter()
+      times['backward_s'] += t_optimizer - t_backward
+      optimizer.step()
+      times['optimizer_s'] += time.perf_counter() - t_optimizer
+      epoch_loss += loss.item() * len(inputs_batch)
+      row_num += len(inputs_batch)
+      if profiler:
+        profiler.step()
+      tic = time.perf_counter()
+
+    # sample weighted mean of the batch losses
+    epoch_loss /= max(row_num, 1)
+    train_loss_h.append(epoch_loss)
+    total_rows += row_num
+      
+    val_loss = None
+    if val_batches is not None:
+      t_val = time.perf_counter()
+      val_loss = batch_loss(model, val_batches, loss_func)
+      times['val_s'] = time.perf_counter() - t_val
+      val_loss_h.append(val_loss)
+      print ("[Epoch %d/%d] [loss: %f] [validation: %f]"
+             % (epoch, epochs, epoch_loss, val_loss))
+
+      if val_loss < best_val_loss:
+        best_val_loss = val_loss
+        best_epoch = epoch
+        best_state = {k:v.detach().clone() for k, v in model.state_dict().items()}
+      elif patience and epoch - best_epoch >= patience:
+        print ("Early stopping at epoch %d, best validation: %f at epoch %d"
+               % (epoch, best_val_loss, best_epoch))
+        stopped = True
+    
+    else:
+      print ("[Epoch %d/%d] [loss: %f] "
+             % (epoch, epochs, epoch_loss))
+
+    if checkpoint_path and (stopped
+                            or epoch == epochs
+                            or (checkpoint_every and epoch % checkpoint_every == 0)):
+      save_checkpoint(checkpoint_path,
+                      {'model':model.state_dict(),
+                       'optimizer':optimizer.state_dict(),
+                       'rng_state':torch.get_rng_state(),
+                       'epoch':epoch,
+                       'train_loss':train_loss_h,
+                       'val_loss':val_loss_h,
+                       'best_val_loss':best_val_loss,
+                       'best_epoch':best_epoch,
+                       'best_model':best_state,
+                       'stopped':stopped})
+
+    if metrics:
+      epoch_s = time.perf_counter() - epoch_start
+      metrics.write('epoch',
+                    epoch=epoch,
+                    epochs=epochs,
+                    train_loss=epoch_loss,
+                    val_loss=val_loss,
+                    samples=row_num,
+                    wall_s=epoch_s,
+                    samples_per_sec=row_num / max(epoch_s, 1e-9),
+                    **times)
+
+    if stopped:
+      break
+
+  if profiler:
+    profiler.stop()
+
+  # keep the best validation weights rather than the last ones
+  if best_state is not None and best_epoch != last_epoch:
+    model.load_state_dict(best_state)
+    print ("Restored best validation: %f at epoch %d" % (best_val_loss, best_epoch))
+
+  if metrics:
+    train_s = time.perf_counter() - train_start
+    metrics.write('summary',
+                  epochs_run=last_epoch - start_epoch + 1,
+                  last_epoch=last_epoch,
+                  epochs=epochs,
+                  stopped=stopped,
+                  wall_s=train_s,
+                  samples=total_rows,
+                  samples_per_sec=total_rows / max(train_s, 1e-9),
+                  train_loss=train_loss_h[-1] if train_loss_h else None,
+                  val_loss=val_loss_h[-1] if val_loss_h else None,
+                  best_val_loss=best_val_loss if best_state is not None else None,
+                  best_epoch=best_epoch if best_state is not None else None)
+
+  return train_loss_h, val_loss_h
 
 
 def fit(model,
@@ -30,50 +329,331 @@ def fit(model,
         loss_func,
         optimizer,
         epochs=10,
-        validation_split=None):
-  #
-  if validation_split != None:
-    validation = True
+        validation_split=None,
+        batch_size=0,
+        num_workers=0,
+        patience=0,
+        checkpoint_path='',
+        checkpoint_every=10,
+        resume=False,
+        precision='fp32',
+        metrics=None,
+        profiler=None):
+  '''
+  Train model, the last validation_split rows are held out for validation.
+  batch_size 0 runs one full-batch step per epoch, otherwise one step per
+  shuffled mini-batch (see ShuffledBatches).
+  patience/checkpoint_path/checkpoint_every/resume/precision/metrics/profiler,
+  see train_epochs.
+  Returns tuple (train_loss_history, validation_loss_history)
+  '''
+  if validation_split:
     val_split_id = int(len(inputs)*(1-validation_split))
-    val_inputs = inputs[:val_split_id]
-    val_outputs = outputs[:val_split_id]
   else:
-    validation = False
     val_split_id = len(inputs)
 
-  train_inputs = inputs[val_split_id:]
-  train_outputs = outputs[val_split_id:]
-      
-  train_loss_h = []
-  val_loss_h = []
-  
-  for epoch in range(1,epochs+1): # count epochs starting with 1
-    optimizer.zero_grad()
-    # shuffle samples at every epoch
-    shuffle_ids = list(range(val_split_id))
-    np.random.shuffle(shuffle_ids)
-    # feed-forward and backpropagate
-    pred = model(inputs[shuffle_ids])
-    #
-    loss = loss_func(pred, outputs[shuffle_ids])
-    train_loss_h.append(loss.item())
-    loss.backward()
-    optimizer.step()
-      
-    if validation:
-      with torch.no_grad(): # validation should not mess with weights
-        val_pred = model(inputs[:val_split_id])
-        val_loss = loss_func(val_pred, outputs[:val_split_id])
+  # slices are views, no copy of the dataset
+  train_inputs = inputs[:val_split_id]
+  train_outputs = outputs[:val_split_id]
 
-        val_loss_h.append(loss.item())
-      print ("[Epoch %d/%d] [loss: %f] [validation: %f]"
-             % (epoch, epochs, loss.item(), val_loss.item()))
-    
-    else:
-      print ("[Epoch %d/%d] [loss: %f] "
-             % (epoch, epochs, loss.item()))
+  batches = ShuffledBatches(train_inputs,
+                            train_outputs,
+                            batch_size=batch_size,
+                            num_workers=num_workers)
 
-  return train_loss_h, val_loss_h
+  val_batches = None
+  if val_split_id < len(inputs):
+    val_batches = [(inputs[val_split_id:], outputs[val_split_id:])]
+
+  return train_epochs(model,
+                      batches,
+                      val_batches,
+                      loss_func,
+                      optimizer,
+                      epochs=epochs,
+                      patience=patience,
+                      checkpoint_path=checkpoint_path,
+                      checkpoint_every=checkpoint_every,
+                      resume=resume,
+                      precision=precision,
+                      metrics=metrics,
+                      profiler=profiler)
+
+
+def fit_shards(model,
+               input_paths,
+               output_paths,
+               stats,
+               loss_func,
+               optimizer,
+               epochs=10,
+               validation_split=None,
+               batch_size=0,
+               num_workers=0,
+               prefetch_size=2,
+               patience=0,
+               checkpoint_path='',
+               checkpoint_every=10,
+               resume=False,
+               precision='fp32',
+               metrics=None,
+               profiler=None):
+  '''
+  Train model streaming normalized batches from memory-mapped shards
+  (see shards.ShardBatches), with at most prefetch_size batches loaded ahead.
+  batch_size 0 uses 256 rows per batch, a full batch is not streamable.
+  patience/checkpoint_path/checkpoint_every/resume/precision/metrics/profiler,
+  see train_epochs.
+  Returns tuple (train_loss_history, validation_loss_history)
+  '''
+  batch_size = batch_size or 256
+
+  train_set = shards.ShardBatches(input_paths,
+                                  output_paths,
+                                  stats,
+                                  batch_size=batch_size,
+                                  validation_split=validation_split,
+                                  split='train')
+  batches = shards.PrefetchBatches(train_set,
+                                   num_workers=num_workers,
+                                   prefetch_size=prefetch_size)
+
+  val_batches = None
+  if validation_split:
+    val_set = shards.ShardBatches(input_paths,
+                                  output_paths,
+                                  stats,
+                                  batch_size=batch_size,
+                                  validation_split=validation_split,
+                                  split='val')
+    if val_set.row_count():
+      val_batches = shards.PrefetchBatches(val_set,
+                                           prefetch_size=prefetch_size)
+
+  return train_epochs(model,
+                      batches,
+                      val_batches,
+                      loss_func,
+                      optimizer,
+                      epochs=epochs,
+                      patience=patience,
+                      checkpoint_path=checkpoint_path,
+                      checkpoint_every=checkpoint_every,
+                      resume=resume,
+                      precision=precision,
+                      metrics=metrics,
+                      profiler=profiler)
+
+
+def make_net(input_cols, output_cols, neuron_num=512):
+  '''
+  MLP mapping neutral vertex data to pose vertex data
+  '''
+  return nn.Sequential(nn.Linear(input_cols, neuron_num),
+                       nn.Tanh(),
+                       nn.Linear(neuron_num, neuron_num),
+                       nn.Tanh(),
+                       nn.Linear(neuron_num, output_cols))
+
+
+def train_model(inputs_norm,
+                outputs_norm,
+                neuron_num=512,
+                learning_rate=0.001,
+                epochs=150,
+                validation_split=0.3,
+                batch_size=0,
+                num_workers=0,
+                patience=0,
+                precision='fp32',
+                seed=None,
+                checkpoint_path='',
+                checkpoint_every=10,
+                resume=False,
+                metrics=None,
+                profiler=None):
+  '''
+  init and fit a model on normalized input/output tensors
+  Returns tuple (model, train_loss_history, validation_loss_history)
+  '''
+  if seed is not None:
+    torch.manual_seed(seed)
+
+  model = make_net(inputs_norm.shape[1], outputs_norm.shape[1], neuron_num)
+  optimizer = torch.optim.Adam(model.parameters(),
+                               lr=learning_rate)
+  loss_func = nn.MSELoss()
+
+  train_loss, val_loss = fit(model,
+                             inputs_norm,
+                             outputs_norm,
+                             loss_func,
+                             optimizer,
+                             epochs=epochs,
+                             validation_split=validation_split,
+                             batch_size=batch_size,
+                             num_workers=num_workers,
+                             patience=patience,
+                             checkpoint_path=checkpoint_path,
+                             checkpoint_every=checkpoint_every,
+                             resume=resume,
+                             precision=precision,
+                             metrics=metrics,
+                             profiler=profiler)
+  return model, train_loss, val_loss
+
+
+def train(inputs,
+          outputs,
+          neuron_num=512,
+          learning_rate=0.001,
+          epochs=150,
+          validation_split=0.3,
+          batch_size=0,
+          num_workers=0,
+          patience=0,
+          precision='fp32',
+          seed=None,
+          pca_inputs=0.0,
+          pca_outputs=0.0,
+          checkpoint_path='',
+          checkpoint_every=10,
+          resume=False,
+          metrics_path='',
+          callback=None,
+          profiler=None):
+  '''
+  Train a model in process on (rows, cols) neutral/pose rows (numpy arrays,
+  memory-mapped .npy or tensors), no files are written besides the
+  optional checkpoint. Rows are normalized chunk by chunk into one float32
+  array that torch uses as is (torch.from_numpy).
+  Params are the make_model options, pca_inputs/pca_outputs fold the PCA
+  bases into the model (see pca.py).
+  metrics_path writes per epoch metrics as JSON lines, callback(record)
+  gets each record live (see metrics.py).
+  profiler (profiling.Profiler) cProfiles normalization and records the
+  training steps with torch.profiler.
+  Returns infer_model.ModelBundle, ie. bundle.predict(rows) or bundle.save(...)
+  '''
+  if torch.is_tensor(inputs):
+    inputs = inputs.numpy()
+  if torch.is_tensor(outputs):
+    outputs = outputs.numpy()
+  inputs = inputs.reshape(-1,inputs.shape[-1])
+  outputs = outputs.reshape(-1,outputs.shape[-1])
+  if len(inputs) != len(outputs):
+    raise ValueError('%d input rows for %d output rows' % (len(inputs), len(outputs)))
+
+  metrics = None
+  if metrics_path or callback:
+    metrics = metrics_log.MetricsLogger(metrics_path, callback, append=resume)
+
+  # normalize INPUTS/OUTPUTS
+  t_prepare = time.perf_counter()
+  with profiling.stage(profiler, 'normalize'):
+    inputs_norm_np, inputs_mean, inputs_std = featNorm(inputs)
+    outputs_norm_np, outputs_mean, outputs_std = featNorm(outputs)
+  inputs_norm = torch.from_numpy(inputs_norm_np)
+  outputs_norm = torch.from_numpy(outputs_norm_np)
+  normalize_s = time.perf_counter() - t_prepare
+
+  # PCA compress normalized INPUTS/OUTPUTS, the MLP trains on coefficients
+  inputs_basis = outputs_basis = None
+  if pca_inputs:
+    inputs_basis, explained = pca.fit_basis(inputs_norm_np, pca_inputs)
+    inputs_norm = pca.project(inputs_norm, inputs_basis)
+    print("inputs PCA: %d -> %d components (%0.6f variance)" % (inputs.shape[1], inputs_basis.shape[1], explained))
+  if pca_outputs:
+    outputs_basis, explained = pca.fit_basis(outputs_norm_np, pca_outputs)
+    outputs_norm = pca.project(outputs_norm, outputs_basis)
+    print("outputs PCA: %d -> %d components (%0.6f variance)" % (outputs.shape[1], outputs_basis.shape[1], explained))
+
+  if metrics:
+    metrics.write('prepare',
+                  rows=len(inputs),
+                  input_cols=inputs.shape[1],
+                  output_cols=outputs.shape[1],
+                  net_input_cols=inputs_norm.shape[1],
+                  net_output_cols=outputs_norm.shape[1],
+                  normalize_s=normalize_s,
+                  pca_s=time.perf_counter() - t_prepare - normalize_s)
+
+  model, train_loss, val_loss = train_model(inputs_norm,
+                                            outputs_norm,
+                                            neuron_num=neuron_num,
+                                            learning_rate=learning_rate,
+                                            epochs=epochs,
+                                            validation_split=validation_split,
+                                            batch_size=batch_size,
+                                            num_workers=num_workers,
+                                            patience=patience,
+                                            precision=precision,
+                                            seed=seed,
+                                            checkpoint_path=checkpoint_path,
+                                            checkpoint_every=checkpoint_every,
+                                            resume=resume,
+                                            metrics=metrics,
+                                            profiler=profiler)
+  if metrics:
+    metrics.close()
+
+  # fold the PCA bases into the model so inference maps full rows
+  bases = None
+  if pca_inputs or pca_outputs:
+    model = pca.wrap_model(model, inputs_basis, outputs_basis)
+    bases = (inputs_basis, outputs_basis)
+
+  return infer_model.ModelBundle(model,
+                                 inputs_mean,
+                                 inputs_std,
+                                 outputs_mean,
+                                 outputs_std,
+                                 bases=bases,
+                                 train_loss=train_loss,
+                                 val_loss=val_loss)
+
+
+def write_inference_artifacts(model,
+                              stats,
+                              model_paths={},
+                              sample_m='',
+                              quantize_int8=False,
+                              export=(),
+                              export_report=False):
+  '''
+  optional int8 model and lean exports of a trained (or cache restored)
+  model, stats is (inputs_mean, inputs_std, outputs_mean, outputs_std)
+  tensors, model_paths is utils.model_paths(), sample_m a data
+  file for the reports
+  '''
+  model_pt = model_paths['model_pt']
+  working_dir = os.path.dirname(model_pt)
+
+  # int8 model for inference, with size/latency/error against fp32
+  if quantize_int8:
+    qmodel = quantize.quantize_model(model)
+    torch.save(qmodel, os.path.splitext(model_pt)[0]+'_int8.pt')
+    sample = vtx_io.load_vtx(sample_m)
+    report = quantize.quant_report(model,
+                                   qmodel,
+                                   stats,
+                                   sample.reshape(-1,sample.shape[-1])[:256])
+    with open(os.path.join(working_dir,'quantize_report.json'), 'w') as fp:
+      json.dump(report, fp, indent=2)
+
+  # export lean inference artifacts (stats included)
+  if export:
+    artifacts = export_model.export_model(model,
+                                          stats,
+                                          model_pt,
+                                          formats=export)
+    if export_report and artifacts:
+      sample = vtx_io.load_vtx(sample_m)
+      report = export_model.latency_report(artifacts,
+                                           model_paths,
+                                           sample=sample.reshape(-1,sample.shape[-1])[0])
+      with open(os.path.join(working_dir,'export_report.json'), 'w') as fp:
+        json.dump(report, fp, indent=2)
 
 
 @click.command()
@@ -83,6 +663,30 @@ def fit(model,
 @click.option('--learning_rate', default=0.001, help='0.001')
 @click.option('--epochs', default=150, help='150')
 @click.option('--validation_split', default=0.3, help='0.3 (30%)')
+@click.option('--batch_size', default=0, help='0 = full batch, 32,64,etc..')
+@click.option('--num_workers', default=0, help='DataLoader workers for mini-batches, 0 = main process')
+@click.option('--prefetch', default=2, help='batches loaded ahead when streaming shard directories')
+@click.option('--patience', default=0, help='stop after N epochs without validation improvement, 0 = off')
+@click.option('--checkpoint_every', default=10, help='save <model>_checkpoint.pt every N epochs, 0 = last epoch only')
+@click.option('--resume', is_flag=True, help='continue training from <model>_checkpoint.pt')
+@click.option('--threads', default=0, help='torch intra-op threads, 0 = $BSG_THREADS, autotuned or torch default')
+@click.option('--interop_threads', default=0, help='torch inter-op threads, 0 = $BSG_INTEROP_THREADS, autotuned or torch default')
+@click.option('--cpus', default='', help='cpu affinity, ie. 0-3,8 (or $BSG_CPUS)')
+@click.option('--precision', default='fp32', type=click.Choice(PRECISIONS), help='fp32, or bf16 autocast training')
+@click.option('--quantize', 'quantize_int8', is_flag=True, help='also write a dynamic int8 <model>_int8.pt and quantize_report.json')
+@click.option('--seed', default=None, type=int, help='torch seed for init and shuffling, only seeded builds use the training cache')
+@click.option('--force', is_flag=True, help='retrain even if the training cache has an identical build')
+@click.option('--pca_inputs', default=0.0, help='PCA compress inputs: 0 = off, >=1 components, <1 explained variance (0.999)')
+@click.option('--pca_outputs', default=0.0, help='PCA compress outputs: 0 = off, >=1 components, <1 explained variance (0.999)')
+@click.option('--export', multiple=True, type=click.Choice(export_model.EXPORT_FORMATS),
+              help='also write a lean inference artifact next to MODEL_PT (repeatable)')
+@click.option('--export_report', is_flag=True, help='report cold start/per call latency of the exports vs model.pt')
+@click.option('--metrics', 'metrics_path', default='', help='per epoch metrics as JSON lines, default <model>_metrics.jsonl')
+@click.option('--profile', is_flag=True, help='torch.profiler trace/op table of the training steps and cProfile of loading, as <model>_profile_*')
+@click.option('--profile_wait', default=0, help='training steps (batches) skipped before profiling')
+@click.option('--profile_warmup', default=1, help='profiled steps discarded as warmup')
+@click.option('--profile_active', default=5, help='profiled steps recorded')
+@click.option('--profile_top', default=20, help='rows of the operator/function tables')
 @click.argument('model_pt', type=click.Path(exists=False))
 @click.argument('inputs_mean_m', type=click.Path(exists=False))
 @click.argument('inputs_std_m', type=click.Path(exists=False))
@@ -98,7 +702,45 @@ def make_model(model_input_m='',
                inputs_mean_m='',
                inputs_std_m='',
                outputs_mean_m='',
-               outputs_std_m=''):
+               outputs_std_m='',
+               batch_size=0,
+               num_workers=0,
+               prefetch=2,
+               patience=0,
+               checkpoint_every=10,
+               resume=False,
+               threads=0,
+               interop_threads=0,
+               cpus='',
+               precision='fp32',
+               quantize_int8=False,
+               seed=None,
+               force=False,
+               pca_inputs=0.0,
+               pca_outputs=0.0,
+               export=(),
+               export_report=False,
+               metrics_path='',
+               profile=False,
+               profile_wait=0,
+               profile_warmup=1,
+               profile_active=5,
+               profile_top=20):
+  '''
+  MODEL_INPUT_M/MODEL_OUTPUT_M are .npy/.m files, or directories of .npy
+  shards that are streamed from disk instead of loaded (see shards.py).
+  --pca_inputs/--pca_outputs train the MLP on PCA coefficients, the bases
+  are folded into MODEL_PT and also saved as <model>_pca.npz (see pca.py).
+  Training is checkpointed to <model>_checkpoint.pt, the weights of the best
+  validation epoch are saved to MODEL_PT.
+  Seeded builds with the same data contents and training params are
+  restored from the training cache (see train_cache.py) unless --force is
+  given.
+  Per epoch time split, throughput and memory are written to --metrics
+  (see metrics.py), followed by a 'build' record with the stage times.
+  --profile writes a Chrome trace, an operator table and cProfile stats of
+  loading/normalization next to MODEL_PT (see profiling.py).
+  '''
   
   # start timer
   start_time = time.time()
@@ -110,6 +752,22 @@ def make_model(model_input_m='',
             'learning_rate':learning_rate,
             'epochs':epochs,
             'validation_split':validation_split,
+            'batch_size':batch_size,
+            'num_workers':num_workers,
+            'prefetch':prefetch,
+            'patience':patience,
+            'checkpoint_every':checkpoint_every,
+            'resume':resume,
+            'threads':threads,
+            'interop_threads':interop_threads,
+            'cpus':cpus,
+            'precision':precision,
+            'quantize':quantize_int8,
+            'seed':seed,
+            'pca_inputs':pca_inputs,
+            'pca_outputs':pca_outputs,
+            'export':list(export),
+            'metrics':metrics_path,
             'model_pt':model_pt,
             'inputs_mean_m':inputs_mean_m,
             'inputs_std_m':inputs_std_m,
@@ -122,64 +780,185 @@ def make_model(model_input_m='',
   with open(params_json, 'w') as fp:
     json.dump(params, fp, indent=2)
 
-  # load input/output training data
-  inputs = np.loadtxt(model_input_m)
-  outputs = np.loadtxt(model_output_m)
+  stream = os.path.isdir(model_input_m)
+  model_paths = utils.model_paths(model_pt,
+                                  inputs_mean_m,
+                                  inputs_std_m,
+                                  outputs_mean_m,
+                                  outputs_std_m)
+  sample_m = shards.shard_paths(model_input_m)[0] if stream else model_input_m
+  metrics_path = metrics_path or os.path.splitext(model_pt)[0]+'_metrics.jsonl'
+  profiler = None
+  if profile:
+    profiler = profiling.Profiler(os.path.splitext(model_pt)[0]+'_profile',
+                                  wait=profile_wait,
+                                  warmup=profile_warmup,
+                                  active=profile_active,
+                                  top=profile_top)
 
-  print("inputs data shape: ",inputs.shape)
-  print("outputs data shape:",outputs.shape)
+  # reuse an identical earlier build (same data contents and training params)
+  cache = train_cache.TrainCache()
+  cache_artifacts = dict(model_paths, pca=os.path.splitext(model_pt)[0]+'_pca.npz')
+  cache_key = None
+  # an unseeded build is not reproducible, it is neither cached nor restored
+  if cache.enabled and not resume and seed is not None:
+    with timing.span('cache lookup'):
+      cache_key = cache.key([model_input_m, model_output_m], params)
+      # a profiled build has to train
+      restored = not (force or profile) and cache.restore(cache_key, cache_artifacts)
+    if restored:
+      print("Training cache hit: %s (--force to retrain)" % cache_key)
+      bundle = infer_model.ModelBundle.load(**model_paths)
+      write_inference_artifacts(bundle.model,
+                                bundle.stats,
+                                model_paths,
+                                sample_m,
+                                quantize_int8=quantize_int8,
+                                export=export,
+                                export_report=export_report)
+      # appended, the epoch records of the restored build stay
+      metrics = metrics_log.MetricsLogger(metrics_path, append=True)
+      metrics.write('build', cache_hit=True, total_s=time.time() - start_time)
+      metrics.close()
+      timing.save_env('build_model')
+      print("--- build_model - restored from cache in %0.2fs ---" % (time.time() - start_time))
+      return
+  if stream and (pca_inputs or pca_outputs):
+    raise click.UsageError('--pca_inputs/--pca_outputs need .npy/.m files, not shard directories')
 
-  # normalize INPUTS
-  inputNormalization = featNorm(inputs)
-  inputs_norm = torch.FloatTensor(inputNormalization[0])
+  t_load = time.time()
+  with profiling.stage(profiler, 'load'), timing.span('file read'):
+    if stream:
+      # stream input/output training data from memory-mapped shards
+      input_paths = shards.shard_paths(model_input_m)
+      output_paths = shards.shard_paths(model_output_m)
+      row_num, input_cols, output_cols = shards.check_shards(input_paths, output_paths)
 
-  inputs_mean = torch.FloatTensor(inputNormalization[1])
-  inputs_mean = inputs_mean.reshape(1,inputs_mean.shape[0])
+      print("inputs data shape: ",(row_num, input_cols), "in %d shards" % len(input_paths))
+      print("outputs data shape:",(row_num, output_cols), "in %d shards" % len(output_paths))
+    else:
+      # load input/output training data (.npy files are memory-mapped)
+      inputs = vtx_io.load_vtx(model_input_m)
+      outputs = vtx_io.load_vtx(model_output_m)
+      input_cols = inputs.shape[1]
+      output_cols = outputs.shape[1]
 
-  inputs_std = torch.FloatTensor(inputNormalization[2])
-  inputs_std = inputs_std.reshape(1,inputs_std.shape[0])
+      print("inputs data shape: ",inputs.shape)
+      print("outputs data shape:",outputs.shape)
 
-  # normalize OUTPUTS
-  outputNormalization = featNorm(outputs)
-  outputs_norm = torch.FloatTensor(outputNormalization[0])
+  # thread pools/affinity before any torch work
+  print("threads:", threads_config.configure(threads,
+                                             interop_threads,
+                                             cpus,
+                                             task='train',
+                                             key=threads_config.shape_key(input_cols, output_cols)))
 
-  outputs_mean = torch.FloatTensor(outputNormalization[1])
-  outputs_mean = outputs_mean.reshape(1,outputs_mean.shape[0])
+  checkpoint_path = os.path.splitext(model_pt)[0]+'_checkpoint.pt'
 
-  outputs_std = torch.FloatTensor(outputNormalization[2])
-  outputs_std = outputs_std.reshape(1,outputs_std.shape[0])
+  t_train = time.time()
+  if stream:
+    metrics = metrics_log.MetricsLogger(metrics_path, append=resume)
 
-  # init model
-  model = nn.Sequential(nn.Linear(inputs.shape[1], neuron_num),
-                        nn.Tanh(),
-                        nn.Linear(neuron_num, neuron_num),
-                        nn.Tanh(),
-                        nn.Linear(neuron_num, outputs.shape[1]))
+    # normalization stats from a first streaming pass
+    with profiling.stage(profiler, 'normalize'):
+      inputNormalization = shards.shard_stats(input_paths)
+      outputNormalization = shards.shard_stats(output_paths)
+    stats = [torch.FloatTensor(stat).reshape(1,-1) for stat in inputNormalization[:2]+outputNormalization[:2]]
+    metrics.write('prepare',
+                  rows=row_num,
+                  input_cols=input_cols,
+                  output_cols=output_cols,
+                  shards=len(input_paths),
+                  normalize_s=time.time() - t_train)
 
-  # init optimizer
-  optimizer = torch.optim.Adam(model.parameters(),
-                               lr=learning_rate)
+    # init model
+    if seed is not None:
+      torch.manual_seed(seed)
+    model = make_net(input_cols, output_cols, neuron_num)
 
-  # init loss function
-  loss_func = nn.MSELoss()
+    # init optimizer
+    optimizer = torch.optim.Adam(model.parameters(),
+                                 lr=learning_rate)
 
-  # run fit on model
-  train_loss, val_loss = fit(model,
-                             inputs_norm,
-                             outputs_norm,
-                             loss_func,
-                             optimizer,
-                             epochs=epochs,
-                             validation_split=validation_split)
+    # init loss function
+    loss_func = nn.MSELoss()
+
+    # run fit on model
+    train_loss, val_loss = fit_shards(model,
+                                      input_paths,
+                                      output_paths,
+                                      tuple(stats),
+                                      loss_func,
+                                      optimizer,
+                                      epochs=epochs,
+                                      validation_split=validation_split,
+                                      batch_size=batch_size,
+                                      num_workers=num_workers,
+                                      prefetch_size=prefetch,
+                                      patience=patience,
+                                      checkpoint_path=checkpoint_path,
+                                      checkpoint_every=checkpoint_every,
+                                      resume=resume,
+                                      precision=precision,
+                                      metrics=metrics,
+                                      profiler=profiler)
+    metrics.close()
+    bundle = infer_model.ModelBundle(model, *stats, train_loss=train_loss, val_loss=val_loss)
+  else:
+    # normalize, fit and fold the PCA bases in process (see train)
+    bundle = train(inputs,
+                   outputs,
+                   neuron_num=neuron_num,
+                   learning_rate=learning_rate,
+                   epochs=epochs,
+                   validation_split=validation_split,
+                   batch_size=batch_size,
+                   num_workers=num_workers,
+                   patience=patience,
+                   precision=precision,
+                   seed=seed,
+                   pca_inputs=pca_inputs,
+                   pca_outputs=pca_outputs,
+                   checkpoint_path=checkpoint_path,
+                   checkpoint_every=checkpoint_every,
+                   resume=resume,
+                   metrics_path=metrics_path,
+                   profiler=profiler)
+
+  # save model and the normalized parameters (mean and std) for inference use
+  t_save = time.time()
+  timing.add('train', t_save - t_train)
+  with timing.span('file write'):
+    bundle.save(**model_paths)
+
+  # keep the build for identical future runs
+  if cache_key:
+    with timing.span('cache store'):
+      cache.store(cache_key, cache_artifacts, params)
+
+  t_artifacts = time.time()
+  with timing.span('export'):
+    write_inference_artifacts(bundle.model,
+                              bundle.stats,
+                              model_paths,
+                              sample_m,
+                              quantize_int8=quantize_int8,
+                              export=export,
+                              export_report=export_report)
 
-  # save model
-  torch.save(model,model_pt)
+  # where the build time went, after the per epoch records
+  metrics = metrics_log.MetricsLogger(metrics_path, append=True)
+  metrics.write('build',
+                cache_hit=False,
+                load_s=t_train - t_load,
+                train_s=t_save - t_train,
+                save_s=t_artifacts - t_save,
+                artifacts_s=time.time() - t_artifacts,
+                total_s=time.time() - start_time)
+  metrics.close()
 
-  # save the normalized parameters (mean and std) for inference use
-  np.savetxt(inputs_mean_m, inputs_mean)
-  np.savetxt(inputs_std_m, inputs_std)
-  np.savetxt(outputs_mean_m, outputs_mean)
-  np.savetxt(outputs_std_m, outputs_std)
+  # stage times for the Maya UI report
+  timing.save_env('build_model')
 
   # end timer
   seconds = time.time() - start_time
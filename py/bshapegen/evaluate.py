@@ -0,0 +1,139 @@
+'''
+Prediction accuracy report from pose and predicted vertex rows.
+
+Works on exported arrays (no Maya), so models can be scored offline/in CI:
+
+  python py/bshapegen/evaluate.py pose_data.npy predict_output_data.npy --out report.json
+
+Errors are xyz distances per vertex, all shapes are scored in one
+vectorized pass. Per shape: mean/max/sum and percentile error plus the
+indices of the worst vertices.
+'''
+import os
+import sys
+import csv
+import json
+import click
+import numpy as np
+
+# allow running as a script (python evaluate.py) as well as a module
+if __package__ in (None, ''):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bshapegen.vtx_io as vtx_io
+
+PERCENTILES = [50, 90, 99]
+
+
+def vertex_errors(y_pred, y_true):
+  '''xyz distance per vertex of (rows, vtx*3) data, Returns (rows, vtx)'''
+  y_pred = np.asarray(y_pred, dtype=np.float64)
+  y_true = np.asarray(y_true, dtype=np.float64)
+  if y_pred.shape != y_true.shape:
+    raise ValueError('Shape mismatch: predicted %s != pose %s' % (y_pred.shape, y_true.shape))
+  diff = (y_pred - y_true).reshape(len(y_true), -1, 3)
+  return np.sqrt((diff**2).sum(axis=-1))
+
+
+def shape_stats(errors, percentiles=PERCENTILES, worst=5):
+  '''
+  per shape stats of (shapes, vtx) errors, all shapes at once
+  Returns dict of arrays, one value (or row for the worst) per shape
+  '''
+  errors = np.atleast_2d(errors)
+  worst = min(worst, errors.shape[1])
+  # unordered top-k then sorted, worst first
+  worst_ids = np.argpartition(errors, -worst, axis=1)[:, -worst:] if worst else np.empty((len(errors), 0), int)
+  worst_errors = np.take_along_axis(errors, worst_ids, axis=1)
+  order = np.argsort(-worst_errors, axis=1)
+
+  stats = {'mean':errors.mean(axis=1),
+           'max':errors.max(axis=1),
+           'sum':errors.sum(axis=1),
+           'worst_vertices':np.take_along_axis(worst_ids, order, axis=1),
+           'worst_errors':np.take_along_axis(worst_errors, order, axis=1)}
+  for p, values in zip(percentiles, np.percentile(errors, percentiles, axis=1)):
+    stats['p%g' % p] = values
+  return stats
+
+
+def make_report(y_pred, y_true, names=None, percentiles=PERCENTILES, worst=5):
+  '''
+  Returns dict {'summary':{...}, 'shapes':[{name, mean, max, ...}, ...]}
+  '''
+  errors = vertex_errors(y_pred, y_true)
+  stats = shape_stats(errors, percentiles, worst)
+  names = names or ['shape_%d' % i for i in range(len(errors))]
+  if len(names) != len(errors):
+    raise ValueError('%d names for %d shapes' % (len(names), len(errors)))
+
+  shapes = []
+  for i, name in enumerate(names):
+    shape = {'name':name}
+    for key, values in stats.items():
+      shape[key] = values[i].tolist()
+    shapes.append(shape)
+
+  summary = {'shapes':len(errors),
+             'vertices':errors.shape[1],
+             'mean':float(errors.mean()) if errors.size else 0.0,
+             'max':float(errors.max()) if errors.size else 0.0,
+             'sum':float(errors.sum())}
+  if errors.size:
+    for p, value in zip(percentiles, np.percentile(errors, percentiles)):
+      summary['p%g' % p] = float(value)
+  return {'summary':summary, 'shapes':shapes}
+
+
+def write_report(report={}, path=''):
+  '''.csv writes one row per shape, anything else json'''
+  if os.path.splitext(path)[1].lower() == '.csv':
+    with open(path, 'w', newline='') as fp:
+      fields = list(report['shapes'][0].keys()) if report['shapes'] else ['name']
+      writer = csv.DictWriter(fp, fieldnames=fields)
+      writer.writeheader()
+      for shape in report['shapes']:
+        writer.writerow({k:(' '.join(str(v) for v in value) if isinstance(value, list) else value)
+                         for k, value in shape.items()})
+  else:
+    with open(path, 'w') as fp:
+      json.dump(report, fp, indent=2)
+  print('Saved:', path)
+
+
+@click.command()
+@click.argument('pose_data_m', type=click.Path(exists=True))
+@click.argument('predict_data_m', type=click.Path(exists=True))
+@click.option('--names', default='', help='text file with one shape name per line')
+@click.option('--out', 'out_paths', multiple=True, default=['evaluate_report.json'],
+              help='.json or .csv report (repeatable)')
+@click.option('--percentile', 'percentiles', multiple=True, type=float, default=PERCENTILES,
+              help='error percentiles per shape (repeatable)')
+@click.option('--worst', default=5, help='worst vertex indices per shape')
+def evaluate(pose_data_m='',
+             predict_data_m='',
+             names='',
+             out_paths=['evaluate_report.json'],
+             percentiles=PERCENTILES,
+             worst=5):
+  '''
+  Score PREDICT_DATA_M against POSE_DATA_M (.npy/.m, one shape per row)
+  '''
+  y_true = vtx_io.load_vtx(pose_data_m)
+  y_pred = vtx_io.load_vtx(predict_data_m)
+  y_true = y_true.reshape(-1, y_true.shape[-1])
+  y_pred = y_pred.reshape(-1, y_pred.shape[-1])
+
+  name_list = None
+  if names:
+    with open(names, 'r') as fp:
+      name_list = [line.strip() for line in fp if line.strip()]
+
+  report = make_report(y_pred, y_true, names=name_list, percentiles=list(percentiles), worst=worst)
+  print(' '.join('[%s: %g]' % item for item in report['summary'].items()))
+  for path in out_paths:
+    write_report(report, path)
+
+
+if __name__ == '__main__':
+  evaluate()
@@ -0,0 +1,108 @@
+'''
+Incremental export of training data rows (one row per mesh).
+
+A manifest next to the .npy data file (model_input_data.npy.manifest.json)
+records mesh name -> content hash -> row offset. On the next export every
+mesh is read once in bulk (see mesh_backend.py) and hashed. When the mesh
+list is the same, only the rows of changed meshes are patched in place in
+the memory-mapped file. New, removed or reordered meshes rewrite the file
+in mesh list order, so removed rows are compacted out and the input and
+output files keep their row pairing. Text (.m) files are always rewritten.
+'''
+import os
+import json
+import hashlib
+import numpy as np
+
+import bshapegen.timing as timing
+import bshapegen.vtx_io as vtx_io
+
+MANIFEST_EXT = '.manifest.json'
+MANIFEST_VERSION = 1
+
+
+def manifest_path(data_path=''):
+  return data_path + MANIFEST_EXT
+
+
+def row_hash(row):
+  return hashlib.sha1(np.ascontiguousarray(row, dtype='<f4').tobytes()).hexdigest()
+
+
+def _file_state(data_path=''):
+  st = os.stat(data_path)
+  return {'data_mtime_ns':st.st_mtime_ns, 'data_size':st.st_size}
+
+
+def load_manifest(data_path=''):
+  '''
+  manifest of data_path, None when missing, stale or the data file was
+  changed by something else since it was written
+  '''
+  path = manifest_path(data_path)
+  if not (os.path.exists(path) and os.path.exists(data_path)):
+    return None
+  with open(path, 'r') as fp:
+    manifest = json.load(fp)
+  if manifest.get('version') != MANIFEST_VERSION:
+    return None
+  if {k:manifest.get(k) for k in ['data_mtime_ns', 'data_size']} != _file_state(data_path):
+    return None
+  return manifest
+
+
+def write_manifest(data_path='', names=[], hashes=[], cols=0):
+  manifest = {'version':MANIFEST_VERSION,
+              'cols':cols,
+              'meshes':[{'name':name, 'hash':h, 'row':i} for i, (name, h) in enumerate(zip(names, hashes))]}
+  manifest.update(_file_state(data_path))
+  with open(manifest_path(data_path), 'w') as fp:
+    json.dump(manifest, fp, indent=2)
+
+
+def export_rows(data_path='', mesh_list=[], backend=None):
+  '''
+  write one row of points per mesh in mesh_list to data_path, only
+  patching the rows that changed since the last export
+  Returns dict of mesh counts {'unchanged', 'changed', 'added', 'removed'}
+  and 'rewritten' (True if the whole file was written)
+  '''
+  with timing.span('vertex read'):
+    rows = [backend.get_points(mesh).reshape(-1) for mesh in mesh_list]
+  hashes = [row_hash(row) for row in rows]
+  cols = len(rows[0]) if rows else 0
+
+  manifest = load_manifest(data_path) if vtx_io.is_binary(data_path) else None
+  old = {}
+  old_names = []
+  if manifest and manifest['cols'] == cols:
+    old_names = [mesh['name'] for mesh in manifest['meshes']]
+    old = {mesh['name']:mesh['hash'] for mesh in manifest['meshes']}
+
+  stats = {'unchanged':sum(1 for name, h in zip(mesh_list, hashes) if old.get(name) == h),
+           'changed':sum(1 for name, h in zip(mesh_list, hashes) if name in old and old[name] != h),
+           'added':sum(1 for name in mesh_list if name not in old),
+           'removed':sum(1 for name in old_names if name not in set(mesh_list)),
+           'rewritten':False}
+
+  # the manifest is removed while the data changes, an interrupted export
+  # is then a full rewrite instead of trusting stale hashes
+  if os.path.exists(manifest_path(data_path)):
+    os.remove(manifest_path(data_path))
+
+  with timing.span('file write'):
+    if old_names and old_names == list(mesh_list):
+      changed_ids = [i for i, (name, h) in enumerate(zip(mesh_list, hashes)) if old[name] != h]
+      if changed_ids:
+        data = np.load(data_path, mmap_mode='r+')
+        for i in changed_ids:
+          data[i] = rows[i]
+        data.flush()
+        del data
+    else:
+      vtx_io.write_vtx(data_path, np.stack(rows) if rows else np.empty((0, 0), dtype=np.float32))
+      stats['rewritten'] = True
+
+    if vtx_io.is_binary(data_path):
+      write_manifest(data_path, mesh_list, hashes, cols)
+  return stats
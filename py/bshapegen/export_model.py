@@ -0,0 +1,193 @@
+'''
+Export trained models for fast cold-start inference (see lean_infer.py).
+
+Artifacts are written next to model.pt and include the normalization
+stats, so they map raw neutral rows to raw pose rows:
+  torchscript - model.ts   (frozen TorchScript)
+  onnx        - model.onnx (needs the onnx package to export)
+  numpy       - model.npz  (layer weights for numpy matmuls, no torch)
+'''
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import numpy as np
+import torch
+import torch.nn as nn
+
+import bshapegen.norm_stats as norm_stats
+
+EXPORT_EXT = {'torchscript':'.ts',
+              'onnx':'.onnx',
+              'numpy':'.npz'}
+EXPORT_FORMATS = list(EXPORT_EXT.keys())
+
+# python path that makes bshapegen importable in report subprocesses
+PY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class NormModel(nn.Module):
+  '''model wrapped with its input normalization and output denormalization'''
+  def __init__(self, model, inputs_mean, inputs_std, outputs_mean, outputs_std):
+    super(NormModel, self).__init__()
+    self.model = model
+    self.register_buffer('inputs_mean', inputs_mean.reshape(1,-1).float())
+    self.register_buffer('inputs_std', inputs_std.reshape(1,-1).float())
+    self.register_buffer('outputs_mean', outputs_mean.reshape(1,-1).float())
+    self.register_buffer('outputs_std', outputs_std.reshape(1,-1).float())
+
+
+  def forward(self, x):
+    x = norm_stats.normalize(x, self.inputs_mean, self.inputs_std)
+    return norm_stats.denormalize(self.model(x), self.outputs_mean, self.outputs_std)
+
+
+def artifact_path(model_pt='', fmt='numpy'):
+  return os.path.splitext(model_pt)[0] + EXPORT_EXT[fmt]
+
+
+def export_numpy(model, stats, path=''):
+  '''layer kinds, transposed weights, biases and stats as .npz'''
+  arrays = {}
+  kinds = []
+  for i, layer in enumerate(model):
+    if isinstance(layer, nn.Linear):
+      kinds.append('linear')
+      arrays['weight_%03d' % i] = np.ascontiguousarray(layer.weight.detach().numpy().T)
+      # PCA projection layers have no bias
+      arrays['bias_%03d' % i] = (layer.bias.detach().numpy() if layer.bias is not None
+                                 else np.zeros(layer.out_features, dtype=np.float32))
+    elif isinstance(layer, nn.Tanh):
+      kinds.append('tanh')
+    else:
+      raise ValueError('Layer not supported by the numpy runtime: %s' % layer)
+
+  for name, stat in zip(['inputs_mean', 'inputs_std', 'outputs_mean', 'outputs_std'], stats):
+    arrays[name] = np.asarray(stat, dtype=np.float32).reshape(1,-1)
+
+  np.savez(path, kinds=np.array(kinds), **arrays)
+
+
+def export_torchscript(norm_model, input_cols=0, path=''):
+  example = torch.zeros((1, input_cols))
+  with torch.no_grad():
+    traced = torch.jit.trace(norm_model, example)
+  torch.jit.save(torch.jit.freeze(traced.eval()), path)
+
+
+def export_onnx(norm_model, input_cols=0, path=''):
+  example = torch.zeros((1, input_cols))
+  kwargs = {}
+  # newer torch defaults to the dynamo exporter, keep the plain tracer
+  if 'dynamo' in torch.onnx.export.__code__.co_varnames:
+    kwargs['dynamo'] = False
+  torch.onnx.export(norm_model,
+                    example,
+                    path,
+                    input_names=['inputs'],
+                    output_names=['outputs'],
+                    dynamic_axes={'inputs':{0:'rows'}, 'outputs':{0:'rows'}},
+                    **kwargs)
+
+
+def export_model(model, stats, model_pt='', formats=[]):
+  '''
+  write the requested artifacts next to model_pt
+  stats is (inputs_mean, inputs_std, outputs_mean, outputs_std) tensors
+  Returns dict {format: path} of the written artifacts
+  '''
+  model.eval()
+  norm_model = NormModel(model, *stats).eval()
+  input_cols = stats[0].numel()
+
+  artifacts = {}
+  for fmt in formats:
+    path = artifact_path(model_pt, fmt)
+    try:
+      if fmt == 'numpy':
+        export_numpy(model, [stat.numpy() for stat in stats], path)
+      elif fmt == 'torchscript':
+        export_torchscript(norm_model, input_cols, path)
+      elif fmt == 'onnx':
+        export_onnx(norm_model, input_cols, path)
+      else:
+        raise ValueError('Unknown export format: %s' % fmt)
+    except Exception as e:
+      print('Export %s Failed! %s' % (fmt, e))
+      continue
+    artifacts[fmt] = path
+    print('Exported:', path)
+  return artifacts
+
+
+def _cold_start_code(runtime='', paths={}, sample_npy=''):
+  '''python code that imports, loads and predicts sample_npy once'''
+  if runtime == 'pickle':
+    return ('import numpy as np\n'
+            'import bshapegen.infer_model as infer_model\n'
+            'stats = infer_model.load_stats(%r, %r, %r, %r)\n'
+            'model = infer_model.load_model(%r)\n'
+            'infer_model.run_model(model, np.load(%r), *stats)\n'
+            % (paths['inputs_mean_m'], paths['inputs_std_m'],
+               paths['outputs_mean_m'], paths['outputs_std_m'],
+               paths['model_pt'], sample_npy))
+  return ('import numpy as np\n'
+          'import bshapegen.lean_infer as lean_infer\n'
+          'lean_infer.load_runtime(%r).predict(np.load(%r))\n'
+          % (paths[runtime], sample_npy))
+
+
+def latency_report(artifacts={}, model_paths={}, sample=None, calls=20):
+  '''
+  cold start (new python process: imports + load + first predict) and
+  median per-call latency of every runtime against the pickled model.pt
+  path used by infer_model
+  model_paths is utils.model_paths() of the pickled model
+  Returns dict {runtime: {'cold_start_s', 'per_call_ms', 'max_abs_diff'}}
+  '''
+  import bshapegen.lean_infer as lean_infer
+  import bshapegen.infer_model as infer_model
+
+  sample = np.asarray(sample, dtype=np.float32).reshape(1,-1)
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join([PY_DIR, env.get('PYTHONPATH', '')])
+
+  stats = infer_model.load_stats(model_paths['inputs_mean_m'],
+                                 model_paths['inputs_std_m'],
+                                 model_paths['outputs_mean_m'],
+                                 model_paths['outputs_std_m'])
+  model = infer_model.load_model(model_paths['model_pt'])
+  baseline = infer_model.run_model(model, sample, *stats)
+
+  runtimes = {'pickle':lambda x: infer_model.run_model(model, x, *stats)}
+  for fmt, path in artifacts.items():
+    runtimes[fmt] = lean_infer.load_runtime(path).predict
+
+  paths = dict(model_paths, **artifacts)
+  report = {}
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    sample_npy = os.path.join(tmp_dir, 'sample.npy')
+    np.save(sample_npy, sample)
+
+    for runtime, run in runtimes.items():
+      start_time = time.time()
+      subprocess.check_call([sys.executable, '-c', _cold_start_code(runtime, paths, sample_npy)], env=env)
+      cold_start = time.time() - start_time
+
+      run(sample) # warm up
+      timings = []
+      for i in range(calls):
+        start_time = time.perf_counter()
+        y_pred = run(sample)
+        timings.append(time.perf_counter() - start_time)
+
+      report[runtime] = {'cold_start_s':cold_start,
+                         'per_call_ms':float(np.median(timings))*1000.0,
+                         'max_abs_diff':float(np.abs(np.asarray(y_pred) - baseline).max())}
+      print('[%s] [cold start: %0.3fs] [per call: %0.3fms] [max abs diff: %g]'
+            % (runtime,
+               report[runtime]['cold_start_s'],
+               report[runtime]['per_call_ms'],
+               report[runtime]['max_abs_diff']))
+  return report
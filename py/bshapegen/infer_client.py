@@ -0,0 +1,115 @@
+'''
+Client for the bshapegen inference server (infer_server.py).
+
+Only uses the standard library so it can be imported inside Maya.
+
+Messages are a 4 byte big-endian header length, a json header and an
+optional little-endian float32 payload of header['nbytes'] bytes.
+'''
+import os
+import json
+import socket
+import struct
+
+import bshapegen.vtx_io as vtx_io
+
+DEFAULT_HOST = os.environ.get('BSG_INFER_HOST', '127.0.0.1')
+DEFAULT_PORT = int(os.environ.get('BSG_INFER_PORT', 50571))
+
+
+def _recv_exact(sock, size=0):
+  buf = bytearray()
+  while len(buf) < size:
+    chunk = sock.recv(min(size - len(buf), 1 << 20))
+    if not chunk:
+      raise ConnectionError('Connection closed by peer')
+    buf.extend(chunk)
+  return bytes(buf)
+
+
+def send_msg(sock, header={}, payload=b''):
+  '''send a json header and optional binary payload'''
+  header = dict(header)
+  header['nbytes'] = len(payload)
+  header_bytes = json.dumps(header).encode('utf-8')
+  sock.sendall(struct.pack('>I', len(header_bytes)) + header_bytes)
+  if payload:
+    sock.sendall(payload)
+
+
+def recv_msg(sock):
+  '''
+  receive a message
+  Returns tuple (header, payload) or (None, b'') if the peer closed
+  '''
+  head = sock.recv(4)
+  if not head:
+    return None, b''
+  if len(head) < 4:
+    head += _recv_exact(sock, 4 - len(head))
+  header_len = struct.unpack('>I', head)[0]
+  header = json.loads(_recv_exact(sock, header_len).decode('utf-8'))
+  payload = _recv_exact(sock, header.get('nbytes', 0))
+  return header, payload
+
+
+class InferClient(object):
+  def __init__(self,
+               host=DEFAULT_HOST,
+               port=DEFAULT_PORT,
+               timeout=600.0):
+    self.host = host
+    self.port = port
+    self.timeout = timeout
+
+
+  def request(self, header={}, payload=b''):
+    '''send one request and return (header, payload) of the reply'''
+    with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+      send_msg(sock, header, payload)
+      reply, reply_payload = recv_msg(sock)
+
+    if reply is None:
+      raise ConnectionError('No reply from inference server')
+    if reply.get('status') != 'ok':
+      raise RuntimeError('Inference server error: %s' % reply.get('error'))
+    return reply, reply_payload
+
+
+  def health(self):
+    '''Returns the server status dict (loaded model, uptime, requests)'''
+    return self.request({'cmd':'health'})[0]
+
+
+  def reload(self, **paths):
+    '''
+    (re)load model and stats, uses the currently loaded paths if none given
+    '''
+    return self.request({'cmd':'reload', 'model':paths})[0]
+
+
+  def predict(self, data=[], **paths):
+    '''
+    predict rows of vertex values (list of rows or numpy array)
+    paths (see utils.model_paths) switch the server to another model if needed
+    Returns a list of rows of floats
+    '''
+    shape, payload = vtx_io.to_bytes(data)
+    header = {'cmd':'predict', 'shape':list(shape)}
+    if paths:
+      header['model'] = paths
+    reply, reply_payload = self.request(header, payload)
+    return vtx_io.from_bytes(reply_payload, reply['shape'])
+
+
+  def shutdown(self):
+    return self.request({'cmd':'shutdown'})[0]
+
+
+def is_running(host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=0.5):
+  '''True if an inference server answers health requests'''
+  try:
+    InferClient(host=host, port=port, timeout=timeout).health()
+  except (OSError, RuntimeError, ValueError):
+    return False
+  return True
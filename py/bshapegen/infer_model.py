@@ -1,90 +1,360 @@
+import os
+import sys
+import glob
 import numpy as np
 import torch.nn as nn
 import torch
 import click
 import time
 
+# allow running as a script (python infer_model.py) as well as a module
+if __package__ in (None, ''):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bshapegen.pca as pca
+import bshapegen.timing as timing
+import bshapegen.vtx_io as vtx_io
+import bshapegen.quantize as quantize
+import bshapegen.profiling as profiling
+import bshapegen.threads as threads_config
+import bshapegen.norm_stats as norm_stats
+
 
 def pred_featNorm(features, mean, std):
   '''
   Normalize features by mean and standard deviation.
   Returns normalizedFeatures
   '''
-  feats_norm = (features - mean) / (std + np.finfo(np.float32).eps)
-  return feats_norm
+  return norm_stats.normalize(features, mean, std)
 
 
 def pred_featDenorm(features_norm, mean, std):
   '''
   Denormalize features by mean and standard deviation
   '''
-  features = (features_norm * std) + mean
-  return features
+  return norm_stats.denormalize(features_norm, mean, std)
+
+
+def load_stats(inputs_mean_m='',
+               inputs_std_m='',
+               outputs_mean_m='',
+               outputs_std_m=''):
+  '''
+  Load normalized mean and std data.
+  Returns tuple of (1,N) FloatTensors
+  (inputs_mean, inputs_std, outputs_mean, outputs_std)
+  '''
+  stats = []
+  for m_path in [inputs_mean_m, inputs_std_m, outputs_mean_m, outputs_std_m]:
+    stat = torch.FloatTensor(vtx_io.load_vtx(m_path, mmap=False))
+    stats.append(stat.reshape(1,-1))
+  return tuple(stats)
+
+
+def load_model(model_pt=''):
+  '''
+  Load a saved model (pickled nn.Sequential, not just weights) for inference
+  '''
+  model = torch.load(model_pt, weights_only=False)
+  model.eval()
+  return model
+
+
+def as_tensor(data):
+  '''
+  float32 tensor of data, sharing memory (torch.from_numpy) when data is
+  already a writable C-contiguous float32 array, otherwise a float32 copy
+  (ie. read-only memory-mapped rows or float64 arrays)
+  '''
+  if torch.is_tensor(data):
+    return data.float()
+  if not (isinstance(data, np.ndarray)
+          and data.dtype == np.float32
+          and data.flags.c_contiguous
+          and data.flags.writeable):
+    data = np.array(data, dtype=np.float32)
+  return torch.from_numpy(data)
+
+
+def run_model(model,
+              predict_data,
+              inputs_mean,
+              inputs_std,
+              outputs_mean,
+              outputs_std,
+              chunk_size=0,
+              profiler=None):
+  '''
+  Normalize predict_data, infer and denormalize the result.
+  Rows run through the model chunk_size at a time (0 = all at once)
+  to cap memory, profiler (profiling.Profiler, started by the caller) steps
+  once per chunk. Returns numpy array of predicted rows
+  '''
+  if torch.is_tensor(predict_data):
+    predict_data = predict_data.numpy()
+  elif not hasattr(predict_data, 'shape'):
+    predict_data = np.asarray(predict_data, dtype=np.float32)
+  predict_data = predict_data.reshape(-1,predict_data.shape[-1])
+
+  row_num = len(predict_data)
+  chunk_size = chunk_size or max(row_num, 1)
+
+  y_pred_denorm_np = np.empty((row_num, outputs_mean.shape[-1]), dtype=np.float32)
+
+  with torch.no_grad():
+    for i in range(0, row_num, chunk_size):
+      # in-memory float32 rows are shared, memory-mapped rows are copied one chunk at a time
+      chunk = as_tensor(predict_data[i:i+chunk_size])
+
+      # normalize predict input data
+      predict_inputs_norm = pred_featNorm(chunk, 
+                                          inputs_mean, 
+                                          inputs_std)
+
+      # infer/predict output
+      y_pred = model(predict_inputs_norm)
+
+      # denormalize predict output
+      y_pred_denorm = pred_featDenorm(y_pred,
+                                      outputs_mean,
+                                      outputs_std)
+
+      y_pred_denorm_np[i:i+len(chunk)] = y_pred_denorm.numpy()
+      if profiler:
+        profiler.step()
+
+  return y_pred_denorm_np
+
+
+class ModelBundle(object):
+  '''
+  A trained model with its normalization stats, predicting raw
+  (unnormalized) rows in process, without temp files or a subprocess:
+
+    bundle = ModelBundle.load(model_pt, inputs_mean_m, inputs_std_m, outputs_mean_m, outputs_std_m)
+    predicted = bundle.predict(neutral_rows)
+
+  build_model.train() returns one, bundle.save() writes the same files as
+  make_model.
+  '''
+  def __init__(self,
+               model,
+               inputs_mean,
+               inputs_std,
+               outputs_mean,
+               outputs_std,
+               bases=None,
+               train_loss=[],
+               val_loss=[]):
+    self.model = model
+    self.model.eval()
+    # (1,N) float32 tensors
+    self.stats = tuple(torch.as_tensor(stat, dtype=torch.float32).reshape(1,-1)
+                       for stat in [inputs_mean, inputs_std, outputs_mean, outputs_std])
+    # (inputs_basis, outputs_basis) when trained with PCA (already folded into model)
+    self.bases = bases
+    self.train_loss = list(train_loss)
+    self.val_loss = list(val_loss)
+
+
+  @classmethod
+  def load(cls,
+           model_pt='',
+           inputs_mean_m='',
+           inputs_std_m='',
+           outputs_mean_m='',
+           outputs_std_m='',
+           quantize_int8=False):
+    '''
+    bundle of saved files (ModelBundle.load(**utils.model_paths(...))),
+    quantize_int8 quantizes the model at load time (see quantize.py)
+    '''
+    model = load_model(model_pt)
+    if quantize_int8:
+      model = quantize.quantize_model(model)
+    return cls(model, *load_stats(inputs_mean_m, inputs_std_m, outputs_mean_m, outputs_std_m))
+
+
+  @property
+  def input_cols(self):
+    return self.stats[0].shape[-1]
+
+
+  @property
+  def output_cols(self):
+    return self.stats[2].shape[-1]
+
+
+  def predict(self, predict_data, chunk_size=0, profiler=None):
+    '''
+    predicted rows for (rows, input_cols) or single row data, numpy arrays
+    and tensors are passed to torch without a copy (see as_tensor).
+    profiler (profiling.Profiler) records the forward passes, one step per chunk
+    Returns (rows, output_cols) float32 numpy array
+    '''
+    if not profiler:
+      return run_model(self.model, predict_data, *self.stats, chunk_size=chunk_size)
+    profiler.start()
+    try:
+      return run_model(self.model, predict_data, *self.stats, chunk_size=chunk_size, profiler=profiler)
+    finally:
+      profiler.stop()
+
+
+  def quantized(self):
+    '''bundle with a dynamic int8 copy of the model (see quantize.py)'''
+    return ModelBundle(quantize.quantize_model(self.model), *self.stats)
+
+
+  def save(self,
+           model_pt='',
+           inputs_mean_m='',
+           inputs_std_m='',
+           outputs_mean_m='',
+           outputs_std_m=''):
+    '''
+    write model_pt and the stats (.npy/.m), the PCA bases (if any) to
+    <model>_pca.npz
+    '''
+    torch.save(self.model, model_pt)
+    for m_path, stat in zip([inputs_mean_m, inputs_std_m, outputs_mean_m, outputs_std_m], self.stats):
+      vtx_io.write_vtx(m_path, stat.numpy())
+    if self.bases is not None:
+      pca.save_basis(os.path.splitext(model_pt)[0]+'_pca.npz', *self.bases)
+
+
+def input_paths(predict_input_data_m=''):
+  '''
+  Expand comma separated paths and glob patterns (sorted per pattern).
+  Returns list of input file paths
+  '''
+  path_list = []
+  for pattern in predict_input_data_m.split(','):
+    pattern = pattern.strip()
+    if not pattern:
+      continue
+    if glob.has_magic(pattern):
+      path_list.extend(sorted(glob.glob(pattern)))
+    else:
+      path_list.append(pattern)
+
+  missing = [path for path in path_list if not os.path.exists(path)]
+  if missing:
+    raise click.BadParameter('Input files not found: %s' % ', '.join(missing))
+  if not path_list:
+    raise click.BadParameter('No input files match: %s' % predict_input_data_m)
+  return path_list
 
 
 @click.command()
 @click.argument('model_pt',  type=click.Path(exists=True))
-@click.argument('predict_input_data_m', type=click.Path(exists=True))
+@click.argument('predict_input_data_m', type=click.Path(exists=False))
 @click.argument('inputs_mean_m', type=click.Path(exists=True))
 @click.argument('inputs_std_m', type=click.Path(exists=True))
 @click.argument('outputs_mean_m', type=click.Path(exists=True))
 @click.argument('outputs_std_m', type=click.Path(exists=True))
 @click.argument('predict_output_data_m', type=click.Path(exists=False))
+@click.option('--chunk_size', default=256, help='rows per forward pass, 0 = all at once')
+@click.option('--threads', default=0, help='torch intra-op threads, 0 = $BSG_THREADS, autotuned or torch default')
+@click.option('--interop_threads', default=0, help='torch inter-op threads, 0 = $BSG_INTEROP_THREADS, autotuned or torch default')
+@click.option('--cpus', default='', help='cpu affinity, ie. 0-3,8 (or $BSG_CPUS)')
+@click.option('--quantize', 'quantize_int8', is_flag=True, help='dynamic int8 quantization of the Linear layers (see quantize.py)')
+@click.option('--profile', is_flag=True, help='torch.profiler trace/op table of the forward passes and cProfile of loading, as <model>_predict_profile_*')
+@click.option('--profile_wait', default=0, help='forward passes (chunks) skipped before profiling')
+@click.option('--profile_warmup', default=1, help='profiled forward passes discarded as warmup')
+@click.option('--profile_active', default=5, help='profiled forward passes recorded')
+@click.option('--profile_top', default=20, help='rows of the operator/function tables')
 def predict(model_pt='',
             predict_input_data_m='',
             inputs_mean_m='',
             inputs_std_m='',
             outputs_mean_m='',
             outputs_std_m='',
-            predict_output_data_m=''):
+            predict_output_data_m='',
+            chunk_size=256,
+            threads=0,
+            interop_threads=0,
+            cpus='',
+            quantize_int8=False,
+            profile=False,
+            profile_wait=0,
+            profile_warmup=1,
+            profile_active=5,
+            profile_top=20):
+  '''
+  PREDICT_INPUT_DATA_M can be a file, a glob pattern or a comma separated
+  list. All rows of all inputs are predicted in one process and written
+  stacked to PREDICT_OUTPUT_DATA_M, or one result per input if it contains
+  {name} (the input file name without extension).
+  MODEL_PT can also be the <model>_int8.pt written by make_model --quantize.
+  --profile writes a Chrome trace, an operator table and cProfile stats of
+  loading next to MODEL_PT (see profiling.py).
+  '''
   
   # start timer
   start_time = time.time()
 
-  # load model
-  model_path = model_pt
-
-  # load predict input data
-  predict_data_path = predict_input_data_m
+  profiler = None
+  if profile:
+    profiler = profiling.Profiler(os.path.splitext(model_pt)[0]+'_predict_profile',
+                                  wait=profile_wait,
+                                  warmup=profile_warmup,
+                                  active=profile_active,
+                                  top=profile_top)
 
-  # load normalized mean and std data
-  inputs_mean = torch.FloatTensor(np.loadtxt(inputs_mean_m))
-  inputs_mean = inputs_mean.reshape(1,inputs_mean.shape[0])
+  with profiling.stage(profiler, 'load'):
+    # load model and normalized mean and std data
+    with timing.span('model load'):
+      bundle = ModelBundle.load(model_pt,
+                                inputs_mean_m,
+                                inputs_std_m,
+                                outputs_mean_m,
+                                outputs_std_m,
+                                quantize_int8=quantize_int8)
 
-  inputs_std = torch.FloatTensor(np.loadtxt(inputs_std_m))
-  inputs_std = inputs_std.reshape(1,inputs_std.shape[0])
+    threads_config.configure(threads,
+                             interop_threads,
+                             cpus,
+                             task='predict',
+                             key=threads_config.shape_key(bundle.input_cols, bundle.output_cols))
 
-  outputs_mean = torch.FloatTensor(np.loadtxt(outputs_mean_m))
-  outputs_mean = outputs_mean.reshape(1,outputs_mean.shape[0])
-  
-  outputs_std = torch.FloatTensor(np.loadtxt(outputs_std_m))
-  outputs_std = outputs_std.reshape(1,outputs_std.shape[0])
-
-  # load model
-  model = torch.load(model_path)
-  model.eval()
+    path_list = input_paths(predict_input_data_m)
 
-  # load predict input data
-  predict_data = torch.FloatTensor(np.loadtxt(predict_data_path))
+    # load predict input data (.npy files are memory-mapped)
+    with timing.span('file read'):
+      predict_data_list = [vtx_io.load_vtx(path) for path in path_list]
+      predict_data_list = [d.reshape(-1,d.shape[-1]) for d in predict_data_list]
 
-  # normalize predict input data
-  predict_inputs_norm = pred_featNorm(predict_data, 
-                                      inputs_mean, 
-                                      inputs_std)
+  # one profile over all inputs
+  if profiler:
+    profiler.start()
 
-  # infer/predict output
-  y_pred = model(predict_inputs_norm)
+  if '{name}' in predict_output_data_m:
+    # one result per input
+    for path, predict_data in zip(path_list, predict_data_list):
+      with timing.span('forward pass'):
+        y_pred_denorm_np = bundle.predict(predict_data, chunk_size=chunk_size, profiler=profiler)
+      name = os.path.splitext(os.path.basename(path))[0]
+      with timing.span('file write'):
+        vtx_io.write_vtx(predict_output_data_m.format(name=name), y_pred_denorm_np)
+  else:
+    # single stacked result, rows in input order
+    if len(predict_data_list) == 1:
+      predict_data = predict_data_list[0]
+    else:
+      predict_data = np.concatenate(predict_data_list)
+    with timing.span('forward pass'):
+      y_pred_denorm_np = bundle.predict(predict_data, chunk_size=chunk_size, profiler=profiler)
+    with timing.span('file write'):
+      vtx_io.write_vtx(predict_output_data_m, y_pred_denorm_np)
 
-  # denormalize predict output
-  y_pred_denorm = pred_featDenorm(y_pred,
-                                  outputs_mean,
-                                  outputs_std)
+  if profiler:
+    profiler.stop()
 
-  # prep data to write output
-  y_pred_denorm_np = y_pred_denorm.detach().numpy()
+  print('Predicted %d rows from %d inputs' % (sum(len(d) for d in predict_data_list), len(path_list)))
 
-  # write_output
-  np.savetxt(predict_output_data_m,y_pred_denorm_np)
+  # stage times for the Maya UI report
+  timing.save_env('infer_model')
 
   # end timer
   seconds = time.time() - start_time
@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import click
+import socket
+import ipaddress
+import traceback
+import numpy as np
+
+# allow running as a script (python infer_server.py) as well as a module
+if __package__ in (None, ''):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bshapegen.infer_model as infer_model
+import bshapegen.utils as utils
+import bshapegen.infer_client as infer_client
+import bshapegen.model_cache as model_cache
+import bshapegen.threads as threads_config
+
+
+class ModelState(object):
+  '''
+  models and normalization stats kept warm between requests in a
+  model_cache.ModelCache (several rigs at once, within cache_mb)
+  requests without model paths use the last requested model, files that
+  changed on disk are reloaded (cache keys include their mtime or hash)
+  '''
+  def __init__(self, chunk_size=256, cache_mb=2048, cache_key='mtime'):
+    self.chunk_size = chunk_size
+    self.cache = model_cache.ModelCache(max_bytes=int(cache_mb * 1024 * 1024), key=cache_key)
+    self.paths = {}
+    self.model = None
+    self.stats = None
+    self.request_count = 0
+    self.start_time = time.time()
+
+
+  @property
+  def load_count(self):
+    return self.cache.misses
+
+
+  def load(self, paths={}):
+    '''(re)load paths from disk and make them the default model'''
+    paths = utils.model_paths(**paths)
+    self.cache.invalidate(paths['model_pt'])
+    self.ensure(paths)
+
+
+  def ensure(self, paths={}):
+    '''cached model/stats for paths (default: the last requested model)'''
+    if paths:
+      paths = utils.model_paths(**paths)
+    elif self.paths:
+      paths = self.paths
+    else:
+      raise RuntimeError('No model loaded')
+
+    misses = self.cache.misses
+    self.model, self.stats = self.cache.get(**paths)
+    self.paths = paths
+    if self.cache.misses != misses:
+      print('Loaded model:', paths['model_pt'])
+
+
+def handle(state, header, payload):
+  '''
+  run one request
+  Returns tuple (reply_header, reply_payload), reply_header['cmd'] is
+  'shutdown' when the server should stop
+  '''
+  cmd = header.get('cmd')
+  state.request_count += 1
+
+  if cmd == 'health':
+    return {'status':'ok',
+            'pid':os.getpid(),
+            'model':state.paths,
+            'loaded':state.model is not None,
+            'load_count':state.load_count,
+            'cache':state.cache.info(),
+            'requests':state.request_count,
+            'uptime':time.time() - state.start_time}, b''
+
+  if cmd == 'reload':
+    state.load(header.get('model') or state.paths)
+    return {'status':'ok', 'model':state.paths}, b''
+
+  if cmd == 'predict':
+    state.ensure(header.get('model'))
+    predict_data = np.frombuffer(payload, dtype='<f4').reshape(header['shape'])
+    y_pred = infer_model.run_model(state.model,
+                                   predict_data,
+                                   *state.stats,
+                                   chunk_size=header.get('chunk_size', state.chunk_size))
+    return {'status':'ok', 'shape':list(y_pred.shape)}, y_pred.astype('<f4').tobytes()
+
+  if cmd == 'shutdown':
+    return {'status':'ok', 'cmd':'shutdown'}, b''
+
+  return {'status':'error', 'error':'Unknown command: %s' % cmd}, b''
+
+
+def is_loopback(host):
+  '''True when every address host resolves to is a loopback address'''
+  try:
+    infos = socket.getaddrinfo(host, None)
+  except socket.gaierror:
+    return False
+  return bool(infos) and all(ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback for info in infos)
+
+
+def serve_forever(state,
+                  host=infer_client.DEFAULT_HOST,
+                  port=infer_client.DEFAULT_PORT,
+                  idle_timeout=1800):
+  '''
+  answer requests one at a time until shutdown or idle_timeout seconds
+  pass without a request (0 = never time out)
+  only loopback hosts are accepted: clients send model paths that are
+  unpickled with torch.load, so the server must not be reachable from
+  the network
+  '''
+  if not is_loopback(host):
+    raise ValueError('Refusing to listen on non-loopback host: %s' % host)
+
+  server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  server_sock.bind((host, port))
+  server_sock.listen(8)
+  server_sock.settimeout(idle_timeout or None)
+
+  print('Inference server listening on %s:%d' % (host, port))
+
+  running = True
+  try:
+    while running:
+      try:
+        conn, _ = server_sock.accept()
+      except socket.timeout:
+        print('Idle for %ds, shutting down' % idle_timeout)
+        break
+
+      with conn:
+        conn.settimeout(None)
+        while True:
+          try:
+            header, payload = infer_client.recv_msg(conn)
+          except (OSError, ValueError):
+            break
+          if header is None:
+            break
+          try:
+            reply, reply_payload = handle(state, header, payload)
+          except Exception as e:
+            print(traceback.format_exc())
+            reply, reply_payload = {'status':'error', 'error':str(e)}, b''
+          infer_client.send_msg(conn, reply, reply_payload)
+          if reply.get('cmd') == 'shutdown':
+            running = False
+            break
+  finally:
+    server_sock.close()
+
+
+@click.command()
+@click.argument('model_pt',  type=click.Path(exists=True))
+@click.argument('inputs_mean_m', type=click.Path(exists=True))
+@click.argument('inputs_std_m', type=click.Path(exists=True))
+@click.argument('outputs_mean_m', type=click.Path(exists=True))
+@click.argument('outputs_std_m', type=click.Path(exists=True))
+@click.option('--host', default=infer_client.DEFAULT_HOST, help='127.0.0.1 (or $BSG_INFER_HOST), loopback only')
+@click.option('--port', default=infer_client.DEFAULT_PORT, help='50571 (or $BSG_INFER_PORT)')
+@click.option('--idle_timeout', default=1800, help='seconds without requests before exit, 0 = never')
+@click.option('--chunk_size', default=256, help='rows per forward pass, 0 = all at once')
+@click.option('--cache_mb', default=model_cache.DEFAULT_MAX_BYTES / (1024 * 1024), help='memory budget of the loaded models (or $BSG_MODEL_CACHE_MB)')
+@click.option('--cache_key', default='mtime', type=click.Choice(model_cache.KEY_MODES), help='reload on mtime/size change, or by content hash')
+@click.option('--threads', default=0, help='torch intra-op threads, 0 = $BSG_THREADS, autotuned or torch default')
+@click.option('--interop_threads', default=0, help='torch inter-op threads, 0 = $BSG_INTEROP_THREADS, autotuned or torch default')
+@click.option('--cpus', default='', help='cpu affinity, ie. 0-3,8 (or $BSG_CPUS)')
+def serve(model_pt='',
+          inputs_mean_m='',
+          inputs_std_m='',
+          outputs_mean_m='',
+          outputs_std_m='',
+          host=infer_client.DEFAULT_HOST,
+          port=infer_client.DEFAULT_PORT,
+          idle_timeout=1800,
+          chunk_size=256,
+          cache_mb=2048,
+          cache_key='mtime',
+          threads=0,
+          interop_threads=0,
+          cpus=''):
+
+  if not is_loopback(host):
+    raise click.BadParameter('only loopback addresses are allowed (127.0.0.1, localhost)', param_hint='--host')
+
+  # start timer
+  start_time = time.time()
+
+  # stats aren't loaded yet, use the last autotuned predict setting
+  print("threads:", threads_config.configure(threads, interop_threads, cpus, task='predict'))
+
+  # load model and stats once
+  state = ModelState(chunk_size=chunk_size, cache_mb=cache_mb, cache_key=cache_key)
+  state.load(utils.model_paths(model_pt,
+                               inputs_mean_m,
+                               inputs_std_m,
+                               outputs_mean_m,
+                               outputs_std_m))
+
+  serve_forever(state,
+                host=host,
+                port=port,
+                idle_timeout=idle_timeout)
+
+  # end timer
+  seconds = time.time() - start_time
+  m, s = divmod(seconds, 60)
+  h, m = divmod(m, 60)
+  print( "--- infer_server - uptime: %d:%02d:%0.2f ---" % (h, m, s))
+
+
+if __name__ == '__main__':
+  serve()
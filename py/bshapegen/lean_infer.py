@@ -0,0 +1,157 @@
+'''
+Lean inference runtimes for exported models (see export_model.py).
+
+Exported artifacts include the normalization stats, so they take raw
+neutral vertex rows and return raw pose vertex rows. Only numpy is
+imported up front, torch/onnxruntime only when their artifact is loaded.
+  .npz  - plain numpy matmuls, no torch import (smallest cold start)
+  .onnx - onnxruntime
+  .ts   - TorchScript
+'''
+import os
+import sys
+import time
+import click
+import numpy as np
+
+# allow running as a script (python lean_infer.py) as well as a module
+if __package__ in (None, ''):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bshapegen.vtx_io as vtx_io
+
+EPS = np.finfo(np.float32).eps
+
+
+def _rows(predict_data):
+  predict_data = np.asarray(predict_data, dtype=np.float32)
+  return predict_data.reshape(-1,predict_data.shape[-1])
+
+
+def _chunked(run, predict_data, chunk_size=0):
+  '''run rows through run() chunk_size rows at a time (0 = all at once)'''
+  predict_data = _rows(predict_data)
+  if not chunk_size or len(predict_data) <= chunk_size:
+    return run(predict_data)
+  return np.concatenate([run(predict_data[i:i+chunk_size])
+                         for i in range(0, len(predict_data), chunk_size)])
+
+
+class NumpyRuntime(object):
+  '''
+  MLP forward pass in numpy from a .npz written by export_model.export_numpy
+  '''
+  def __init__(self, path=''):
+    with np.load(path) as data:
+      self.kinds = [str(kind) for kind in data['kinds']]
+      self.weights = [data['weight_%03d' % i] if kind == 'linear' else None
+                      for i, kind in enumerate(self.kinds)]
+      self.biases = [data['bias_%03d' % i] if kind == 'linear' else None
+                     for i, kind in enumerate(self.kinds)]
+      self.inputs_mean = data['inputs_mean']
+      self.inputs_std = data['inputs_std']
+      self.outputs_mean = data['outputs_mean']
+      self.outputs_std = data['outputs_std']
+
+
+  def _run(self, x):
+    x = (x - self.inputs_mean) / (self.inputs_std + EPS)
+    for kind, weight, bias in zip(self.kinds, self.weights, self.biases):
+      if kind == 'linear':
+        # weights are stored transposed (in, out) for a contiguous matmul
+        x = x @ weight
+        x += bias
+      elif kind == 'tanh':
+        np.tanh(x, out=x)
+      else:
+        raise ValueError('Unsupported layer: %s' % kind)
+    return x * self.outputs_std + self.outputs_mean
+
+
+  def predict(self, predict_data, chunk_size=0):
+    return _chunked(self._run, predict_data, chunk_size)
+
+
+class OnnxRuntime(object):
+  def __init__(self, path=''):
+    import onnxruntime
+    self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+    self.input_name = self.session.get_inputs()[0].name
+
+
+  def _run(self, x):
+    return self.session.run(None, {self.input_name:x})[0]
+
+
+  def predict(self, predict_data, chunk_size=0):
+    return _chunked(self._run, predict_data, chunk_size)
+
+
+class TorchScriptRuntime(object):
+  def __init__(self, path=''):
+    import torch
+    self.torch = torch
+    self.model = torch.jit.load(path)
+    self.model.eval()
+
+
+  def _run(self, x):
+    with self.torch.no_grad():
+      # copy, memory-mapped rows are read-only
+      return self.model(self.torch.from_numpy(np.array(x))).numpy()
+
+
+  def predict(self, predict_data, chunk_size=0):
+    return _chunked(self._run, predict_data, chunk_size)
+
+
+RUNTIMES = {'.npz':NumpyRuntime,
+            '.onnx':OnnxRuntime,
+            '.ts':TorchScriptRuntime}
+
+
+def load_runtime(path=''):
+  '''runtime for an exported artifact, picked by file extension'''
+  ext = os.path.splitext(path)[1].lower()
+  if ext not in RUNTIMES:
+    raise ValueError('No lean runtime for %s (use one of %s)' % (path, ', '.join(RUNTIMES)))
+  return RUNTIMES[ext](path)
+
+
+@click.command()
+@click.argument('model_artifact', type=click.Path(exists=True))
+@click.argument('predict_input_data_m', type=click.Path(exists=True))
+@click.argument('predict_output_data_m', type=click.Path(exists=False))
+@click.option('--chunk_size', default=256, help='rows per forward pass, 0 = all at once')
+def lean_predict(model_artifact='',
+                 predict_input_data_m='',
+                 predict_output_data_m='',
+                 chunk_size=256):
+  '''
+  Predict with an exported .npz/.onnx/.ts model (stats are built in)
+  '''
+  # start timer
+  start_time = time.time()
+
+  runtime = load_runtime(model_artifact)
+
+  # load predict input data (.npy files are memory-mapped)
+  predict_data = vtx_io.load_vtx(predict_input_data_m)
+
+  # infer/predict output
+  y_pred = runtime.predict(predict_data, chunk_size=chunk_size)
+
+  # write_output
+  vtx_io.write_vtx(predict_output_data_m, y_pred)
+
+  # end timer
+  seconds = time.time() - start_time
+  m, s = divmod(seconds, 60)
+  h, m = divmod(m, 60)
+  print
+  print( "--- lean_infer - elapsed time: %d:%02d:%0.2f ---" % (h, m, s))
+  print
+
+
+if __name__ == '__main__':
+  lean_predict()
@@ -1,9 +1,19 @@
 import os
-import maya.cmds as cmds
+import numpy as np
+
+import bshapegen.timing as timing
+import bshapegen.vtx_io as vtx_io
+import bshapegen.evaluate as evaluate
+import bshapegen.export_cache as export_cache
+import bshapegen.mesh_backend as mesh_backend
 
 def create_material(name='material',
                     color_list=[1,1,1]):
   '''create material'''
+  # maya is only imported where scene commands are needed, mesh data goes
+  # through the backend so the tools also run without Maya (StubBackend)
+  import maya.cmds as cmds
+
   if not cmds.objExists(name):
     # create lambert material
     lambert = cmds.shadingNode('lambert', asShader=True)
@@ -18,176 +28,180 @@ def create_material(name='material',
   return lambert
 
 
-def get_model_input_data(mesh_list=[],end_str=''):
-  '''X shapes'''
-  X_shape_list = []
-  for mesh in mesh_list:
-    if end_str != '':
-      if not mesh.endswith(end_str):
-        continue
-    #
-    flat_vrt_list = []
-    vtx_index_list = cmds.getAttr( mesh+".vrts", multiIndices=True )
-    for vrt in vtx_index_list:
-      pos=cmds.xform( (mesh+'.vtx[%s]'%vrt),t=1,q=1)
-
-      pos[0]=str(pos[0])
-      pos[1]=str(pos[1])
-      pos[2]=str(pos[2])
-
-      flat_vrt_list.extend(pos)
-    X_shape_list.append(flat_vrt_list)
-
-  #
-  return X_shape_list
-
-
-def get_model_output_data(mesh_list=[],end_str=''):
-  '''Y shapes'''
-  Y_shape_list = []
-  #
-  for mesh in mesh_list:
-    if end_str != '':
-      if not mesh.endswith(end_str):
-        continue
-    #
-    flat_vrt_list = []
-    vtx_index_list = cmds.getAttr( mesh+".vrts", multiIndices=True )
-    for vrt in vtx_index_list:
-      pos=cmds.xform( (mesh+'.vtx[%s]'%vrt),t=1,q=1)
-
-      pos[0]=str(pos[0])
-      pos[1]=str(pos[1])
-      pos[2]=str(pos[2])
-
-      flat_vrt_list.extend(pos)
-    #
-    Y_shape_list.append(flat_vrt_list)
-
-  #
-  return Y_shape_list
+def _filter_meshes(mesh_list=[],end_str=''):
+  if end_str == '':
+    return list(mesh_list)
+  return [mesh for mesh in mesh_list if mesh.endswith(end_str)]
 
 
-def write_vtx_m(m_path='',data=[]):
-  f = open(m_path,'w')
+def get_model_input_data(mesh_list=[],end_str='',backend=None):
+  '''
+  X shapes
+  Returns (mesh count, vertex count*3) float32 array, one row per mesh
+  read with one bulk call per mesh (see bshapegen/mesh_backend.py)
+  '''
+  backend = backend or mesh_backend.get_backend()
+  with timing.span('vertex read'):
+    return backend.get_points_batch(_filter_meshes(mesh_list,end_str))
 
-  for line in data:
-    f.write(' '.join(line)+'\n')
 
-  f.close()
+def get_model_output_data(mesh_list=[],end_str='',backend=None):
+  '''
+  Y shapes
+  Returns (mesh count, vertex count*3) float32 array, one row per mesh
+  '''
+  backend = backend or mesh_backend.get_backend()
+  with timing.span('vertex read'):
+    return backend.get_points_batch(_filter_meshes(mesh_list,end_str))
 
-  # hide user
-  m_path = m_path.replace(os.getlogin(),'~')
 
-  print('Saved:',m_path)
+def export_model_data(mesh_list=[],end_str='',m_path='',backend=None):
+  '''
+  write X or Y shapes to m_path, only rows of meshes that changed since
+  the last export are rewritten (see bshapegen/export_cache.py)
+  Returns dict of unchanged/changed/added/removed mesh counts
+  '''
+  backend = backend or mesh_backend.get_backend()
+  stats = export_cache.export_rows(m_path,
+                                   _filter_meshes(mesh_list,end_str),
+                                   backend=backend)
+
+  # hide user
+  print('Saved:',m_path.replace(os.path.expanduser('~'),'~'),stats)
+  return stats
 
 
-def read_vtx_m(m_path='',tgt_mesh='',shape_num=0):
+def write_vtx_m(m_path='',data=[]):
   '''
-  read vtx pos data
-  return in usable array
+  write vtx pos data
+  .npy paths are written as binary float32, anything else as text
   '''
-  data = []
+  with timing.span('file write'):
+    vtx_io.write_vtx(m_path,data)
 
-  f = open(m_path,'r')
-
-  line_list = f.readlines()
-  for line in line_list:
-    if line != '\n':
-      data.append(line)
+  # hide user
+  m_path = m_path.replace(os.getlogin(),'~')
 
-  f.close()
+  print('Saved:',m_path)
 
-  #prep data 
-  data = data[0].replace('\n','').split(' ')
 
-  shape_data_list = []
+def read_vtx_m(m_path='',tgt_mesh='',shape_num=0,backend=None):
+  '''
+  read vtx pos data
+  Returns (shape count, vertex count*3) float32 array
+  without tgt_mesh every row is returned as one shape, with tgt_mesh the
+  data is split into shape_num shapes of its vertex count
+  '''
+  # binary (.npy) or text (.m) picked by extension
+  with timing.span('file read'):
+    data = np.atleast_2d(vtx_io.load_vtx(m_path, mmap=False)).astype(np.float32)
 
-  tgt_mesh_vtx_num = cmds.polyEvaluate(tgt_mesh, vertex=True )
+  if not tgt_mesh:
+    return data
 
-  for i in range(0,tgt_mesh_vtx_num*3*shape_num,tgt_mesh_vtx_num*3):
-      shape_data_list.append( data[i:i+tgt_mesh_vtx_num*3] )
+  backend = backend or mesh_backend.get_backend()
+  tgt_mesh_vtx_num = backend.vertex_count(tgt_mesh)
 
-  return shape_data_list
+  return data.reshape(-1)[:tgt_mesh_vtx_num*3*shape_num].reshape(-1,tgt_mesh_vtx_num*3)
 
 
 def create_shapes(tgt_mesh='',
                   shape_name_list=[],
-                  shape_data_list=[]):
+                  shape_data_list=[],
+                  backend=None):
   '''
   dup tgt_mesh 
-  read vtx pos data
-  apply to new dup verts
+  apply vtx pos data (arrays or lists of rows, vertex count*3 values per
+  shape) to the new dup verts in one bulk write per shape
   '''
+  backend = backend or mesh_backend.get_backend()
 
   new_mesh_list = []
 
-  tgt_mesh_vtx_num = cmds.polyEvaluate(tgt_mesh, vertex=True )
-  
   for i in range(len(shape_name_list)):
     new_shape_mesh = tgt_mesh.replace('_neutral','_'+shape_name_list[i]+'_predict')
-    if not cmds.objExists(new_shape_mesh):
-      new_shape_mesh = cmds.duplicate(tgt_mesh,n=new_shape_mesh)[0]
+    if not backend.exists(new_shape_mesh):
+      with timing.span('mesh duplicate'):
+        new_shape_mesh = backend.duplicate(tgt_mesh,new_shape_mesh)
 
     print('New Shape:',new_shape_mesh)
 
-    cmds.select(cl=1)
-
-    i_vtx = 0
-    for j in range(0,tgt_mesh_vtx_num*3,3):
-      #print(shape_data_list[i][j:j+3])
-      pos = shape_data_list[i][j:j+3]
-
-      cmds.xform(new_shape_mesh+'.vtx['+str(i_vtx)+']',
-               t=[float(pos[0]),float(pos[1]),float(pos[2])])
-
-      i_vtx += 1
+    with timing.span('vertex write'):
+      backend.set_points(new_shape_mesh, shape_data_list[i])
 
     new_mesh_list.append(new_shape_mesh)
 
   return new_mesh_list
 
 
-def get_pose_predict_shapes_diff(top_node=''):
+def update_predict_shapes(mesh_list=[],
+                          shape_data_list=[],
+                          shape_name='pose',
+                          backend=None):
+  '''
+  create the <shape_name>_predict dup of every mesh, or rewrite an
+  existing one only if its points differ from the new shape data
+  Returns tuple (created, updated, unchanged) lists of predict meshes
+  '''
+  backend = backend or mesh_backend.get_backend()
+
+  created, updated, unchanged = [], [], []
+  for mesh, shape_data in zip(mesh_list, shape_data_list):
+    predict_mesh = mesh.replace('_neutral','_'+shape_name+'_predict')
+    if not backend.exists(predict_mesh):
+      created.extend(create_shapes(tgt_mesh=mesh,
+                                   shape_name_list=[shape_name],
+                                   shape_data_list=[shape_data],
+                                   backend=backend))
+      continue
+
+    with timing.span('vertex read'):
+      points = backend.get_points(predict_mesh)
+    if np.array_equal(points, np.asarray(shape_data, dtype=np.float32).reshape(-1,3)):
+      unchanged.append(predict_mesh)
+    else:
+      with timing.span('vertex write'):
+        backend.set_points(predict_mesh, shape_data)
+      updated.append(predict_mesh)
+
+  return created, updated, unchanged
+
+
+def get_pose_predict_shapes_diff(top_node='',report_path='',backend=None):
   '''
   Return:
     1. A list of the difference between the pose and predict shapes
+       (summed vertex distances per pose group)
     2. A total sum of the differences found
+  All pose groups are scored in one vectorized pass (see bshapegen/evaluate.py),
+  report_path also writes the full per-vertex error report (.json/.csv)
   '''
-  diff_list = []
-  diff_sum = 0
+  import maya.cmds as cmds
+  backend = backend or mesh_backend.get_backend()
 
   # get all children of top_node
-  ad_list = cmds.listRelatives(top_node, ad=True)
+  with timing.span('mesh enumeration'):
+    ad_list = cmds.listRelatives(top_node, ad=True) or []
   
   # get all *_pose_grp nodes
-  pose_grp_list = []
-
-  for ad in ad_list:
-    if ad.endswith('_pose_grp'):
-      pose_grp_list.append(ad)
-
-  # get diff data for each pose_grp
-  for pose_grp in pose_grp_list:
-    pose = pose_grp.replace('_pose_grp','_pose')
-    pose_predict = pose_grp.replace('_pose_grp','_pose_predict')
-    # for each vertex measure the difference between the pose and pose_predict mesh by vector magnitude
-    pose_vtx_list = cmds.ls(pose+'.vtx[*]',fl=True)
-    pose_predict_vtx_list = cmds.ls(pose_predict+'.vtx[*]',fl=True)
-    pose_diff = 0
-    for i in range(len(pose_vtx_list)):
-      pose_vtx_pos = cmds.xform(pose_vtx_list[i], q=True, t=True, ws=True)
-      pose_predict_vtx_pos = cmds.xform(pose_predict_vtx_list[i], q=True, t=True, ws=True)
-      diff = [pose_vtx_pos[0]-pose_predict_vtx_pos[0],
-              pose_vtx_pos[1]-pose_predict_vtx_pos[1],
-              pose_vtx_pos[2]-pose_predict_vtx_pos[2]]
-      # get magnitude of diff
-      diff_mag = (diff[0]**2 + diff[1]**2 + diff[2]**2)**0.5
-      # add to pose_diff
-      pose_diff += diff_mag
-    #
-    diff_list.append([pose_grp, pose_diff])
-    diff_sum += pose_diff
+  pose_grp_list = [ad for ad in ad_list if ad.endswith('_pose_grp')]
+  if not pose_grp_list:
+    return [], 0
+
+  # world space points of every pose and pose_predict mesh, one row per group
+  with timing.span('vertex read'):
+    pose_data = backend.get_points_batch([pose_grp.replace('_pose_grp','_pose')
+                                          for pose_grp in pose_grp_list], world=True)
+    predict_data = backend.get_points_batch([pose_grp.replace('_pose_grp','_pose_predict')
+                                             for pose_grp in pose_grp_list], world=True)
+
+  with timing.span('evaluate'):
+    report = evaluate.make_report(predict_data, pose_data, names=pose_grp_list)
+  if report_path:
+    with timing.span('file write'):
+      evaluate.write_report(report, report_path)
+
+  diff_list = [[shape['name'], shape['sum']] for shape in report['shapes']]
+  diff_sum = report['summary']['sum']
 
   return diff_list, diff_sum
-
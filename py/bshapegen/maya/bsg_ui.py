@@ -1,5 +1,6 @@
 import os
 import sys
+import functools
 from pathlib import Path
 
 from PySide2.QtCore import *
@@ -13,6 +14,9 @@ import maya.cmds as cmds
 from maya.app.general.mayaMixin import MayaQWidgetDockableMixin
 
 import bshapegen.utils as utils
+import bshapegen.timing as timing
+import bshapegen.infer_client as infer_client
+import bshapegen.predict_cache as predict_cache
 import bshapegen.maya.bsg_tools as bsg_t
 import bshapegen.maya.init_test_scene as its
 
@@ -34,6 +38,48 @@ def get_env_path():
   return _path
 
 
+def timed_action(action=''):
+  '''
+  BSG_UI button command decorator, the stage times (bshapegen/timing.py)
+  are reset before the action, printed after it and saved to the working
+  dir as timing_<action>.json
+  '''
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(self):
+      timing.reset()
+      try:
+        return func(self)
+      finally:
+        timing.print_report(action)
+        wrk_dir = self.wrk_dir_FileInput.getText()
+        if wrk_dir and os.path.isdir(wrk_dir):
+          timing.save(sep.join([wrk_dir,f'timing_{action}.json']), action)
+    return wrapper
+  return decorator
+
+
+def run_script(command_str='', env={}, timing_path='', prefix=''):
+  '''
+  run a bshapegen script subprocess, the stage times it saves to
+  $BSG_TIMING_JSON are added to the action report as <prefix><stage>
+  Returns exit code
+  '''
+  if os.path.exists(timing_path):
+    os.remove(timing_path)
+  env = dict(env)
+  env[timing.ENV_VAR] = timing_path
+
+  with timing.span('subprocess launch'):
+    results = utils.subprocess_cmd([command_str],
+                                    env=env,
+                                    wait=1,
+                                    shell=1,
+                                    v=1)
+  timing.merge_file(timing_path, prefix)
+  return results
+
+
 class NodePath(QWidget):
   def __init__(self,
               my_parent=None,
@@ -301,10 +347,16 @@ class BSG_UI(MayaQWidgetDockableMixin,QMainWindow):
                                             value=0.001,
                                             toolTip='Float Values Only')
 
+    self.batch_size_IntInput = IntInput(parent=parent,
+                                        name='batch size',
+                                        value=0,
+                                        toolTip='0 = Full Batch, Integer Values Only')
+
     self.model_params_HBoxLayout=QHBoxLayout()
     self.model_params_HBoxLayout.addWidget(self.neuron_num_IntInput)
     self.model_params_HBoxLayout.addWidget(self.epochs_IntInput)
     self.model_params_HBoxLayout.addWidget(self.learning_rate_DblInput)
+    self.model_params_HBoxLayout.addWidget(self.batch_size_IntInput)
     self.train_VBoxLayout.addLayout(self.model_params_HBoxLayout)
 
     self.build_model_PushButton = QPushButton('Build Model')
@@ -351,19 +403,22 @@ class BSG_UI(MayaQWidgetDockableMixin,QMainWindow):
     self.write_predict_import_data_PushButton.clicked.connect(self.write_predict_import_data_cmd)
 
   
+  @timed_action('build_test_scene')
   def build_test_scene_cmd(self):
     print('Build Test Scene')
 
     num_train_shapes = int(self.num_train_shapes_IntInput.getText())
     num_predict_shapes = int(self.num_predict_shapes_IntInput.getText())
 
-    _train, _predict = its.create_scene(num_train_shapes=num_train_shapes,
-                                        num_predict_shapes=num_predict_shapes)
+    with timing.span('scene build'):
+      _train, _predict = its.create_scene(num_train_shapes=num_train_shapes,
+                                          num_predict_shapes=num_predict_shapes)
     
     self.export_group_NodePath.lineedit.setText(_train)
     self.predict_NodePath.lineedit.setText(_predict)
 
 
+  @timed_action('export')
   def export_model_data_cmd(self):
     print('Export PyTorch Model Training & Testing [X,Y] Data')
 
@@ -371,27 +426,27 @@ class BSG_UI(MayaQWidgetDockableMixin,QMainWindow):
 
     # get childen of group
     group_node = self.export_group_NodePath.getText()
-    mesh_list = cmds.listRelatives(group_node,ad=1)
+    with timing.span('mesh enumeration'):
+      mesh_list = cmds.listRelatives(group_node,ad=1)
 
     if not mesh_list:
       print(f'Nodes Not Found Under: {group_node}')
       return
 
-    # write X data
-    bsl=bsg_t.get_model_input_data(mesh_list=mesh_list,
-                                   end_str='_neutral')
-    i_data_path=sep.join([wrk_dir,'model_input_data.m'])
-    bsg_t.write_vtx_m(m_path=i_data_path,
-                       data=bsl)
+    # write X data (only changed meshes are patched in the existing file)
+    i_data_path=sep.join([wrk_dir,'model_input_data.npy'])
+    bsg_t.export_model_data(mesh_list=mesh_list,
+                            end_str='_neutral',
+                            m_path=i_data_path)
 
     # write Y data
-    asl=bsg_t.get_model_output_data(mesh_list=mesh_list,
-                                   end_str='_pose')
-    o_data_path=sep.join([wrk_dir,'model_output_data.m'])
-    bsg_t.write_vtx_m(m_path=o_data_path,
-                       data=asl)
+    o_data_path=sep.join([wrk_dir,'model_output_data.npy'])
+    bsg_t.export_model_data(mesh_list=mesh_list,
+                            end_str='_pose',
+                            m_path=o_data_path)
 
 
+  @timed_action('build')
   def build_model_cmd(self):
     print('Build PyTorch Seq Model')
 
@@ -412,21 +467,22 @@ class BSG_UI(MayaQWidgetDockableMixin,QMainWindow):
     commands.append(self.learning_rate_DblInput.getText())
     commands.append('--epochs')
     commands.append(self.epochs_IntInput.getText())
-    commands.append(sep.join([wrk_dir,'model_input_data.m']))
-    commands.append(sep.join([wrk_dir,'model_output_data.m']))
+    commands.append('--batch_size')
+    commands.append(self.batch_size_IntInput.getText())
+    commands.append(sep.join([wrk_dir,'model_input_data.npy']))
+    commands.append(sep.join([wrk_dir,'model_output_data.npy']))
     commands.append(sep.join([wrk_dir,'model.pt']))
-    commands.append(sep.join([wrk_dir,'in_mean.m']))
-    commands.append(sep.join([wrk_dir,'in_std.m']))
-    commands.append(sep.join([wrk_dir,'out_mean.m']))
-    commands.append(sep.join([wrk_dir,'out_std.m']))
+    commands.append(sep.join([wrk_dir,'in_mean.npy']))
+    commands.append(sep.join([wrk_dir,'in_std.npy']))
+    commands.append(sep.join([wrk_dir,'out_mean.npy']))
+    commands.append(sep.join([wrk_dir,'out_std.npy']))
 
     command_str = ' '.join(commands)  
 
-    results = utils.subprocess_cmd([command_str],
-                                    env=env,
-                                    wait=1,
-                                    shell=1,
-                                    v=1)
+    results = run_script(command_str,
+                         env=env,
+                         timing_path=sep.join([wrk_dir,'timing_build_model.json']),
+                         prefix='build_model/')
     
     if results == 0:
       print('Build Model Success!')
@@ -434,6 +490,58 @@ class BSG_UI(MayaQWidgetDockableMixin,QMainWindow):
       print('Build Model Failed!')
 
 
+  def predict_rows(self, rows, wrk_dir='', model_paths={}, env={}):
+    '''
+    predicted rows for neutral rows, from the inference server if one is
+    running (model stays loaded), otherwise or if the server fails a single
+    infer_model.py subprocess. Returns None on failure
+    '''
+    if infer_client.is_running():
+      print(f'Using Inference Server: {infer_client.DEFAULT_HOST}:{infer_client.DEFAULT_PORT}')
+      client = infer_client.InferClient()
+
+      # predict in the server, no file round trip
+      try:
+        with timing.span('forward pass'):
+          return client.predict(rows, **model_paths)
+      except (OSError, RuntimeError, ValueError) as e:
+        print(f'Inference Server Predict Failed: {e}')
+        print('Falling back to infer_model.py')
+
+    # write predict X data
+    p_data_path=sep.join([wrk_dir,'predict_input_data.npy'])
+    bsg_t.write_vtx_m(m_path=p_data_path,
+                      data=rows)
+
+    # run prediction
+    commands = []
+    # base cmd
+    commands.append('python')
+    commands.append(f'{parent_dir}/infer_model.py')
+    # and args
+    commands.append(model_paths['model_pt'])
+    commands.append(p_data_path)
+    commands.append(model_paths['inputs_mean_m'])
+    commands.append(model_paths['inputs_std_m'])
+    commands.append(model_paths['outputs_mean_m'])
+    commands.append(model_paths['outputs_std_m'])
+    commands.append(sep.join([wrk_dir,'predict_output_data.npy']))
+
+    command_str = ' '.join(commands)  
+
+    results = run_script(command_str,
+                         env=env,
+                         timing_path=sep.join([wrk_dir,'timing_infer_model.json']),
+                         prefix='infer_model/')
+    
+    if results != 0:
+      return None
+    
+    # read predict Y data (one row per mesh)
+    return bsg_t.read_vtx_m(m_path=sep.join([wrk_dir,'predict_output_data.npy']))
+
+
+  @timed_action('predict')
   def write_predict_import_data_cmd(self):
     print('Run Prediction and Import Results!')
 
@@ -443,75 +551,52 @@ class BSG_UI(MayaQWidgetDockableMixin,QMainWindow):
     env = os.environ
     env['PATH']=_path
 
-    # delete predicted data if exists
-    predict_mesh = cmds.ls('predict_shape_*_predict')
-    if predict_mesh:
-      cmds.delete(predict_mesh)
-
     # get _neutral mesh nodes
     group_node = self.predict_NodePath.getText()
-    node_list = cmds.listRelatives(group_node,ad=1)
+    with timing.span('mesh enumeration'):
+      node_list = cmds.listRelatives(group_node,ad=1)
+      predict_list = cmds.ls('predict_shape_*_predict') or []
     mesh_list = []
     for node in node_list:
       if node.endswith('_neutral'):
         mesh_list.append(node)
-    
-    # predict and import data
+
+    # delete predicted meshes whose neutral is gone, the others are updated in place
+    keep_list = [mesh.replace('_neutral','_pose_predict') for mesh in mesh_list]
+    stale_list = [mesh for mesh in predict_list if mesh not in keep_list]
+    if stale_list:
+      cmds.delete(stale_list)
+
+    # get predict X data for all meshes at once (one row per mesh)
+    psl=bsg_t.get_model_input_data(mesh_list=mesh_list,
+                                  end_str='_neutral')
+
+    model_paths = utils.model_paths(model_pt=sep.join([wrk_dir,'model.pt']),
+                                    inputs_mean_m=sep.join([wrk_dir,'in_mean.npy']),
+                                    inputs_std_m=sep.join([wrk_dir,'in_std.npy']),
+                                    outputs_mean_m=sep.join([wrk_dir,'out_mean.npy']),
+                                    outputs_std_m=sep.join([wrk_dir,'out_std.npy']))
+
+    # only neutrals (or a model) that changed since the last predict are inferred
+    cache = predict_cache.PredictCache()
+    p_shape_data, hits = cache.predict(psl,
+                                       model_paths,
+                                       lambda rows: self.predict_rows(rows, wrk_dir, model_paths, env))
+    if p_shape_data is None:
+      print(f'Predict {len(mesh_list)} Meshes Failed!')
+      return
+    print(f'Predict {len(mesh_list)} Meshes Success! ({hits} from cache)')
+
+    # import predicted shapes, unchanged predictions are left alone
+    created, updated, unchanged = bsg_t.update_predict_shapes(mesh_list=mesh_list,
+                                                              shape_data_list=p_shape_data)
+    print(f'Predict Shapes: {len(created)} created, {len(updated)} updated, {len(unchanged)} unchanged')
+
     for i,mesh in enumerate(mesh_list):
-      
-      # input data file name
-      i_data_name=f'{mesh}_input_data.m'
-
-      # output data file name
-      o_data_name=f'{mesh}_output_data.m'
-
-      # write predict X data
-      psl=bsg_t.get_model_input_data(mesh_list=[mesh],
-                                    end_str='_neutral')
-      p_data_path=sep.join([wrk_dir,i_data_name])
-      bsg_t.write_vtx_m(m_path=p_data_path,
-                        data=psl)
-
-      # run prediction
-      commands = []
-      # base cmd
-      commands.append('python')
-      commands.append(f'{parent_dir}/infer_model.py')
-      # and args
-      commands.append(sep.join([wrk_dir,'model.pt']))
-      commands.append(sep.join([wrk_dir,i_data_name]))
-      commands.append(sep.join([wrk_dir,'in_mean.m']))
-      commands.append(sep.join([wrk_dir,'in_std.m']))
-      commands.append(sep.join([wrk_dir,'out_mean.m']))
-      commands.append(sep.join([wrk_dir,'out_std.m']))
-      commands.append(sep.join([wrk_dir,o_data_name]))
-
-      command_str = ' '.join(commands)  
-
-      results = utils.subprocess_cmd([command_str],
-                                      env=env,
-                                      wait=1,
-                                      shell=1,
-                                      v=1)
-      
-      if results == 0:
-        print(f'Predict {mesh} Success!')
-      else:
-        print(f'Predict {mesh} Failed!')
-      
-      # read predict Y data
-      p_shape_data_path=sep.join([wrk_dir,o_data_name])
-      p_shape_data = bsg_t.read_vtx_m(m_path=p_shape_data_path,
-                                      tgt_mesh=mesh,
-                                      shape_num=1)
-
-      # create predicted shapes
-      new_mesh_list = bsg_t.create_shapes(tgt_mesh=mesh,
-                                          shape_name_list=['pose'],
-                                          shape_data_list=p_shape_data)
-      
-      pose_parent = f'predict_shape_{i}_pose_grp'
-      cmds.parent(new_mesh_list,pose_parent,relative=1)
+      predict_mesh = mesh.replace('_neutral','_pose_predict')
+      if predict_mesh in created:
+        pose_parent = f'predict_shape_{i}_pose_grp'
+        cmds.parent(predict_mesh,pose_parent,relative=1)
     
     # create and assign material to predict Y data
     predict_shapes_mtl = bsg_t.create_material(name='predict_Y_material',
@@ -519,8 +604,9 @@ class BSG_UI(MayaQWidgetDockableMixin,QMainWindow):
     cmds.select('predict_shape_*_predict')
     cmds.hyperShade(assign=predict_shapes_mtl)
 
-    # run diff report
-    diff_list, diff_sum = bsg_t.get_pose_predict_shapes_diff('predict_shapes')
+    # run diff report (per vertex error stats saved next to the data)
+    diff_list, diff_sum = bsg_t.get_pose_predict_shapes_diff('predict_shapes',
+                                                             report_path=sep.join([wrk_dir,'predict_report.json']))
     for mesh_data in diff_list:
         print(f'Mesh: {mesh_data[0]} - Diff: {mesh_data[1]}')
 
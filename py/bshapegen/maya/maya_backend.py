@@ -0,0 +1,48 @@
+'''
+OpenMaya (API 2.0) mesh backend, see bshapegen/mesh_backend.py.
+All points of a mesh are read with one MFnMesh call and written with one
+(undoable) cmds.xform over the vertex range, instead of a cmds.xform round
+trip per vertex.
+'''
+import numpy as np
+import maya.cmds as cmds
+import maya.api.OpenMaya as om
+
+from bshapegen.mesh_backend import MeshBackend
+
+
+def mfn_mesh(mesh=''):
+  '''MFnMesh of a mesh transform or shape name'''
+  sel = om.MSelectionList()
+  sel.add(mesh)
+  return om.MFnMesh(sel.getDagPath(0))
+
+
+class MayaBackend(MeshBackend):
+
+  def exists(self, mesh=''):
+    return cmds.objExists(mesh)
+
+
+  def vertex_count(self, mesh=''):
+    return mfn_mesh(mesh).numVertices
+
+
+  def get_points(self, mesh='', world=False):
+    # object space is the same as cmds.xform(vtx, t=1, q=1)
+    points = mfn_mesh(mesh).getPoints(om.MSpace.kWorld if world else om.MSpace.kObject)
+    # MPoints are (x, y, z, w)
+    return np.array(points, dtype=np.float64)[:, :3].astype(np.float32)
+
+
+  def set_points(self, mesh='', points=None):
+    points = self._check_points(mesh, points)
+    # one xform over the whole vertex range rather than MFnMesh.setPoints,
+    # so updating existing predict meshes can be undone
+    cmds.xform('%s.vtx[0:%d]' % (mesh, len(points)-1),
+               objectSpace=True,
+               translation=points.astype(np.float64).reshape(-1).tolist())
+
+
+  def duplicate(self, mesh='', name=''):
+    return cmds.duplicate(mesh, n=name)[0]
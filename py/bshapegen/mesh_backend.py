@@ -0,0 +1,121 @@
+'''
+Mesh point access for maya/bsg_tools.py.
+
+bsg_tools reads and writes whole point arrays through a backend instead of
+one cmds.xform per vertex, and duplicates meshes for predicted shapes.
+MeshBackend is the interface, MayaBackend (maya/maya_backend.py, OpenMaya
+MFnMesh) is the default inside Maya and StubBackend keeps meshes in memory
+so the tools can run without Maya:
+
+  import bshapegen.mesh_backend as mesh_backend
+  mesh_backend.set_backend(mesh_backend.StubBackend({'a_neutral':points}))
+
+Points are (vertex_count, 3) float32 arrays in object space.
+'''
+import numpy as np
+
+
+class MeshBackend(object):
+  '''
+  point access interface, implement exists, vertex_count, get_points,
+  set_points and duplicate
+  '''
+
+  def exists(self, mesh=''):
+    raise NotImplementedError
+
+
+  def vertex_count(self, mesh=''):
+    raise NotImplementedError
+
+
+  def get_points(self, mesh='', world=False):
+    '''Returns (vertex_count, 3) float32 object (or world) space points'''
+    raise NotImplementedError
+
+
+  def set_points(self, mesh='', points=None):
+    '''set all points of mesh from a (vertex_count, 3) or flat array'''
+    raise NotImplementedError
+
+
+  def duplicate(self, mesh='', name=''):
+    '''Returns the name of the duplicate'''
+    raise NotImplementedError
+
+
+  def _check_points(self, mesh='', points=None):
+    '''(vertex_count, 3) float32 points, raises on a vertex count mismatch'''
+    points = np.asarray(points, dtype=np.float32).reshape(-1,3)
+    vertex_count = self.vertex_count(mesh)
+    if len(points) != vertex_count:
+      raise ValueError('%d points for %s with %d vertices' % (len(points), mesh, vertex_count))
+    return points
+
+
+  def get_points_batch(self, mesh_list=[], world=False):
+    '''
+    points of all meshes as one row per mesh
+    Returns (len(mesh_list), vertex_count*3) float32 array
+    '''
+    if not mesh_list:
+      return np.empty((0, 0), dtype=np.float32)
+    rows = [self.get_points(mesh, world).reshape(-1) for mesh in mesh_list]
+    if len(set(len(row) for row in rows)) > 1:
+      raise ValueError('Meshes have different vertex counts: %s'
+                       % ', '.join('%s=%d' % (mesh, len(row)//3) for mesh, row in zip(mesh_list, rows)))
+    return np.stack(rows)
+
+
+class StubBackend(MeshBackend):
+  '''in memory meshes {name: points}, for tests and offline tools'''
+
+  def __init__(self, meshes={}):
+    self.meshes = {name:np.asarray(points, dtype=np.float32).reshape(-1,3)
+                   for name, points in meshes.items()}
+
+
+  def _mesh(self, mesh=''):
+    if mesh not in self.meshes:
+      raise KeyError('Mesh not found: %s' % mesh)
+    return self.meshes[mesh]
+
+
+  def exists(self, mesh=''):
+    return mesh in self.meshes
+
+
+  def vertex_count(self, mesh=''):
+    return len(self._mesh(mesh))
+
+
+  def get_points(self, mesh='', world=False):
+    # stub meshes have no transforms, object space == world space
+    return self._mesh(mesh).copy()
+
+
+  def set_points(self, mesh='', points=None):
+    self.meshes[mesh] = self._check_points(mesh, points).copy()
+
+
+  def duplicate(self, mesh='', name=''):
+    self.meshes[name] = self._mesh(mesh).copy()
+    return name
+
+
+_backend = None
+
+
+def set_backend(backend=None):
+  '''backend used by bsg_tools, None resets to the Maya backend'''
+  global _backend
+  _backend = backend
+
+
+def get_backend():
+  '''current backend, the OpenMaya one unless set_backend() was called'''
+  global _backend
+  if _backend is None:
+    from bshapegen.maya.maya_backend import MayaBackend
+    _backend = MayaBackend()
+  return _backend
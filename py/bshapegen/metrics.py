@@ -0,0 +1,103 @@
+'''
+Structured training metrics, one JSON object per line.
+
+train_epochs writes an 'epoch' record per epoch (wall time, samples/sec,
+data/forward/backward/optimizer/validation time split, current and peak
+RSS, train/val loss) and a final 'summary' record. A callback gets every
+record as it is written, ie. to report live progress to a farm scheduler:
+
+  bundle = bshapegen.api.train(inputs, outputs, metrics_path='metrics.jsonl',
+                               callback=lambda record: print(record['type']))
+
+make_model writes <model>_metrics.jsonl by default (--metrics).
+'''
+import os
+import sys
+import json
+import time
+
+_MB = 1024.0 * 1024.0
+
+
+def _windows_rss():
+  import ctypes
+  import ctypes.wintypes
+
+  class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+    _fields_ = [('cb', ctypes.wintypes.DWORD),
+                ('PageFaultCount', ctypes.wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t)]
+
+  counters = PROCESS_MEMORY_COUNTERS()
+  counters.cb = ctypes.sizeof(counters)
+  ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                           ctypes.byref(counters),
+                                           counters.cb)
+  return counters.WorkingSetSize, counters.PeakWorkingSetSize
+
+
+def rss_bytes():
+  '''
+  Returns tuple (current, peak) resident set size of this process in bytes,
+  0 when the platform does not report it
+  '''
+  if sys.platform == 'win32':
+    try:
+      return _windows_rss()
+    except (OSError, AttributeError):
+      return 0, 0
+
+  import resource
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on linux, bytes on macOS
+  if sys.platform != 'darwin':
+    peak *= 1024
+  current = 0
+  try:
+    with open('/proc/self/statm', 'r') as fp:
+      current = int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (OSError, ValueError, IndexError):
+    pass
+  # both are sampled at page granularity, peak can't be below current
+  return current, max(peak, current)
+
+
+class MetricsLogger(object):
+  '''
+  Write records to path as JSON lines (truncated unless append, ie. a
+  resumed run) and pass them to callback(record). Both are optional.
+  '''
+  def __init__(self, path='', callback=None, append=False):
+    self.path = path
+    self.callback = callback
+    self.start_time = time.time()
+    self._fp = open(path, 'a' if append else 'w') if path else None
+
+
+  def write(self, record_type='epoch', **values):
+    current, peak = rss_bytes()
+    record = {'type':record_type,
+              'time':time.time(),
+              'elapsed_s':time.time() - self.start_time}
+    record.update(values)
+    record.update({'rss_mb':current / _MB,
+                   'peak_rss_mb':peak / _MB})
+    if self._fp:
+      self._fp.write(json.dumps(record) + '\n')
+      self._fp.flush()
+    if self.callback:
+      self.callback(record)
+    return record
+
+
+  def close(self):
+    if self._fp:
+      self._fp.close()
+      self._fp = None
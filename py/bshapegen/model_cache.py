@@ -0,0 +1,152 @@
+'''
+In-process LRU cache of loaded models and their normalization stats.
+
+With one model per character/region, repeated predictions against the
+same few rigs should only cost the forward pass:
+
+  import bshapegen.model_cache as model_cache
+  y_pred = model_cache.predict(rows, model_pt, in_mean, in_std, out_mean, out_std)
+
+Entries are keyed by the five file paths plus their mtime and size
+(key='mtime'), or by a sha1 of the file contents (key='hash', identical
+models at different paths share one entry). When the loaded entries go
+over max_bytes (parameters, buffers and stats) the least recently used
+ones are evicted. The default cache budget is $BSG_MODEL_CACHE_MB
+(2048 MB).
+'''
+import os
+import threading
+import collections
+
+import bshapegen.utils as utils
+import bshapegen.infer_model as infer_model
+
+KEY_MODES = ['mtime', 'hash']
+DEFAULT_MAX_BYTES = int(float(os.environ.get('BSG_MODEL_CACHE_MB', 2048)) * 1024 * 1024)
+
+
+def model_nbytes(model, stats=()):
+  '''memory held by the model parameters/buffers and the stats tensors'''
+  tensors = list(model.parameters()) + list(model.buffers()) + list(stats)
+  return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelCache(object):
+  def __init__(self, max_bytes=DEFAULT_MAX_BYTES, key='mtime'):
+    if key not in KEY_MODES:
+      raise ValueError('Unknown cache key mode: %s (use one of %s)' % (key, ', '.join(KEY_MODES)))
+    self.max_bytes = max_bytes
+    self.key_mode = key
+    self.entries = collections.OrderedDict()
+    self.nbytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.lock = threading.RLock()
+    # sha1 per (path, mtime, size), files are only re-hashed when they change
+    self._hashes = {}
+
+
+  def _file_key(self, path=''):
+    st = os.stat(path)
+    file_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if self.key_mode == 'mtime':
+      return file_key
+    if file_key not in self._hashes:
+      self._hashes[file_key] = utils.file_sha1(path)
+    return self._hashes[file_key]
+
+
+  def key(self, paths={}):
+    paths = utils.model_paths(**paths)
+    return tuple(self._file_key(paths[name]) for name in sorted(paths))
+
+
+  def get(self, model_pt='', inputs_mean_m='', inputs_std_m='', outputs_mean_m='', outputs_std_m=''):
+    '''
+    cached (model, stats) for the model files, loaded on a miss
+    stats is (inputs_mean, inputs_std, outputs_mean, outputs_std) tensors
+    '''
+    paths = utils.model_paths(model_pt, inputs_mean_m, inputs_std_m, outputs_mean_m, outputs_std_m)
+    with self.lock:
+      key = self.key(paths)
+      if key in self.entries:
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]['model'], self.entries[key]['stats']
+
+      self.misses += 1
+      # older versions of the same files are stale
+      for stale_key, entry in list(self.entries.items()):
+        if entry['paths'] == paths:
+          del self.entries[stale_key]
+          self.nbytes -= entry['nbytes']
+
+      stats = infer_model.load_stats(inputs_mean_m, inputs_std_m, outputs_mean_m, outputs_std_m)
+      model = infer_model.load_model(model_pt)
+      entry = {'model':model,
+               'stats':stats,
+               'paths':paths,
+               'nbytes':model_nbytes(model, stats)}
+      self.entries[key] = entry
+      self.nbytes += entry['nbytes']
+      self._evict()
+      return model, stats
+
+
+  def _evict(self):
+    '''drop least recently used entries over budget, never the newest one'''
+    while self.nbytes > self.max_bytes and len(self.entries) > 1:
+      key, entry = self.entries.popitem(last=False)
+      self.nbytes -= entry['nbytes']
+      self.evictions += 1
+
+
+  def invalidate(self, model_pt='', inputs_mean_m='', inputs_std_m='', outputs_mean_m='', outputs_std_m=''):
+    '''drop the entries loaded from model_pt (all entries if not given)'''
+    with self.lock:
+      for key, entry in list(self.entries.items()):
+        if not model_pt or entry['paths']['model_pt'] == model_pt:
+          del self.entries[key]
+          self.nbytes -= entry['nbytes']
+
+
+  def info(self):
+    with self.lock:
+      return {'entries':len(self.entries),
+              'nbytes':self.nbytes,
+              'max_bytes':self.max_bytes,
+              'key':self.key_mode,
+              'hits':self.hits,
+              'misses':self.misses,
+              'evictions':self.evictions,
+              'models':[entry['paths']['model_pt'] for entry in self.entries.values()]}
+
+
+  def predict(self, predict_data, model_pt='', inputs_mean_m='', inputs_std_m='', outputs_mean_m='', outputs_std_m='',
+              chunk_size=256):
+    '''run_model with the cached model and stats, Returns numpy array of rows'''
+    model, stats = self.get(model_pt, inputs_mean_m, inputs_std_m, outputs_mean_m, outputs_std_m)
+    return infer_model.run_model(model, predict_data, *stats, chunk_size=chunk_size)
+
+
+_default_cache = None
+
+
+def default_cache():
+  '''process wide cache used by the module level predict()'''
+  global _default_cache
+  if _default_cache is None:
+    _default_cache = ModelCache()
+  return _default_cache
+
+
+def predict(predict_data, model_pt='', inputs_mean_m='', inputs_std_m='', outputs_mean_m='', outputs_std_m='',
+            chunk_size=256):
+  return default_cache().predict(predict_data,
+                                 model_pt,
+                                 inputs_mean_m,
+                                 inputs_std_m,
+                                 outputs_mean_m,
+                                 outputs_std_m,
+                                 chunk_size=chunk_size)
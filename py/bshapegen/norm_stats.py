@@ -0,0 +1,111 @@
+'''
+Per column normalization statistics (mean and standard deviation).
+
+RunningStats is fed chunks of rows and keeps float64 accumulators
+(Welford / Chan et al. parallel update), so the whole array never has to
+be in memory and partial stats from parallel loaders can be merged.
+std is the population std (ddof=0), the same as build_model.featNorm.
+'''
+import numpy as np
+
+EPS = np.finfo(np.float32).eps
+
+
+def normalize(features, mean, std):
+  '''
+  Normalize features by mean and standard deviation.
+  Works on numpy arrays and torch tensors
+  '''
+  return (features - mean) / (std + EPS)
+
+
+def denormalize(features_norm, mean, std):
+  '''
+  Denormalize features by mean and standard deviation
+  '''
+  return (features_norm * std) + mean
+
+
+class RunningStats(object):
+  def __init__(self):
+    self.count = 0
+    self.mean_ = None
+    self.m2 = None
+
+
+  def update(self, chunk):
+    '''
+    add a chunk of rows (2d, or 1d for a single row)
+    Returns self
+    '''
+    chunk = np.asarray(chunk, dtype=np.float64)
+    chunk = chunk.reshape(-1, chunk.shape[-1])
+    if not len(chunk):
+      return self
+
+    chunk_mean = chunk.mean(axis=0)
+    chunk_m2 = ((chunk - chunk_mean)**2).sum(axis=0)
+    return self._combine(len(chunk), chunk_mean, chunk_m2)
+
+
+  def merge(self, other):
+    '''
+    add the rows seen by another RunningStats (ie. from another worker)
+    Returns self
+    '''
+    if other.count:
+      self._combine(other.count, other.mean_, other.m2)
+    return self
+
+
+  def _combine(self, count, mean, m2):
+    if not self.count:
+      self.count = count
+      self.mean_ = np.array(mean, dtype=np.float64)
+      self.m2 = np.array(m2, dtype=np.float64)
+      return self
+
+    total = self.count + count
+    delta = mean - self.mean_
+    self.mean_ = self.mean_ + delta * (count / total)
+    self.m2 = self.m2 + m2 + delta**2 * (self.count * count / total)
+    self.count = total
+    return self
+
+
+  @property
+  def mean(self):
+    return self.mean_
+
+
+  @property
+  def std(self):
+    return np.sqrt(self.m2 / max(self.count, 1))
+
+
+  @classmethod
+  def from_mean_std(cls, mean, std, count=1):
+    '''rebuild stats saved as mean/std of count rows'''
+    stats = cls()
+    mean = np.asarray(mean, dtype=np.float64).reshape(-1)
+    std = np.asarray(std, dtype=np.float64).reshape(-1)
+    return stats._combine(count, mean, std**2 * count)
+
+
+  def normalize(self, features):
+    return normalize(features, self.mean, self.std)
+
+
+  def denormalize(self, features_norm):
+    return denormalize(features_norm, self.mean, self.std)
+
+
+def chunk_stats(data, chunk_rows=4096):
+  '''
+  RunningStats of a 2d array (or memory-map) fed chunk_rows rows at a time
+  '''
+  data = data.reshape(-1, data.shape[-1])
+  stats = RunningStats()
+  for i in range(0, len(data), chunk_rows):
+    stats.update(data[i:i+chunk_rows])
+  return stats
@@ -0,0 +1,100 @@
+'''
+PCA compression of the normalized input/output vertex spaces.
+
+A truncated basis is fit on the normalized (zero mean) data, the MLP
+trains on basis coefficients, and the basis is folded back into the saved
+nn.Sequential as fixed projection/reconstruction Linear layers. Inference
+(infer_model, the server and the exports) uses the model unchanged.
+'''
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def n_components(variances, spec=0.0):
+  '''
+  spec >= 1 is a number of components, 0 < spec < 1 the fraction of
+  variance the components must explain
+  '''
+  if spec >= 1:
+    return int(min(spec, len(variances)))
+  ratio = np.cumsum(variances) / max(variances.sum(), np.finfo(np.float64).tiny)
+  return int(min(np.searchsorted(ratio, spec) + 1, len(variances)))
+
+
+def fit_basis(data_norm, spec=0.0):
+  '''
+  orthonormal (cols, k) basis of the top principal components of zero mean
+  data_norm, from the smaller of the two gram matrices
+  Returns tuple (basis, explained_variance_ratio)
+  '''
+  data = np.asarray(data_norm, dtype=np.float64)
+  data = data.reshape(-1, data.shape[-1])
+  rows, cols = data.shape
+
+  if rows < cols:
+    # (rows, rows) gram, basis vectors are data.T @ u / s
+    eig_vals, eig_vecs = np.linalg.eigh(data @ data.T)
+  else:
+    eig_vals, eig_vecs = np.linalg.eigh(data.T @ data)
+  order = np.argsort(eig_vals)[::-1]
+  eig_vals = np.maximum(eig_vals[order], 0.0)
+  eig_vecs = eig_vecs[:, order]
+
+  k = n_components(eig_vals, spec)
+
+  # components past the numerical rank (<= rows-1 for mean-centered data)
+  # are noise, they can't be normalized into an orthonormal basis
+  tol = np.finfo(np.float64).eps * max(eig_vals[0] if len(eig_vals) else 0.0, 0.0) * max(rows, cols)
+  rank = int((eig_vals > tol).sum())
+  if k > rank:
+    print("PCA: %d components requested, data rank is %d, using %d" % (k, rank, rank))
+    k = rank
+
+  if rows < cols:
+    s = np.sqrt(eig_vals[:k])
+    basis = (data.T @ eig_vecs[:, :k]) / s
+  else:
+    basis = eig_vecs[:, :k]
+
+  explained = eig_vals[:k].sum() / max(eig_vals.sum(), np.finfo(np.float64).tiny)
+  return basis.astype(np.float32), float(explained)
+
+
+def project(data_norm, basis):
+  '''basis coefficients of normalized rows (tensor or numpy)'''
+  if torch.is_tensor(data_norm):
+    return data_norm @ torch.from_numpy(basis)
+  return np.asarray(data_norm, dtype=np.float32) @ basis
+
+
+def _fixed_linear(weight):
+  layer = nn.Linear(weight.shape[1], weight.shape[0], bias=False)
+  with torch.no_grad():
+    layer.weight.copy_(torch.from_numpy(np.ascontiguousarray(weight)))
+  layer.weight.requires_grad_(False)
+  return layer
+
+
+def wrap_model(model, inputs_basis=None, outputs_basis=None):
+  '''
+  fold the bases into one nn.Sequential:
+  [inputs projection] + model layers + [outputs reconstruction]
+  '''
+  layers = []
+  if inputs_basis is not None:
+    layers.append(_fixed_linear(inputs_basis.T))
+  layers.extend(model)
+  if outputs_basis is not None:
+    layers.append(_fixed_linear(outputs_basis))
+  return nn.Sequential(*layers)
+
+
+def save_basis(path='', inputs_basis=None, outputs_basis=None):
+  '''bases (when used) as .npz next to the model'''
+  arrays = {}
+  if inputs_basis is not None:
+    arrays['inputs_basis'] = inputs_basis
+  if outputs_basis is not None:
+    arrays['outputs_basis'] = outputs_basis
+  np.savez(path, **arrays)
@@ -0,0 +1,127 @@
+'''
+On-disk cache of predicted rows, used by the Maya UI predict step.
+
+A predicted row is stored under a sha1 of the neutral row (float32 points)
+plus the hash of the model artifacts (model.pt and the four stats files),
+so editing one neutral only re-predicts that mesh and retraining the model
+invalidates everything. Needs numpy but not torch, it runs inside Maya.
+
+Rows are .npy files in $BSG_PREDICT_CACHE_DIR (~/.bshapegen/predict_cache),
+the least recently used are evicted above $BSG_PREDICT_CACHE_MB (1024).
+'''
+import os
+import hashlib
+import numpy as np
+
+import bshapegen.utils as utils
+
+CACHE_DIR = os.environ.get('BSG_PREDICT_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.bshapegen', 'predict_cache'))
+DEFAULT_MAX_BYTES = int(float(os.environ.get('BSG_PREDICT_CACHE_MB', 1024)) * 1024 * 1024)
+
+
+class PredictCache(object):
+  def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.enabled = max_bytes > 0
+    # sha1 per (path, mtime, size), the model is only re-hashed when it changes
+    self._file_hashes = {}
+
+
+  def model_hash(self, model_paths={}):
+    '''
+    hash of the model artifacts, model_paths is utils.model_paths()
+    Returns None if one of them doesn't exist (no model built yet)
+    '''
+    sha1 = hashlib.sha1()
+    for name in sorted(model_paths):
+      path = model_paths[name]
+      if not os.path.isfile(path):
+        print('Model file not found:', path)
+        return None
+      st = os.stat(path)
+      file_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+      if file_key not in self._file_hashes:
+        self._file_hashes[file_key] = utils.file_sha1(path)
+      sha1.update(self._file_hashes[file_key].encode('ascii'))
+    return sha1.hexdigest()
+
+
+  def key(self, row, model_hash=''):
+    sha1 = hashlib.sha1(np.ascontiguousarray(row, dtype='<f4').tobytes())
+    sha1.update(model_hash.encode('ascii'))
+    return sha1.hexdigest()
+
+
+  def _path(self, key=''):
+    return os.path.join(self.cache_dir, key + '.npy')
+
+
+  def get(self, key=''):
+    '''cached predicted row or None'''
+    path = self._path(key)
+    if not (self.enabled and os.path.exists(path)):
+      return None
+    # mtime is the last use for LRU eviction
+    os.utime(path)
+    return np.load(path)
+
+
+  def put(self, key='', row=None):
+    if not self.enabled:
+      return
+    if not os.path.exists(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    tmp_path = self._path(key) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.save(f, np.asarray(row, dtype=np.float32))
+    os.replace(tmp_path, self._path(key))
+
+
+  def evict(self):
+    '''drop least recently used rows until the cache fits max_bytes'''
+    if not os.path.exists(self.cache_dir):
+      return
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      if name.endswith('.npy'):
+        path = os.path.join(self.cache_dir, name)
+        st = os.stat(path)
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in entries:
+      if total <= self.max_bytes:
+        break
+      os.remove(path)
+      total -= size
+
+
+  def predict(self, rows, model_paths={}, predict_func=None):
+    '''
+    predicted rows for neutral rows, only cache misses are passed (as one
+    array) to predict_func, which returns their predicted rows or None on
+    failure
+    Returns tuple ((rows, cols) float32 array or None, hit count), None
+    also when the model files are missing
+    '''
+    rows = np.asarray(rows, dtype=np.float32)
+    model_hash = self.model_hash(model_paths)
+    if model_hash is None:
+      return None, 0
+    keys = [self.key(row, model_hash) for row in rows]
+
+    cached = [self.get(key) for key in keys]
+    miss_ids = [i for i, row in enumerate(cached) if row is None]
+    if miss_ids:
+      predicted = predict_func(rows[miss_ids])
+      if predicted is None:
+        return None, len(rows) - len(miss_ids)
+      predicted = np.asarray(predicted, dtype=np.float32).reshape(len(miss_ids), -1)
+      for i, row in zip(miss_ids, predicted):
+        cached[i] = row
+        self.put(keys[i], row)
+      self.evict()
+
+    return np.stack(cached) if cached else np.empty((0, 0), dtype=np.float32), len(rows) - len(miss_ids)
@@ -0,0 +1,102 @@
+'''
+Opt-in profiling of builds and predictions (build_model.py/infer_model.py
+--profile, or a Profiler passed to train()/bundle.predict()).
+
+torch.profiler records training steps (one per batch) or inference forward
+passes (one per chunk) on a wait/warmup/active schedule. Only the active
+steps pay the recording overhead. cProfile covers the Python side of
+loading and normalization. Files are written with the prefix, ie.
+model_profile:
+
+  model_profile_trace.json   Chrome trace (chrome://tracing, ui.perfetto.dev)
+  model_profile_ops.txt      top operators by self CPU time
+  model_profile_load.prof    cProfile stats of a stage (pstats, snakeviz)
+  model_profile_load.txt     top functions of a stage by cumulative time
+'''
+import io
+import pstats
+import cProfile
+import contextlib
+import torch
+
+
+class Profiler(object):
+  def __init__(self, prefix='', wait=0, warmup=1, active=5, top=20):
+    self.prefix = prefix
+    self.wait = wait
+    self.warmup = warmup
+    self.active = active
+    self.top = top
+    self.paths = []
+    self._prof = None
+    self._depth = 0
+
+
+  def start(self):
+    '''
+    start torch.profiler, call step() after every batch/chunk and stop() at
+    the end. Nested start/stop pairs record into the outermost one
+    '''
+    self._depth += 1
+    if self._depth > 1:
+      return self
+    self._prof = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                        schedule=torch.profiler.schedule(wait=self.wait,
+                                                                         warmup=self.warmup,
+                                                                         active=self.active,
+                                                                         repeat=1),
+                                        on_trace_ready=self._trace_ready,
+                                        record_shapes=True)
+    self._prof.start()
+    return self
+
+
+  def step(self):
+    if self._prof is not None:
+      self._prof.step()
+
+
+  def stop(self):
+    '''stop recording, a run shorter than the schedule writes what was recorded'''
+    self._depth = max(self._depth - 1, 0)
+    if self._depth == 0 and self._prof is not None:
+      self._prof.stop()
+      self._prof = None
+
+
+  def _save(self, path='', text=''):
+    with open(path, 'w') as fp:
+      fp.write(text)
+    self.paths.append(path)
+    print('Saved:', path)
+
+
+  def _trace_ready(self, prof):
+    trace_path = self.prefix + '_trace.json'
+    prof.export_chrome_trace(trace_path)
+    self.paths.append(trace_path)
+    print('Saved:', trace_path)
+    self._save(self.prefix + '_ops.txt',
+               prof.key_averages().table(sort_by='self_cpu_time_total', row_limit=self.top))
+
+
+  @contextlib.contextmanager
+  def python_stage(self, name=''):
+    '''cProfile the block, stats are saved as <prefix>_<name>.prof/.txt'''
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+      yield
+    finally:
+      profile.disable()
+      prof_path = '%s_%s.prof' % (self.prefix, name)
+      profile.dump_stats(prof_path)
+      self.paths.append(prof_path)
+      buf = io.StringIO()
+      pstats.Stats(profile, stream=buf).sort_stats('cumulative').print_stats(self.top)
+      self._save('%s_%s.txt' % (self.prefix, name), buf.getvalue())
+
+
+def stage(profiler=None, name=''):
+  '''profiler.python_stage(name), or a no-op context without a profiler'''
+  return profiler.python_stage(name) if profiler else contextlib.nullcontext()
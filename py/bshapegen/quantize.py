@@ -0,0 +1,73 @@
+'''
+Dynamic int8 quantization of the nn.Linear layers for CPU inference.
+
+Weights are stored as int8, activations are quantized on the fly, so no
+calibration data is needed. quant_report compares size, latency and
+per-vertex error (xyz distance) against the fp32 model, so the accuracy
+loss can be checked per asset before using the quantized model.
+'''
+import io
+import time
+import warnings
+import numpy as np
+import torch
+import torch.nn as nn
+
+import bshapegen.evaluate as evaluate
+
+
+def quantize_model(model):
+  '''int8 dynamic quantized copy of model (nn.Linear layers only)'''
+  model.eval()
+  with warnings.catch_warnings():
+    # torch.ao.quantization is deprecated in favour of torchao, which is not a dependency
+    warnings.simplefilter('ignore')
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def model_size(model):
+  '''bytes of the serialized state_dict'''
+  buf = io.BytesIO()
+  torch.save(model.state_dict(), buf)
+  return buf.tell()
+
+
+def _latency(model, sample, stats, calls=20):
+  '''median ms per run_model call'''
+  import bshapegen.infer_model as infer_model
+
+  infer_model.run_model(model, sample, *stats) # warm up
+  timings = []
+  for i in range(calls):
+    start_time = time.perf_counter()
+    infer_model.run_model(model, sample, *stats)
+    timings.append(time.perf_counter() - start_time)
+  return float(np.median(timings))*1000.0
+
+
+def quant_report(model, qmodel, stats, predict_data, calls=20):
+  '''
+  size, latency and per-vertex error of qmodel against the fp32 model on
+  predict_data rows, stats is (inputs_mean, inputs_std, outputs_mean,
+  outputs_std) tensors
+  Returns dict {'fp32':{...}, 'int8':{...}}
+  '''
+  import bshapegen.infer_model as infer_model
+
+  predict_data = np.asarray(predict_data, dtype=np.float32).reshape(-1, stats[0].shape[-1])
+  baseline = infer_model.run_model(model, predict_data, *stats)
+  y_pred = infer_model.run_model(qmodel, predict_data, *stats)
+  errors = evaluate.vertex_errors(y_pred, baseline)
+
+  report = {}
+  for name, _model in [('fp32', model), ('int8', qmodel)]:
+    report[name] = {'size_bytes':model_size(_model),
+                    'per_call_ms':_latency(_model, predict_data[:1], stats, calls),
+                    'batch_ms':_latency(_model, predict_data, stats, max(1, calls // 4))}
+  report['int8'].update({'vertex_error_mean':float(errors.mean()),
+                         'vertex_error_p99':float(np.percentile(errors, 99)),
+                         'vertex_error_max':float(errors.max())})
+
+  for name, values in report.items():
+    print('[%s] %s' % (name, ' '.join('[%s: %g]' % item for item in values.items())))
+  return report
@@ -0,0 +1,341 @@
+'''
+Warm-start incremental retraining when new neutral/pose pairs are added.
+
+The saved mean/std are updated with the new rows (norm_stats.RunningStats,
+no pass over the old data), the first and last Linear layers are rescaled
+so the model predicts exactly what it did under the old stats, then it is
+fine-tuned for a few epochs on the new rows plus a random replay sample
+of the old rows. The new model and stats are written next to the old
+ones with a suffix (model_incr.pt, in_mean_incr.npy, ...).
+
+The data a retrained model was trained on (old plus new files and their
+row count) is saved to <model>_retrain.json, so retraining it again merges
+into stats of the right row count.
+'''
+import os
+import sys
+import json
+import time
+import click
+import numpy as np
+import torch
+import torch.nn as nn
+
+# allow running as a script (python retrain.py) as well as a module
+if __package__ in (None, ''):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bshapegen.vtx_io as vtx_io
+import bshapegen.norm_stats as norm_stats
+import bshapegen.build_model as build_model
+import bshapegen.infer_model as infer_model
+
+
+def params_path(model_pt=''):
+  '''model_incr.pt -> model_incr_retrain.json'''
+  return os.path.splitext(model_pt)[0] + '_retrain.json'
+
+
+def load_rows(path=''):
+  '''memory-mapped 2d rows of a data file (a one row .m file loads 1d)'''
+  rows = vtx_io.load_vtx(path)
+  return rows.reshape(1,-1) if rows.ndim == 1 else rows
+
+
+class ConcatRows(object):
+  '''
+  rows of several (memory-mapped) arrays indexed as one array, only the
+  indexed rows are read
+  '''
+  def __init__(self, arrays=[]):
+    self.arrays = list(arrays)
+    self.offsets = np.cumsum([0] + [len(array) for array in self.arrays])
+    self.shape = (int(self.offsets[-1]), self.arrays[0].shape[-1])
+
+
+  def __len__(self):
+    return self.shape[0]
+
+
+  def __getitem__(self, ids):
+    ids = np.asarray(ids, dtype=np.int64)
+    array_ids = np.searchsorted(self.offsets, ids, side='right') - 1
+    rows = np.empty((len(ids), self.shape[1]), dtype=self.arrays[0].dtype)
+    for i, array in enumerate(self.arrays):
+      mask = array_ids == i
+      if mask.any():
+        rows[mask] = array[ids[mask] - self.offsets[i]]
+    return rows
+
+
+def training_data(model_pt=''):
+  '''
+  data files model_pt and its stats were trained on, from its retrain json
+  or make_model_params.json
+  Returns tuple (input_paths, output_paths, row_count or None)
+  '''
+  if os.path.exists(params_path(model_pt)):
+    with open(params_path(model_pt), 'r') as fp:
+      params = json.load(fp)
+    return params['input_paths'], params['output_paths'], params['row_count']
+
+  params_json = os.path.join(os.path.dirname(model_pt),'make_model_params.json')
+  if not os.path.exists(params_json):
+    raise click.UsageError('No --old_input/--old_output, %s or %s' % (params_path(model_pt), params_json))
+  with open(params_json, 'r') as fp:
+    params = json.load(fp)
+  return [params['model_input_m']], [params['model_output_m']], None
+
+
+def update_stats(mean, std, count, new_data):
+  '''RunningStats of count rows saved as mean/std plus the new_data rows'''
+  stats = norm_stats.RunningStats.from_mean_std(mean, std, count=count)
+  return stats.merge(norm_stats.chunk_stats(new_data))
+
+
+def _with_bias(layer):
+  '''PCA projection layers have no bias, a rescaled layer needs one'''
+  if layer.bias is not None:
+    return layer
+  new_layer = nn.Linear(layer.in_features, layer.out_features)
+  with torch.no_grad():
+    new_layer.weight.copy_(layer.weight)
+    new_layer.bias.zero_()
+  new_layer.weight.requires_grad_(layer.weight.requires_grad)
+  new_layer.bias.requires_grad_(layer.weight.requires_grad)
+  return new_layer
+
+
+def rescale_model(model, old_stats, new_stats):
+  '''
+  fold the change from old_stats to new_stats (each (inputs_mean,
+  inputs_std, outputs_mean, outputs_std) arrays) into the first and last
+  Linear layers, so model(new normalized x) denormalized with new_stats
+  equals the old prediction
+  Returns the rescaled model
+  '''
+  old_in_mean, old_in_std, old_out_mean, old_out_std = [np.asarray(stat, dtype=np.float64).reshape(-1)
+                                                       for stat in old_stats]
+  new_in_mean, new_in_std, new_out_mean, new_out_std = [np.asarray(stat, dtype=np.float64).reshape(-1)
+                                                       for stat in new_stats]
+  eps = norm_stats.EPS
+  linear_ids = [i for i, layer in enumerate(model) if isinstance(layer, nn.Linear)]
+  first_id, last_id = linear_ids[0], linear_ids[-1]
+  model[first_id] = _with_bias(model[first_id])
+  model[last_id] = _with_bias(model[last_id])
+
+  # x_old_norm = scale * x_new_norm + shift
+  in_scale = (new_in_std + eps) / (old_in_std + eps)
+  in_shift = (new_in_mean - old_in_mean) / (old_in_std + eps)
+
+  # y_new_norm = y_old_norm * scale + shift, constant columns stay at the mean
+  safe_std = np.where(new_out_std > 0, new_out_std, 1.0)
+  out_scale = np.where(new_out_std > 0, old_out_std / safe_std, 0.0)
+  out_shift = np.where(new_out_std > 0, (old_out_mean - new_out_mean) / safe_std, 0.0)
+
+  with torch.no_grad():
+    first = model[first_id]
+    weight = first.weight.double()
+    first.bias.add_((weight @ torch.from_numpy(in_shift)).float())
+    first.weight.mul_(torch.from_numpy(in_scale).float().reshape(1,-1))
+
+    last = model[last_id]
+    out_scale = torch.from_numpy(out_scale).float()
+    last.weight.mul_(out_scale.reshape(-1,1))
+    last.bias.mul_(out_scale).add_(torch.from_numpy(out_shift).float())
+  return model
+
+
+def replay_rows(row_num, replay=4.0, new_row_num=0, seed=None):
+  '''sorted random old row ids, replay old rows per new row'''
+  rng = np.random.default_rng(seed)
+  size = min(row_num, int(round(replay * new_row_num)))
+  return np.sort(rng.choice(row_num, size=size, replace=False))
+
+
+def retrain_model(model,
+                  stats,
+                  new_inputs,
+                  new_outputs,
+                  old_inputs,
+                  old_outputs,
+                  replay=4.0,
+                  learning_rate=0.0001,
+                  epochs=20,
+                  validation_split=0.0,
+                  batch_size=0,
+                  seed=None):
+  '''
+  update stats with the new rows, rescale and fine-tune model on the new
+  rows plus replay*len(new_inputs) random old rows
+  stats is (inputs_mean, inputs_std, outputs_mean, outputs_std) arrays of
+  the old_inputs/old_outputs rows (arrays or ConcatRows)
+  Returns tuple (model, new_stats, train_loss_history, validation_loss_history)
+  '''
+  if seed is not None:
+    torch.manual_seed(seed)
+
+  new_inputs = np.asarray(new_inputs, dtype=np.float32).reshape(-1, old_inputs.shape[-1])
+  new_outputs = np.asarray(new_outputs, dtype=np.float32).reshape(-1, old_outputs.shape[-1])
+  old_count = len(old_inputs)
+
+  input_stats = update_stats(stats[0], stats[1], old_count, new_inputs)
+  output_stats = update_stats(stats[2], stats[3], old_count, new_outputs)
+  new_stats = (input_stats.mean, input_stats.std, output_stats.mean, output_stats.std)
+  model = rescale_model(model, stats, new_stats)
+
+  # memory-mapped old data, only the replay rows are read
+  replay_ids = replay_rows(old_count, replay, len(new_inputs), seed=seed)
+  inputs = np.concatenate([new_inputs, old_inputs[replay_ids]])
+  outputs = np.concatenate([new_outputs, old_outputs[replay_ids]])
+
+  # mix new and old rows so a validation split holds out both
+  shuffle_ids = np.random.default_rng(seed).permutation(len(inputs))
+  inputs_norm = torch.from_numpy(input_stats.normalize(inputs[shuffle_ids]).astype(np.float32))
+  outputs_norm = torch.from_numpy(output_stats.normalize(outputs[shuffle_ids]).astype(np.float32))
+
+  print("fine-tune rows: %d new + %d replay" % (len(new_inputs), len(replay_ids)))
+
+  optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad],
+                               lr=learning_rate)
+  train_loss, val_loss = build_model.fit(model,
+                                         inputs_norm,
+                                         outputs_norm,
+                                         nn.MSELoss(),
+                                         optimizer,
+                                         epochs=epochs,
+                                         validation_split=validation_split,
+                                         batch_size=batch_size)
+  model.eval()
+  return model, new_stats, train_loss, val_loss
+
+
+def suffixed(path='', suffix='_incr'):
+  '''model.pt -> model_incr.pt'''
+  stem, ext = os.path.splitext(path)
+  return stem + suffix + ext
+
+
+@click.command()
+@click.argument('model_pt', type=click.Path(exists=True))
+@click.argument('inputs_mean_m', type=click.Path(exists=True))
+@click.argument('inputs_std_m', type=click.Path(exists=True))
+@click.argument('outputs_mean_m', type=click.Path(exists=True))
+@click.argument('outputs_std_m', type=click.Path(exists=True))
+@click.argument('new_input_m', type=click.Path(exists=True))
+@click.argument('new_output_m', type=click.Path(exists=True))
+@click.option('--old_input', default='', help='training inputs of MODEL_PT (default from its retrain json or make_model_params.json)')
+@click.option('--old_output', default='', help='training outputs of MODEL_PT (default from its retrain json or make_model_params.json)')
+@click.option('--replay', default=4.0, help='old rows replayed per new row')
+@click.option('--learning_rate', default=0.0001, help='0.0001')
+@click.option('--epochs', default=20, help='fine-tune epochs')
+@click.option('--validation_split', default=0.0, help='0.0 (0%)')
+@click.option('--batch_size', default=0, help='0 = full batch, 32,64,etc..')
+@click.option('--suffix', default='_incr', help='new model/stats are written next to the old ones with this suffix')
+@click.option('--seed', default=None, type=int, help='seed for the replay sample and shuffling')
+def retrain(model_pt='',
+            inputs_mean_m='',
+            inputs_std_m='',
+            outputs_mean_m='',
+            outputs_std_m='',
+            new_input_m='',
+            new_output_m='',
+            old_input='',
+            old_output='',
+            replay=4.0,
+            learning_rate=0.0001,
+            epochs=20,
+            validation_split=0.0,
+            batch_size=0,
+            suffix='_incr',
+            seed=None):
+  '''
+  Fine-tune MODEL_PT on NEW_INPUT_M/NEW_OUTPUT_M plus a replay sample of
+  its old training data instead of a full make_model rebuild
+  '''
+  # start timer
+  start_time = time.time()
+
+  # data of the model (and the row count of its stats)
+  row_count = None
+  if old_input and old_output:
+    input_paths, output_paths = [old_input], [old_output]
+  else:
+    input_paths, output_paths, row_count = training_data(model_pt)
+    input_paths = [old_input] if old_input else input_paths
+    output_paths = [old_output] if old_output else output_paths
+
+  old_inputs = ConcatRows([load_rows(path) for path in input_paths])
+  old_outputs = ConcatRows([load_rows(path) for path in output_paths])
+  if len(old_inputs) != len(old_outputs):
+    raise click.UsageError('Old input and output row counts differ: %d, %d' % (len(old_inputs), len(old_outputs)))
+  if row_count is not None and len(old_inputs) != row_count:
+    raise click.UsageError('%s names %d rows, the files now have %d' % (params_path(model_pt), row_count, len(old_inputs)))
+  new_inputs = load_rows(new_input_m)
+  new_outputs = load_rows(new_output_m)
+
+  print("old data shape:", old_inputs.shape, old_outputs.shape)
+  print("new data shape:", new_inputs.shape, new_outputs.shape)
+
+  model = infer_model.load_model(model_pt)
+  stats = [stat.numpy() for stat in infer_model.load_stats(inputs_mean_m,
+                                                           inputs_std_m,
+                                                           outputs_mean_m,
+                                                           outputs_std_m)]
+
+  # error of the old model on the new rows, before fine-tuning
+  before = infer_model.run_model(model, new_inputs, *[torch.from_numpy(stat) for stat in stats])
+  print("new rows mean abs error before: %f" % np.abs(before - new_outputs).mean())
+
+  model, new_stats, train_loss, val_loss = retrain_model(model,
+                                                         stats,
+                                                         new_inputs,
+                                                         new_outputs,
+                                                         old_inputs,
+                                                         old_outputs,
+                                                         replay=replay,
+                                                         learning_rate=learning_rate,
+                                                         epochs=epochs,
+                                                         validation_split=validation_split,
+                                                         batch_size=batch_size,
+                                                         seed=seed)
+
+  new_stats = [torch.FloatTensor(stat).reshape(1,-1) for stat in new_stats]
+  after = infer_model.run_model(model, new_inputs, *new_stats)
+  print("new rows mean abs error after: %f" % np.abs(after - new_outputs).mean())
+
+  # save model and stats next to the old ones
+  new_model_pt = suffixed(model_pt, suffix)
+  torch.save(model, new_model_pt)
+  for m_path, stat in zip([inputs_mean_m, inputs_std_m, outputs_mean_m, outputs_std_m], new_stats):
+    vtx_io.write_vtx(suffixed(m_path, suffix), stat.numpy())
+  print('Saved:', new_model_pt)
+
+  # the data of the new stats, read by the next retrain of new_model_pt
+  with open(params_path(new_model_pt), 'w') as fp:
+    json.dump({'model_pt':model_pt,
+               'new_model_pt':new_model_pt,
+               'input_paths':[os.path.abspath(path) for path in input_paths + [new_input_m]],
+               'output_paths':[os.path.abspath(path) for path in output_paths + [new_output_m]],
+               'row_count':len(old_inputs) + len(new_inputs),
+               'new_input_m':new_input_m,
+               'new_output_m':new_output_m,
+               'replay':replay,
+               'learning_rate':learning_rate,
+               'epochs':epochs,
+               'validation_split':validation_split,
+               'batch_size':batch_size,
+               'suffix':suffix,
+               'seed':seed}, fp, indent=2)
+
+  # end timer
+  seconds = time.time() - start_time
+  m, s = divmod(seconds, 60)
+  h, m = divmod(m, 60)
+  print
+  print( "--- retrain - elapsed time: %d:%02d:%0.2f ---" % (h, m, s))
+  print
+
+
+if __name__ == '__main__':
+  retrain()
@@ -0,0 +1,260 @@
+'''
+Sharded training data for out-of-core training.
+
+A shard directory holds .npy files (sorted by name), each one a block of
+rows. The input and output directories must have the same number of shards
+with matching row counts. Shards are memory-mapped and streamed in batches,
+the full dataset is never loaded.
+'''
+import os
+import glob
+import queue
+import threading
+import numpy as np
+import torch
+
+import bshapegen.vtx_io as vtx_io
+import bshapegen.norm_stats as norm_stats
+
+EPS = norm_stats.EPS
+
+
+def shard_paths(shard_dir=''):
+  '''sorted .npy shard paths in shard_dir'''
+  path_list = sorted(glob.glob(os.path.join(shard_dir, '*'+vtx_io.NPY_EXT)))
+  if not path_list:
+    raise ValueError('No %s shards found in: %s' % (vtx_io.NPY_EXT, shard_dir))
+  return path_list
+
+
+def shard_shape(path=''):
+  '''(rows, cols) of a shard from its header, without mapping the data'''
+  with open(path, 'rb') as f:
+    descr, shape, offset = vtx_io.read_npy_header(f)
+  if len(shape) == 1:
+    return 1, shape[0]
+  return shape
+
+
+def check_shards(input_paths=[], output_paths=[]):
+  '''
+  make sure input and output shards pair up
+  Returns tuple (rows, input_cols, output_cols)
+  '''
+  if len(input_paths) != len(output_paths):
+    raise ValueError('Input/output shard count differs: %d != %d' % (len(input_paths), len(output_paths)))
+
+  rows = 0
+  input_cols = output_cols = None
+  for input_path, output_path in zip(input_paths, output_paths):
+    i_rows, i_cols = shard_shape(input_path)
+    o_rows, o_cols = shard_shape(output_path)
+    if i_rows != o_rows:
+      raise ValueError('Shard row count differs: %s (%d) != %s (%d)' % (input_path, i_rows, output_path, o_rows))
+    if input_cols not in (None, i_cols) or output_cols not in (None, o_cols):
+      raise ValueError('Shard column count differs: %s' % input_path)
+    input_cols, output_cols = i_cols, o_cols
+    rows += i_rows
+  return rows, input_cols, output_cols
+
+
+def write_shards(data=[], shard_dir='', shard_rows=1024, prefix='shard'):
+  '''
+  split rows of data (numpy array or list of rows) into .npy shards
+  Returns list of written shard paths
+  '''
+  if not os.path.exists(shard_dir):
+    os.makedirs(shard_dir)
+
+  path_list = []
+  for i in range(0, len(data), shard_rows):
+    path = os.path.join(shard_dir, '%s_%05d%s' % (prefix, i // shard_rows, vtx_io.NPY_EXT))
+    vtx_io.write_vtx(path, data[i:i+shard_rows])
+    path_list.append(path)
+  return path_list
+
+
+def load_shard(path=''):
+  '''memory-map a shard as a 2d array'''
+  data = vtx_io.load_vtx(path)
+  return data.reshape(-1, data.shape[-1])
+
+
+def shard_stats(path_list=[], chunk_rows=4096):
+  '''
+  per column mean and std over all shards in one streaming pass
+  (per shard norm_stats.RunningStats, merged)
+  Returns tuple (mean, std)
+  '''
+  stats = norm_stats.RunningStats()
+  for path in path_list:
+    stats.merge(norm_stats.chunk_stats(load_shard(path), chunk_rows))
+  return stats.mean, stats.std
+
+
+class ShardBatches(torch.utils.data.IterableDataset):
+  '''
+  Stream normalized (inputs, outputs) batches from memory-mapped shards.
+  The last validation_split rows of every shard are the validation rows,
+  split='train' iterates the others shuffled (shard order and rows within
+  a shard), split='val' iterates the validation rows in order.
+  With DataLoader workers every worker streams its own subset of shards.
+  '''
+  def __init__(self,
+               input_paths=[],
+               output_paths=[],
+               stats=None,
+               batch_size=256,
+               validation_split=0.0,
+               split='train'):
+    super(ShardBatches, self).__init__()
+    check_shards(input_paths, output_paths)
+    self.input_paths = list(input_paths)
+    self.output_paths = list(output_paths)
+    # (inputs_mean, inputs_std, outputs_mean, outputs_std) as float32
+    self.stats = [np.asarray(stat, dtype=np.float32).reshape(1,-1) for stat in stats]
+    self.batch_size = batch_size
+    self.validation_split = validation_split or 0.0
+    self.split = split
+
+
+  def row_range(self, rows=0):
+    '''train or validation rows of a shard with rows rows'''
+    val_split_id = int(rows*(1-self.validation_split))
+    if self.split == 'val':
+      return val_split_id, rows
+    return 0, val_split_id
+
+
+  def row_count(self):
+    count = 0
+    for path in self.input_paths:
+      start, end = self.row_range(shard_shape(path)[0])
+      count += end - start
+    return count
+
+
+  def _norm(self, data, mean, std):
+    # fancy indexing already copied out of the memory-map
+    data = np.asarray(data, dtype=np.float32)
+    data -= mean
+    data /= (std + EPS)
+    return torch.from_numpy(data)
+
+
+  def __iter__(self):
+    shuffle = self.split == 'train'
+    shard_ids = list(range(len(self.input_paths)))
+    if shuffle:
+      shard_ids = torch.randperm(len(shard_ids)).tolist()
+
+    # split shards between DataLoader workers
+    worker_info = torch.utils.data.get_worker_info()
+    if worker_info is not None:
+      shard_ids = shard_ids[worker_info.id::worker_info.num_workers]
+
+    inputs_mean, inputs_std, outputs_mean, outputs_std = self.stats
+
+    for shard_id in shard_ids:
+      inputs = load_shard(self.input_paths[shard_id])
+      outputs = load_shard(self.output_paths[shard_id])
+      start, end = self.row_range(len(inputs))
+      if end <= start:
+        continue
+
+      if shuffle:
+        row_ids = torch.randperm(end - start).numpy() + start
+      else:
+        row_ids = np.arange(start, end)
+
+      for i in range(0, len(row_ids), self.batch_size):
+        # sorted ids read the memory-map front to back
+        batch_ids = np.sort(row_ids[i:i+self.batch_size])
+        yield (self._norm(inputs[batch_ids], inputs_mean, inputs_std),
+               self._norm(outputs[batch_ids], outputs_mean, outputs_std))
+
+
+def prefetch(iterable, size=2):
+  '''
+  iterate iterable in a background thread, at most size items ahead
+  the thread is stopped and joined when the consumer stops early (break,
+  exception or close()), so it doesn't keep shard memory-maps open
+  '''
+  if size <= 0:
+    for item in iterable:
+      yield item
+    return
+
+  done = object()
+  items = queue.Queue(maxsize=size)
+  stop = threading.Event()
+  errors = []
+
+  def _put(item):
+    while not stop.is_set():
+      try:
+        items.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _produce():
+    iterator = iter(iterable)
+    try:
+      for item in iterator:
+        if not _put(item):
+          break
+    except Exception as e:
+      errors.append(e)
+    finally:
+      # close generators here, in the thread that runs them
+      if hasattr(iterator, 'close'):
+        iterator.close()
+      _put(done)
+
+  thread = threading.Thread(target=_produce, daemon=True)
+  thread.start()
+
+  try:
+    while True:
+      item = items.get()
+      if item is done:
+        break
+      yield item
+  finally:
+    stop.set()
+    while True:
+      try:
+        items.get_nowait()
+      except queue.Empty:
+        break
+    thread.join()
+
+  if errors:
+    raise errors[0]
+
+
+class PrefetchBatches(object):
+  '''
+  re-iterable wrapper of ShardBatches with bounded prefetch, through
+  DataLoader workers (prefetch batches per worker) or a background thread
+  '''
+  def __init__(self, dataset, num_workers=0, prefetch_size=2):
+    self.dataset = dataset
+    self.num_workers = num_workers
+    self.prefetch_size = prefetch_size
+    self.loader = None
+    if num_workers > 0:
+      self.loader = torch.utils.data.DataLoader(dataset,
+                                                batch_size=None,
+                                                num_workers=num_workers,
+                                                prefetch_factor=max(prefetch_size, 1),
+                                                pin_memory=torch.cuda.is_available(),
+                                                persistent_workers=True)
+
+
+  def __iter__(self):
+    if self.loader is not None:
+      return iter(self.loader)
+    return prefetch(self.dataset, self.prefetch_size)
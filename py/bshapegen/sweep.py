@@ -0,0 +1,259 @@
+import os
+import sys
+import csv
+import json
+import math
+import time
+import click
+import random
+import shutil
+import itertools
+import multiprocessing
+import numpy as np
+import torch
+
+# allow running as a script (python sweep.py) as well as a module
+if __package__ in (None, ''):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bshapegen.vtx_io as vtx_io
+import bshapegen.build_model as build_model
+
+# make_model params a sweep spec can vary (and their make_model defaults)
+SWEEP_DEFAULTS = {'neuron_num':512,
+                  'learning_rate':0.001,
+                  'epochs':150,
+                  'batch_size':0}
+SWEEP_PARAMS = list(SWEEP_DEFAULTS.keys())
+
+RESULT_FIELDS = ['trial', 'seed'] + SWEEP_PARAMS + ['train_loss',
+                                                   'val_loss',
+                                                   'best_val_loss',
+                                                   'loss',
+                                                   'wall_time',
+                                                   'model_pt']
+
+# normalized data shared by the trials of a worker process
+_shared = {}
+
+
+def grid_trials(spec={}):
+  '''every combination of the spec value lists'''
+  for name, values in spec.items():
+    if not isinstance(values, list):
+      raise click.BadParameter('Grid search needs a list of values for: %s' % name)
+  names = list(spec.keys())
+  return [dict(zip(names, values)) for values in itertools.product(*[spec[name] for name in names])]
+
+
+def _sample(values, rng):
+  if isinstance(values, list):
+    return rng.choice(values)
+  low, high = values['min'], values['max']
+  if values.get('log'):
+    value = math.exp(rng.uniform(math.log(low), math.log(high)))
+  else:
+    value = rng.uniform(low, high)
+  if isinstance(low, int) and isinstance(high, int):
+    value = int(round(value))
+  return value
+
+
+def random_trials(spec={}, trials=10, seed=0):
+  '''
+  trials random picks, lists are sampled uniformly, {"min","max","log"}
+  ranges uniformly or log-uniformly (ints stay ints)
+  '''
+  rng = random.Random(seed)
+  return [{name:_sample(values, rng) for name, values in spec.items()} for i in range(trials)]
+
+
+def _init_worker(inputs_norm_npy, outputs_norm_npy, threads):
+  '''
+  runs once per worker process: limit torch threads so trials don't
+  oversubscribe the cores and map the shared normalized data
+  '''
+  torch.set_num_threads(threads)
+  torch.set_num_interop_threads(1)
+  # copy-on-write maps, pages are shared with the other workers
+  _shared['inputs_norm'] = torch.from_numpy(np.load(inputs_norm_npy, mmap_mode='c'))
+  _shared['outputs_norm'] = torch.from_numpy(np.load(outputs_norm_npy, mmap_mode='c'))
+
+
+def run_trial(trial):
+  '''train one trial, Returns its result dict'''
+  start_time = time.time()
+
+  params = {name:trial[name] for name in SWEEP_PARAMS}
+  model, train_loss, val_loss = build_model.train_model(_shared['inputs_norm'],
+                                                        _shared['outputs_norm'],
+                                                        validation_split=trial['validation_split'],
+                                                        seed=trial['seed'],
+                                                        **params)
+  wall_time = time.time() - start_time
+
+  torch.save(model, trial['model_pt'])
+
+  result = dict(trial)
+  result.update({'train_loss':train_loss[-1] if train_loss else None,
+                 'val_loss':val_loss[-1] if val_loss else None,
+                 'best_val_loss':min(val_loss) if val_loss else None,
+                 'wall_time':wall_time,
+                 'train_loss_history':train_loss,
+                 'val_loss_history':val_loss})
+  result['loss'] = trial_loss(result)
+  return result
+
+
+def trial_loss(result={}):
+  '''loss of the saved trial model, best validation (or final training) loss'''
+  loss = result['best_val_loss']
+  return loss if loss is not None else result['train_loss']
+
+
+def pick_best(results=[], target_loss=None):
+  '''
+  fastest trial with a best validation loss <= target_loss, or the lowest
+  best validation loss if no target is given or no trial meets it
+  trial models hold their best validation weights, without a validation
+  split the final training loss is compared
+  '''
+  if target_loss is not None:
+    passed = [result for result in results if result['loss'] <= target_loss]
+    if passed:
+      return min(passed, key=lambda result: result['wall_time'])
+    print('No trial reached target validation loss:', target_loss)
+  return min(results, key=lambda result: result['loss'])
+
+
+@click.command()
+@click.argument('model_input_m',  type=click.Path(exists=True))
+@click.argument('model_output_m', type=click.Path(exists=True))
+@click.argument('sweep_dir', type=click.Path(exists=False))
+@click.option('--spec', 'spec_json', required=True, type=click.Path(exists=True),
+              help='json {param: [values] or {"min","max","log"}} for '+','.join(SWEEP_PARAMS))
+@click.option('--search', default='grid', type=click.Choice(['grid', 'random']), help='grid or random')
+@click.option('--trials', default=10, help='number of random search trials')
+@click.option('--processes', default=0, help='parallel trials, 0 = cpu count')
+@click.option('--target_loss', default=None, type=float, help='pick the fastest trial reaching this best validation loss')
+@click.option('--validation_split', default=0.3, help='0.3 (30%)')
+@click.option('--seed', default=0, help='base seed, trial n uses seed+n')
+def sweep(model_input_m='',
+          model_output_m='',
+          sweep_dir='',
+          spec_json='',
+          search='grid',
+          trials=10,
+          processes=0,
+          target_loss=None,
+          validation_split=0.3,
+          seed=0):
+  '''
+  Hyperparameter sweep over make_model params. Trials run in a process
+  pool, results go to SWEEP_DIR/results.csv (and results.jsonl with the
+  loss histories). The picked model and its normalization stats are
+  copied to SWEEP_DIR as model.pt, in_mean.npy, in_std.npy, out_mean.npy
+  and out_std.npy.
+  '''
+  # start timer
+  start_time = time.time()
+
+  if not os.path.exists(sweep_dir):
+    os.makedirs(sweep_dir)
+
+  with open(spec_json, 'r') as fp:
+    spec = json.load(fp)
+  unknown = [name for name in spec if name not in SWEEP_PARAMS]
+  if unknown:
+    raise click.BadParameter('Unknown sweep params: %s' % ', '.join(unknown))
+
+  if search == 'grid':
+    trial_list = grid_trials(spec)
+  else:
+    trial_list = random_trials(spec, trials=trials, seed=seed)
+
+  for i, trial in enumerate(trial_list):
+    for name, value in SWEEP_DEFAULTS.items():
+      trial.setdefault(name, value)
+    trial.update({'trial':i,
+                  'seed':seed+i,
+                  'validation_split':validation_split,
+                  'model_pt':os.path.join(sweep_dir, 'trial_%04d.pt' % i)})
+
+  # normalize once, workers map the normalized data instead of each
+  # loading and normalizing their own copy
+  inputs = vtx_io.load_vtx(model_input_m)
+  outputs = vtx_io.load_vtx(model_output_m)
+  inputs_norm, inputs_mean, inputs_std = build_model.featNorm(inputs)
+  outputs_norm, outputs_mean, outputs_std = build_model.featNorm(outputs)
+
+  inputs_norm_npy = os.path.join(sweep_dir, '_inputs_norm.npy')
+  outputs_norm_npy = os.path.join(sweep_dir, '_outputs_norm.npy')
+  # workers memory-map the normalized data, removed even if a trial fails
+  try:
+    np.save(inputs_norm_npy, inputs_norm)
+    np.save(outputs_norm_npy, outputs_norm)
+    del inputs_norm, outputs_norm
+
+    processes = min(processes or os.cpu_count(), len(trial_list))
+    threads = max(1, os.cpu_count() // processes)
+    print('Sweep: %d trials, %d processes, %d torch threads each' % (len(trial_list), processes, threads))
+
+    results = []
+    results_jsonl = os.path.join(sweep_dir, 'results.jsonl')
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes,
+                  initializer=_init_worker,
+                  initargs=(inputs_norm_npy, outputs_norm_npy, threads)) as pool, \
+         open(results_jsonl, 'w') as fp:
+      for result in pool.imap_unordered(run_trial, trial_list):
+        results.append(result)
+        fp.write(json.dumps(result)+'\n')
+        fp.flush()
+        print('[Trial %d/%d] [%s] [train: %s] [loss: %s] [time: %0.2fs]'
+              % (result['trial']+1,
+                 len(trial_list),
+                 ' '.join('%s=%s' % (name, result[name]) for name in SWEEP_PARAMS),
+                 result['train_loss'],
+                 result['loss'],
+                 result['wall_time']))
+  finally:
+    for path in (inputs_norm_npy, outputs_norm_npy):
+      if os.path.exists(path):
+        os.remove(path)
+
+  # results table
+  results.sort(key=lambda result: result['trial'])
+  with open(os.path.join(sweep_dir, 'results.csv'), 'w', newline='') as fp:
+    writer = csv.DictWriter(fp, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(results)
+
+  # pick and copy the best model next to its normalization stats
+  best = pick_best(results, target_loss=target_loss)
+  shutil.copyfile(best['model_pt'], os.path.join(sweep_dir, 'model.pt'))
+  vtx_io.write_vtx(os.path.join(sweep_dir, 'in_mean.npy'), inputs_mean.reshape(1,-1))
+  vtx_io.write_vtx(os.path.join(sweep_dir, 'in_std.npy'), inputs_std.reshape(1,-1))
+  vtx_io.write_vtx(os.path.join(sweep_dir, 'out_mean.npy'), outputs_mean.reshape(1,-1))
+  vtx_io.write_vtx(os.path.join(sweep_dir, 'out_std.npy'), outputs_std.reshape(1,-1))
+
+  with open(os.path.join(sweep_dir, 'best.json'), 'w') as fp:
+    json.dump({name:best[name] for name in RESULT_FIELDS+['validation_split']}, fp, indent=2)
+
+  print('Best Trial: %d [%s] [loss: %s] [time: %0.2fs]'
+        % (best['trial'],
+           ' '.join('%s=%s' % (name, best[name]) for name in SWEEP_PARAMS),
+           best['loss'],
+           best['wall_time']))
+
+  # end timer
+  seconds = time.time() - start_time
+  m, s = divmod(seconds, 60)
+  h, m = divmod(m, 60)
+  print
+  print( "--- sweep - elapsed time: %d:%02d:%0.2f ---" % (h, m, s))
+  print
+
+
+if __name__ == '__main__':
+  sweep()
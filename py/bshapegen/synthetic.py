@@ -0,0 +1,76 @@
+'''
+Maya-free synthetic blendshape data, the numpy counterpart of
+maya/init_test_scene.py.
+
+A neutral is a vertical strip (a plane extruded up and down) whose edge
+rows are randomly scaled, the pose is the neutral bent from its middle
+row up by a random angle (like the bend deformer in the test scene).
+Rows are flattened x,y,z vertex data, the same layout bsg_tools exports.
+'''
+import math
+import numpy as np
+
+
+def grid_size(vtx_num=8):
+  '''(rows, cols) of a strip with about vtx_num vertices, 3x taller than wide'''
+  cols = max(2, int(round(math.sqrt(vtx_num / 3.0))))
+  rows = max(2, vtx_num // cols)
+  return rows, cols
+
+
+def make_neutral(rows=4, cols=2, rng=None):
+  '''
+  strip in the xy plane, height 3 (plane plus two extrusions), width 1
+  every edge row gets a random 0.9-1.5 scale in x and in its z profile
+  Returns (rows*cols, 3) float64 vertex positions
+  '''
+  rng = rng or np.random.default_rng()
+  y = np.linspace(-1.5, 1.5, rows)
+  x = np.linspace(-0.5, 0.5, cols)
+  xx, yy = np.meshgrid(x, y)
+
+  row_scale = rng.uniform(0.9, 1.5, size=(rows, 1))
+  xx = xx * row_scale
+  # extrusions fold out of the plane a little
+  zz = 0.25 * (yy / 1.5)**2 * row_scale
+
+  return np.stack([xx, yy, zz], axis=-1).reshape(-1, 3)
+
+
+def bend(points, angle_deg=45.0, low_bound=0.0):
+  '''
+  bend points above y=low_bound around the x axis so that the top row is
+  rotated by angle_deg (circular arc, length preserving along y)
+  '''
+  points = np.array(points, dtype=np.float64)
+  height = points[:,1].max() - low_bound
+  angle = math.radians(angle_deg)
+  if height <= 0 or angle == 0:
+    return points
+
+  radius = height / angle
+  above = points[:,1] > low_bound
+  t = (points[above,1] - low_bound) / radius
+  z = points[above,2]
+
+  # arc bending towards +z, z offsets stay perpendicular to the arc
+  points[above,1] = low_bound + (radius - z) * np.sin(t)
+  points[above,2] = radius - (radius - z) * np.cos(t)
+  return points
+
+
+def make_samples(samples=100, vtx_num=8, seed=0, dtype=np.float32):
+  '''
+  samples neutral/pose pairs with about vtx_num vertices each
+  Returns tuple (neutral_rows, pose_rows), each (samples, vtx*3)
+  '''
+  rng = np.random.default_rng(seed)
+  rows, cols = grid_size(vtx_num)
+
+  neutral = np.empty((samples, rows*cols*3), dtype=dtype)
+  pose = np.empty((samples, rows*cols*3), dtype=dtype)
+  for i in range(samples):
+    points = make_neutral(rows, cols, rng)
+    neutral[i] = points.reshape(-1)
+    pose[i] = bend(points, angle_deg=rng.uniform(25, 50)).reshape(-1)
+  return neutral, pose
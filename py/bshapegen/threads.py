@@ -0,0 +1,249 @@
+'''
+CPU thread pool and affinity settings for training and inference.
+
+Several make_model/predict processes started at once (the UI, batch jobs)
+oversubscribe the machine with torch's default pools. Settings come from,
+in order of precedence:
+  --threads/--interop_threads/--cpus options
+  $BSG_THREADS, $BSG_INTEROP_THREADS, $BSG_CPUS
+  the autotuned config ($BSG_THREADS_CONFIG, ~/.bshapegen/threads.json)
+  torch defaults
+
+  python threads.py autotune model_input_data.npy model_output_data.npy
+'''
+import os
+import sys
+import json
+import time
+import click
+import numpy as np
+import torch
+import torch.nn as nn
+
+# allow running as a script (python threads.py) as well as a module
+if __package__ in (None, ''):
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bshapegen.vtx_io as vtx_io
+
+CONFIG_PATH = os.environ.get('BSG_THREADS_CONFIG',
+                             os.path.join(os.path.expanduser('~'), '.bshapegen', 'threads.json'))
+TASKS = ['train', 'predict']
+
+
+def parse_cpus(spec=''):
+  '''"0-3,8" -> [0, 1, 2, 3, 8]'''
+  cpus = []
+  for part in spec.split(','):
+    part = part.strip()
+    if not part:
+      continue
+    if '-' in part:
+      first, last = part.split('-')
+      cpus.extend(range(int(first), int(last)+1))
+    else:
+      cpus.append(int(part))
+  return cpus
+
+
+def shape_key(input_cols=0, output_cols=0):
+  return '%d-%d' % (input_cols, output_cols)
+
+
+def load_config(path=CONFIG_PATH):
+  if not os.path.exists(path):
+    return {}
+  with open(path, 'r') as fp:
+    return json.load(fp)
+
+
+def tuned(task='train', key='', path=CONFIG_PATH):
+  '''
+  autotuned setting for task, the one tuned for the same data shape key or
+  the last one tuned for the task (printed when key was not tuned).
+  Returns dict or None
+  '''
+  entries = load_config(path).get(task, {})
+  if key in entries:
+    return entries[key]
+  setting = entries.get('last')
+  if key and setting:
+    print("threads: no %s setting autotuned for shape %s, reusing the one tuned for %s"
+          % (task, key, setting.get('key', 'another shape')))
+  return setting
+
+
+def save_tuned(task='train', key='', setting={}, path=CONFIG_PATH):
+  config = load_config(path)
+  entries = config.setdefault(task, {})
+  entries[key] = setting
+  entries['last'] = dict(setting, key=key)
+  if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  with open(path, 'w') as fp:
+    json.dump(config, fp, indent=2)
+
+
+def configure(threads=0, interop_threads=0, cpus='', task='', key=''):
+  '''
+  apply thread/affinity settings (0/'' = not set, see module docstring for
+  precedence), call before any torch work in the process
+  Returns dict of the applied settings
+  '''
+  setting = tuned(task, key) if task else None
+  setting = setting or {}
+  threads = threads or int(os.environ.get('BSG_THREADS', 0)) or setting.get('threads', 0)
+  interop_threads = (interop_threads
+                     or int(os.environ.get('BSG_INTEROP_THREADS', 0))
+                     or setting.get('interop_threads', 0))
+  cpus = cpus or os.environ.get('BSG_CPUS', '')
+
+  if cpus and hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, parse_cpus(cpus))
+  if threads:
+    torch.set_num_threads(threads)
+  if interop_threads:
+    try:
+      torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+      # only settable once, before inter-op parallel work started
+      pass
+
+  return {'threads':torch.get_num_threads(),
+          'interop_threads':torch.get_num_interop_threads(),
+          'cpus':cpus}
+
+
+def candidate_threads(max_threads=0):
+  '''1, 2, 4, ... up to max_threads (the usable cores) and max_threads itself'''
+  if hasattr(os, 'sched_getaffinity'):
+    max_threads = max_threads or len(os.sched_getaffinity(0))
+  max_threads = max_threads or os.cpu_count() or 1
+  counts = []
+  n = 1
+  while n < max_threads:
+    counts.append(n)
+    n *= 2
+  counts.append(max_threads)
+  return counts
+
+
+def _time_train(inputs_norm, outputs_norm, neuron_num=512, batch_size=0, epochs=2):
+  import bshapegen.build_model as build_model
+
+  torch.manual_seed(0)
+  model = build_model.make_net(inputs_norm.shape[1], outputs_norm.shape[1], neuron_num)
+  optimizer = torch.optim.Adam(model.parameters())
+  batches = build_model.ShuffledBatches(inputs_norm, outputs_norm, batch_size=batch_size)
+  # one untimed epoch for allocator/pool warm up
+  build_model.train_epochs(model, batches, None, nn.MSELoss(), optimizer, epochs=1)
+  start_time = time.perf_counter()
+  build_model.train_epochs(model, batches, None, nn.MSELoss(), optimizer, epochs=epochs)
+  return (time.perf_counter() - start_time) / epochs
+
+
+def _time_predict(model, inputs, stats, chunk_size=256, calls=5):
+  import bshapegen.infer_model as infer_model
+
+  infer_model.run_model(model, inputs, *stats, chunk_size=chunk_size)
+  timings = []
+  for i in range(calls):
+    start_time = time.perf_counter()
+    infer_model.run_model(model, inputs, *stats, chunk_size=chunk_size)
+    timings.append(time.perf_counter() - start_time)
+  return float(np.median(timings))
+
+
+@click.group()
+def cli():
+  pass
+
+
+@cli.command()
+@click.argument('model_input_m',  type=click.Path(exists=True))
+@click.argument('model_output_m', type=click.Path(exists=True))
+@click.option('--task', 'tasks', multiple=True, type=click.Choice(TASKS), default=TASKS, help='train and/or predict (repeatable)')
+@click.option('--candidates', default='', help='comma separated thread counts, default 1,2,4,.. up to the core count')
+@click.option('--interop_threads', default=1, help='inter-op threads used while tuning and saved with the result')
+@click.option('--rows', default=1024, help='rows of the data used for timing')
+@click.option('--epochs', default=2, help='timed training epochs per candidate')
+@click.option('--neuron_num', default=512, help='512,1024,etc..')
+@click.option('--batch_size', default=0, help='0 = full batch, 32,64,etc..')
+@click.option('--model_pt', default='', help='model timed for predict, default an untrained net of the same shape')
+@click.option('--chunk_size', default=256, help='predict rows per forward pass')
+def autotune(model_input_m='',
+             model_output_m='',
+             tasks=TASKS,
+             candidates='',
+             interop_threads=1,
+             rows=1024,
+             epochs=2,
+             neuron_num=512,
+             batch_size=0,
+             model_pt='',
+             chunk_size=256):
+  '''
+  Time training epochs / inference batches at different thread counts for
+  the shape of MODEL_INPUT_M/MODEL_OUTPUT_M and save the fastest setting,
+  make_model/predict/serve pick it up when no threads are given
+  '''
+  import bshapegen.build_model as build_model
+  import bshapegen.infer_model as infer_model
+
+  try:
+    torch.set_num_interop_threads(interop_threads)
+  except RuntimeError:
+    pass
+
+  inputs = vtx_io.load_vtx(model_input_m)
+  outputs = vtx_io.load_vtx(model_output_m)
+  inputs = np.array(inputs[:rows], dtype=np.float32)
+  outputs = np.array(outputs[:rows], dtype=np.float32)
+  key = shape_key(inputs.shape[1], outputs.shape[1])
+
+  inputs_norm, inputs_mean, inputs_std = build_model.featNorm(inputs)
+  outputs_norm, outputs_mean, outputs_std = build_model.featNorm(outputs)
+  inputs_norm = torch.from_numpy(inputs_norm)
+  outputs_norm = torch.from_numpy(outputs_norm)
+  stats = [torch.FloatTensor(stat).reshape(1,-1) for stat in (inputs_mean, inputs_std, outputs_mean, outputs_std)]
+
+  if model_pt:
+    model = infer_model.load_model(model_pt)
+  else:
+    model = build_model.make_net(inputs.shape[1], outputs.shape[1], neuron_num).eval()
+
+  counts = [int(n) for n in candidates.split(',') if n.strip()] or candidate_threads()
+
+  for task in tasks:
+    timings = {}
+    for n in counts:
+      torch.set_num_threads(n)
+      if task == 'train':
+        timings[n] = _time_train(inputs_norm, outputs_norm, neuron_num, batch_size, epochs)
+      else:
+        timings[n] = _time_predict(model, inputs, stats, chunk_size)
+      print('[%s] [threads: %d] [%0.4fs]' % (task, n, timings[n]))
+
+    best = min(timings, key=timings.get)
+    save_tuned(task, key, {'threads':best,
+                           'interop_threads':interop_threads,
+                           'seconds':timings[best],
+                           'timings':{str(n):t for n, t in timings.items()},
+                           'time':time.strftime('%Y-%m-%dT%H:%M:%S')})
+    print('Best %s threads for %s: %d (saved to %s)' % (task, key, best, CONFIG_PATH))
+
+
+@cli.command()
+def show():
+  '''print the saved autotune config and the current settings'''
+  print(json.dumps({'config_path':CONFIG_PATH,
+                    'config':load_config(),
+                    'env':{name:os.environ.get(name, '') for name in ['BSG_THREADS',
+                                                                      'BSG_INTEROP_THREADS',
+                                                                      'BSG_CPUS']},
+                    'torch_threads':torch.get_num_threads(),
+                    'torch_interop_threads':torch.get_num_interop_threads()}, indent=2))
+
+
+if __name__ == '__main__':
+  cli()
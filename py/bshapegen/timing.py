@@ -0,0 +1,134 @@
+'''
+Lightweight stage timing for the Maya export -> build -> predict -> import
+pipeline. Only needs the standard library, so it runs inside Maya:
+
+  import bshapegen.timing as timing
+
+  timing.reset()
+  with timing.span('vertex read'):
+    rows = backend.get_points_batch(mesh_list)
+  timing.print_report('export')
+  timing.save('timing_export.json', 'export')
+
+Spans are aggregated per name (count, total, mean and max seconds) by a
+process wide Timer. Spans can nest (ie. subprocess launch contains the
+startup of the child), so shares of the action wall time can add up to
+more than 100%. build_model.py/infer_model.py save their own spans to
+$BSG_TIMING_JSON when it is set; merge_file() adds them to the caller's
+report with a prefix (infer_model/forward pass).
+'''
+import os
+import json
+import time
+import contextlib
+
+ENV_VAR = 'BSG_TIMING_JSON'
+
+
+class Timer(object):
+  def __init__(self):
+    self.reset()
+
+
+  def reset(self):
+    self.spans = {}
+    self.start_time = time.perf_counter()
+
+
+  @contextlib.contextmanager
+  def span(self, name=''):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add(name, time.perf_counter() - start)
+
+
+  def add(self, name='', seconds=0.0, count=1, max_s=None):
+    entry = self.spans.setdefault(name, {'count':0, 'total_s':0.0, 'max_s':0.0})
+    entry['count'] += count
+    entry['total_s'] += seconds
+    entry['max_s'] = max(entry['max_s'], seconds if max_s is None else max_s)
+
+
+  def merge(self, stages=[], prefix=''):
+    '''add the stages of another report (ie. from a subprocess)'''
+    for stage in stages:
+      self.add(prefix + stage['name'], stage['total_s'], stage['count'], stage['max_s'])
+
+
+  def report(self, action=''):
+    '''
+    Returns dict {'action', 'wall_s', 'stages':[{name, count, total_s,
+    mean_s, max_s, share}, ...]}, stages sorted by total time
+    '''
+    wall_s = time.perf_counter() - self.start_time
+    stages = []
+    for name, entry in self.spans.items():
+      stages.append({'name':name,
+                     'count':entry['count'],
+                     'total_s':entry['total_s'],
+                     'mean_s':entry['total_s'] / max(entry['count'], 1),
+                     'max_s':entry['max_s'],
+                     'share':entry['total_s'] / wall_s if wall_s > 0 else 0.0})
+    stages.sort(key=lambda stage: -stage['total_s'])
+    return {'action':action, 'wall_s':wall_s, 'stages':stages}
+
+
+  def print_report(self, action=''):
+    report = self.report(action)
+    print('--- timing: %s (wall %0.3fs) ---' % (action, report['wall_s']))
+    for stage in report['stages']:
+      print('  %-32s %6dx %10.4fs %6.1f%%  (max %0.4fs)'
+            % (stage['name'], stage['count'], stage['total_s'], stage['share']*100, stage['max_s']))
+    return report
+
+
+  def save(self, path='', action=''):
+    with open(path, 'w') as fp:
+      json.dump(self.report(action), fp, indent=2)
+    return path
+
+
+_timer = Timer()
+
+
+def span(name=''):
+  '''time a block under name in the process wide Timer'''
+  return _timer.span(name)
+
+
+def add(name='', seconds=0.0):
+  '''add an already measured span'''
+  _timer.add(name, seconds)
+
+
+def reset():
+  _timer.reset()
+
+
+def report(action=''):
+  return _timer.report(action)
+
+
+def print_report(action=''):
+  return _timer.print_report(action)
+
+
+def save(path='', action=''):
+  return _timer.save(path, action)
+
+
+def save_env(action=''):
+  '''save the report to $BSG_TIMING_JSON if it is set (subprocesses of the UI)'''
+  path = os.environ.get(ENV_VAR)
+  if path:
+    _timer.save(path, action)
+
+
+def merge_file(path='', prefix=''):
+  '''add the stages saved by a subprocess, a missing file (ie. it failed) is skipped'''
+  if not os.path.exists(path):
+    return
+  with open(path, 'r') as fp:
+    _timer.merge(json.load(fp)['stages'], prefix)
@@ -0,0 +1,206 @@
+'''
+Content addressed cache of make_model results.
+
+The key is a sha1 of the training data contents (files, or all shards of
+a shard directory) plus every make_model param that changes the trained
+model (KEY_PARAMS, including the seed). An identical build copies the
+stored model.pt, stats and PCA basis instead of training again (stats are
+rewritten when the build asks for another .npy/.m format). Only
+seeded builds are cached, an unseeded one is a different random model
+every time.
+
+Entries live in $BSG_TRAIN_CACHE_DIR (~/.bshapegen/train_cache), the least
+recently used ones are evicted above $BSG_TRAIN_CACHE_MB (4096, 0 turns the
+cache off).
+'''
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import bshapegen.utils as utils
+import bshapegen.vtx_io as vtx_io
+import bshapegen.shards as shards
+
+CACHE_DIR = os.environ.get('BSG_TRAIN_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.bshapegen', 'train_cache'))
+DEFAULT_MAX_BYTES = int(float(os.environ.get('BSG_TRAIN_CACHE_MB', 4096)) * 1024 * 1024)
+
+# bump when training changes so old entries stop matching
+CACHE_VERSION = 1
+
+# make_model params that change the trained model
+KEY_PARAMS = ['neuron_num',
+              'learning_rate',
+              'epochs',
+              'validation_split',
+              'batch_size',
+              'num_workers',
+              'patience',
+              'precision',
+              'pca_inputs',
+              'pca_outputs',
+              'seed']
+
+# vertex data artifacts, restored as .npy or .m whatever format they were stored in
+STATS_ROLES = ['inputs_mean_m',
+               'inputs_std_m',
+               'outputs_mean_m',
+               'outputs_std_m']
+
+META_JSON = 'meta.json'
+
+
+def _dir_nbytes(path=''):
+  return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class TrainCache(object):
+  def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.enabled = max_bytes > 0
+
+
+  def _hashes_path(self):
+    return os.path.join(self.cache_dir, 'file_hashes.json')
+
+
+  def data_hash(self, path=''):
+    '''
+    sha1 of a data file or of all shards of a shard directory
+    file hashes are remembered per (path, mtime, size), unchanged files
+    are not read again
+    '''
+    if os.path.isdir(path):
+      paths = shards.shard_paths(path)
+    else:
+      paths = [path]
+
+    known = {}
+    if os.path.exists(self._hashes_path()):
+      with open(self._hashes_path(), 'r') as fp:
+        known = json.load(fp)
+
+    sha1 = hashlib.sha1()
+    for file_path in paths:
+      st = os.stat(file_path)
+      file_key = '%s|%d|%d' % (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+      if file_key not in known:
+        # forget older versions of the file
+        prefix = os.path.abspath(file_path) + '|'
+        for old_key in [k for k in known if k.startswith(prefix)]:
+          del known[old_key]
+        known[file_key] = utils.file_sha1(file_path)
+      sha1.update(known[file_key].encode('ascii'))
+
+    if not os.path.exists(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    with open(self._hashes_path(), 'w') as fp:
+      json.dump(known, fp)
+    return sha1.hexdigest()
+
+
+  def key(self, data_paths=[], params={}):
+    '''cache key of the training data and the KEY_PARAMS of params'''
+    key_data = {'version':CACHE_VERSION,
+                'data':[self.data_hash(path) for path in data_paths],
+                'params':{name:params.get(name) for name in KEY_PARAMS}}
+    return hashlib.sha1(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+  def entry_dir(self, key=''):
+    return os.path.join(self.cache_dir, key)
+
+
+  def restore(self, key='', artifacts={}):
+    '''
+    copy a cached entry to the artifacts {role: path} paths
+    Returns True on a hit
+    '''
+    entry_dir = self.entry_dir(key)
+    meta_path = os.path.join(entry_dir, META_JSON)
+    if not (self.enabled and os.path.exists(meta_path)):
+      return False
+    with open(meta_path, 'r') as fp:
+      meta = json.load(fp)
+
+    # every requested artifact has to be in the entry (the pca basis is optional)
+    # in the same format, or a stats format vtx_io can convert
+    for role, path in artifacts.items():
+      if role not in meta['artifacts']:
+        if role != 'pca':
+          return False
+      elif (os.path.splitext(meta['artifacts'][role])[1].lower() != os.path.splitext(path)[1].lower()
+            and role not in STATS_ROLES):
+        return False
+
+    for role, path in artifacts.items():
+      if role in meta['artifacts']:
+        stored_path = os.path.join(entry_dir, meta['artifacts'][role])
+        if os.path.splitext(stored_path)[1].lower() == os.path.splitext(path)[1].lower():
+          shutil.copyfile(stored_path, path)
+        else:
+          vtx_io.write_vtx(path, vtx_io.read_vtx(stored_path))
+      elif os.path.exists(path):
+        # a stale basis of another build must not be picked up
+        os.remove(path)
+
+    # mtime of meta.json is the last use for LRU eviction
+    os.utime(meta_path)
+    return True
+
+
+  def store(self, key='', artifacts={}, params={}):
+    '''copy the existing artifacts {role: path} into the cache under key'''
+    if not self.enabled:
+      return
+    entry_dir = self.entry_dir(key)
+    tmp_dir = entry_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+      shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    stored = {}
+    for role, path in artifacts.items():
+      if path and os.path.exists(path):
+        stored[role] = role + os.path.splitext(path)[1]
+        shutil.copyfile(path, os.path.join(tmp_dir, stored[role]))
+    with open(os.path.join(tmp_dir, META_JSON), 'w') as fp:
+      json.dump({'key':key,
+                 'artifacts':stored,
+                 'params':{name:params.get(name) for name in KEY_PARAMS},
+                 'created':time.strftime('%Y-%m-%dT%H:%M:%S')}, fp, indent=2)
+
+    # replace an entry written with --force
+    if os.path.exists(entry_dir):
+      shutil.rmtree(entry_dir)
+    os.rename(tmp_dir, entry_dir)
+    self.evict(keep=key)
+
+
+  def entries(self):
+    '''Returns list of (last_used, nbytes, key), least recently used first'''
+    entries = []
+    if not os.path.exists(self.cache_dir):
+      return entries
+    for key in os.listdir(self.cache_dir):
+      meta_path = os.path.join(self.cache_dir, key, META_JSON)
+      if os.path.exists(meta_path):
+        entries.append((os.path.getmtime(meta_path), _dir_nbytes(self.entry_dir(key)), key))
+    return sorted(entries)
+
+
+  def evict(self, keep=''):
+    '''drop least recently used entries until the cache fits max_bytes'''
+    entries = self.entries()
+    total = sum(nbytes for last_used, nbytes, key in entries)
+    for last_used, nbytes, key in entries:
+      if total <= self.max_bytes:
+        break
+      if key == keep:
+        continue
+      shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+      total -= nbytes
+      print('Training cache evicted:', key)
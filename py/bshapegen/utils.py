@@ -1,7 +1,31 @@
 import os
+import hashlib
 import traceback
 import subprocess
 
+
+def file_sha1(path='', block_size=1 << 20):
+  '''sha1 hex digest of a file, read block_size bytes at a time'''
+  sha1 = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(block_size), b''):
+      sha1.update(block)
+  return sha1.hexdigest()
+
+
+def model_paths(model_pt='',
+                inputs_mean_m='',
+                inputs_std_m='',
+                outputs_mean_m='',
+                outputs_std_m=''):
+  '''model artifact paths as saved by build_model and sent to the inference server'''
+  return {'model_pt':model_pt,
+          'inputs_mean_m':inputs_mean_m,
+          'inputs_std_m':inputs_std_m,
+          'outputs_mean_m':outputs_mean_m,
+          'outputs_std_m':outputs_std_m}
+
+
 def subprocess_cmd(cmd=[],env=os.environ,wait=0,shell=None,v=0):
   if v:
     print('subprocess_cmd():')
@@ -0,0 +1,149 @@
+'''
+Vertex data file io.
+
+Two on-disk layouts are supported, picked by file extension:
+  .npy - binary float32 using the numpy .npy (v1.0) layout. The header holds
+         the dtype and the shape (shape count, vertex count * 3), so readers
+         can memory-map the data instead of parsing it.
+  .m   - whitespace separated text, one shape per line (legacy fallback)
+
+write_vtx and read_vtx only use the standard library so they also run inside
+Maya without numpy. load_vtx returns numpy arrays for the model scripts.
+'''
+import os
+import ast
+import sys
+import array
+import struct
+
+NPY_EXT = '.npy'
+NPY_MAGIC = b'\x93NUMPY'
+NPY_ALIGN = 64
+
+# npy descr -> array module typecode
+_TYPECODES = {'<f4':'f',
+              '<f8':'d'}
+
+
+def is_binary(path=''):
+  '''True if path uses the binary .npy layout'''
+  return os.path.splitext(path)[1].lower() == NPY_EXT
+
+
+def _npy_header(shape, descr='<f4'):
+  '''build a .npy v1.0 header for a C ordered array'''
+  header = "{'descr': '%s', 'fortran_order': False, 'shape': %s, }" % (descr, repr(tuple(shape)))
+  # magic(6) + version(2) + header len(2) + header + '\n' padded to NPY_ALIGN
+  pad = NPY_ALIGN - (10 + len(header) + 1) % NPY_ALIGN
+  header = header + ' '*(pad % NPY_ALIGN) + '\n'
+  return NPY_MAGIC + b'\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def read_npy_header(f):
+  '''
+  read the header of an open .npy file
+  Returns tuple (descr, shape, data_offset)
+  '''
+  magic = f.read(6)
+  if magic != NPY_MAGIC:
+    raise ValueError('Not a .npy file: %s' % getattr(f, 'name', f))
+  major, minor = struct.unpack('<BB', f.read(2))
+  if major == 1:
+    header_len = struct.unpack('<H', f.read(2))[0]
+  else:
+    header_len = struct.unpack('<I', f.read(4))[0]
+  header = ast.literal_eval(f.read(header_len).decode('latin1'))
+  if header['fortran_order']:
+    raise ValueError('Fortran ordered .npy files are not supported')
+  return header['descr'], tuple(header['shape']), f.tell()
+
+
+def to_bytes(data=[]):
+  '''
+  pack rows of vertex values as little-endian float32
+  data can be a list of rows (floats or strings) or a numpy array
+  Returns tuple (shape, bytes)
+  '''
+  if hasattr(data, 'astype'):
+    return tuple(data.shape), data.astype('<f4').tobytes()
+
+  cols = len(data[0]) if len(data) else 0
+  values = array.array('f')
+  for row in data:
+    if len(row) != cols:
+      raise ValueError('All rows must have the same length: %d != %d' % (len(row), cols))
+    values.extend(float(v) for v in row)
+  if sys.byteorder == 'big':
+    values.byteswap()
+  return (len(data), cols), values.tobytes()
+
+
+def from_bytes(buf=b'', shape=(), typecode='f'):
+  '''
+  unpack little-endian float32 (or float64 with typecode 'd') values
+  Returns a list of rows of floats
+  '''
+  values = array.array(typecode)
+  values.frombytes(buf)
+  if sys.byteorder == 'big':
+    values.byteswap()
+
+  # a 1d array is a single row
+  cols = shape[-1] if shape else 1
+  data = []
+  for i in range(0, len(values), max(cols, 1)):
+    data.append(values[i:i+cols].tolist())
+  return data
+
+
+def write_vtx(path='', data=[]):
+  '''
+  write rows of vertex values (one row per shape)
+  data can be a list of rows (floats or strings) or a 2d numpy array
+  '''
+  if hasattr(data, 'tolist') and not is_binary(path):
+    data = data.tolist()
+
+  if is_binary(path):
+    shape, buf = to_bytes(data)
+    with open(path, 'wb') as f:
+      f.write(_npy_header(shape))
+      f.write(buf)
+  else:
+    with open(path, 'w') as f:
+      for row in data:
+        f.write(' '.join(str(v) for v in row)+'\n')
+
+
+def read_vtx(path=''):
+  '''
+  read vertex values without numpy
+  Returns a list of rows of floats (one row per shape)
+  '''
+  if is_binary(path):
+    with open(path, 'rb') as f:
+      descr, shape, offset = read_npy_header(f)
+      if descr not in _TYPECODES:
+        raise ValueError('Unsupported .npy dtype: %s' % descr)
+      data = from_bytes(f.read(), shape, _TYPECODES[descr])
+  else:
+    data = []
+    with open(path, 'r') as f:
+      for line in f:
+        line = line.split()
+        if line:
+          data.append([float(v) for v in line])
+
+  return data
+
+
+def load_vtx(path='', mmap=True):
+  '''
+  load vertex values as a numpy array
+  .npy files are memory-mapped read-only unless mmap is False
+  '''
+  import numpy as np
+
+  if is_binary(path):
+    return np.load(path, mmap_mode='r' if mmap else None)
+  return np.loadtxt(path)
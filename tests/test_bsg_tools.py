@@ -0,0 +1,73 @@
+'''
+bsg_tools against an in-memory StubBackend, no Maya needed:
+
+  pytest tests
+'''
+import os
+import sys
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'py'))
+
+import bshapegen.vtx_io as vtx_io
+import bshapegen.export_cache as export_cache
+import bshapegen.mesh_backend as mesh_backend
+import bshapegen.maya.bsg_tools as bsg_t
+
+
+@pytest.fixture
+def backend():
+  rng = np.random.default_rng(0)
+  meshes = {}
+  for i in range(3):
+    meshes['shape_%d_neutral' % i] = rng.random((8, 3))
+    meshes['shape_%d_pose' % i] = rng.random((8, 3))
+  backend = mesh_backend.StubBackend(meshes)
+  mesh_backend.set_backend(backend)
+  yield backend
+  mesh_backend.set_backend(None)
+
+
+def test_export_model_data(backend, tmp_path):
+  mesh_list = sorted(backend.meshes)
+  data_path = str(tmp_path / 'model_input_data.npy')
+
+  stats = bsg_t.export_model_data(mesh_list, '_neutral', data_path)
+  assert stats['added'] == 3 and stats['rewritten']
+  neutral = bsg_t.get_model_input_data(mesh_list, '_neutral')
+  assert neutral.shape == (3, 24) and neutral.dtype == np.float32
+  np.testing.assert_array_equal(vtx_io.load_vtx(data_path), neutral)
+
+  # only the edited mesh is patched in place
+  backend.set_points('shape_1_neutral', backend.get_points('shape_1_neutral') + 1)
+  stats = bsg_t.export_model_data(mesh_list, '_neutral', data_path)
+  assert (stats['changed'], stats['unchanged'], stats['rewritten']) == (1, 2, False)
+  np.testing.assert_array_equal(vtx_io.load_vtx(data_path),
+                                bsg_t.get_model_input_data(mesh_list, '_neutral'))
+  assert export_cache.load_manifest(data_path) is not None
+
+
+def test_create_and_update_predict_shapes(backend):
+  mesh_list = ['shape_%d_neutral' % i for i in range(3)]
+  pose = bsg_t.get_model_output_data(['shape_%d_pose' % i for i in range(3)])
+
+  new_mesh_list = bsg_t.create_shapes('shape_0_neutral', ['pose'], [pose[0]])
+  assert new_mesh_list == ['shape_0_pose_predict']
+  np.testing.assert_array_equal(backend.get_points('shape_0_pose_predict').reshape(-1), pose[0])
+
+  created, updated, unchanged = bsg_t.update_predict_shapes(mesh_list, pose)
+  assert (created, updated, unchanged) == (['shape_1_pose_predict', 'shape_2_pose_predict'],
+                                           [],
+                                           ['shape_0_pose_predict'])
+
+  pose[2] += 1
+  created, updated, unchanged = bsg_t.update_predict_shapes(mesh_list, pose)
+  assert (created, updated) == ([], ['shape_2_pose_predict'])
+  np.testing.assert_array_equal(backend.get_points('shape_2_pose_predict').reshape(-1), pose[2])
+
+
+def test_vertex_count_mismatch(backend):
+  with pytest.raises(ValueError):
+    backend.set_points('shape_0_neutral', np.zeros(9))
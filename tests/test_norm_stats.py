@@ -0,0 +1,61 @@
+'''
+norm_stats.RunningStats against one-pass numpy stats:
+
+  pytest tests
+'''
+import os
+import sys
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'py'))
+
+import bshapegen.norm_stats as norm_stats
+import bshapegen.build_model as build_model
+
+
+def _data(rows=1000, cols=12, seed=0):
+  rng = np.random.default_rng(seed)
+  # large offsets and a constant column, where a naive sum of squares loses precision
+  data = rng.normal(1000.0, rng.uniform(0.01, 5.0, cols), (rows, cols))
+  data[:, 0] = 3.0
+  return data.astype(np.float32)
+
+
+def test_featnorm_matches_numpy():
+  data = _data()
+  expected_mean = np.mean(data.astype(np.float64), axis=0)
+  expected_std = np.std(data.astype(np.float64), axis=0, ddof=0)
+
+  for chunk_rows in [1, 7, 4096]:
+    data_norm, mean, std = build_model.featNorm(data, chunk_rows=chunk_rows)
+    np.testing.assert_allclose(mean, expected_mean, rtol=1e-12)
+    np.testing.assert_allclose(std, expected_std, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(data_norm,
+                               (data - expected_mean) / (expected_std + norm_stats.EPS),
+                               rtol=1e-4, atol=1e-4)
+    assert data_norm.dtype == np.float32
+
+
+def test_merge_uneven_chunks():
+  data = _data(rows=997)
+  one_pass = norm_stats.chunk_stats(data, chunk_rows=len(data))
+
+  # partial stats of uneven splits (as from several loader workers), merged
+  stats = norm_stats.RunningStats()
+  for start, end in [(0, 1), (1, 300), (300, 301), (301, 750), (750, 997)]:
+    stats.merge(norm_stats.chunk_stats(data[start:end], chunk_rows=64))
+  stats.merge(norm_stats.RunningStats())
+
+  assert stats.count == one_pass.count == len(data)
+  np.testing.assert_allclose(stats.mean, one_pass.mean, rtol=1e-12)
+  np.testing.assert_allclose(stats.std, one_pass.std, rtol=1e-9, atol=1e-12)
+
+
+def test_from_mean_std():
+  data = _data(rows=200)
+  head = norm_stats.chunk_stats(data[:150])
+  stats = norm_stats.RunningStats.from_mean_std(head.mean, head.std, count=150)
+  stats.merge(norm_stats.chunk_stats(data[150:]))
+  np.testing.assert_allclose(stats.mean, np.mean(data.astype(np.float64), axis=0), rtol=1e-12)
+  np.testing.assert_allclose(stats.std, np.std(data.astype(np.float64), axis=0), rtol=1e-9, atol=1e-12)
@@ -0,0 +1,56 @@
+'''
+predict_cache.PredictCache hits, misses and missing model files:
+
+  pytest tests
+'''
+import os
+import sys
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'py'))
+
+import bshapegen.utils as utils
+import bshapegen.predict_cache as predict_cache
+
+
+def _model_paths(model_dir):
+  paths = utils.model_paths(*[str(model_dir / name) for name in ['model.pt',
+                                                                  'in_mean.npy',
+                                                                  'in_std.npy',
+                                                                  'out_mean.npy',
+                                                                  'out_std.npy']])
+  for path in paths.values():
+    with open(path, 'wb') as f:
+      f.write(os.path.basename(path).encode('ascii'))
+  return paths
+
+
+def test_predict_misses_only(tmp_path):
+  cache = predict_cache.PredictCache(cache_dir=str(tmp_path / 'cache'))
+  model_paths = _model_paths(tmp_path)
+  calls = []
+  def _predict(rows):
+    calls.append(len(rows))
+    return rows * 2
+
+  rows = np.arange(12, dtype=np.float32).reshape(3, 4)
+  predicted, hits = cache.predict(rows, model_paths, _predict)
+  assert hits == 0 and calls == [3]
+  np.testing.assert_array_equal(predicted, rows * 2)
+
+  rows[1] += 1
+  predicted, hits = cache.predict(rows, model_paths, _predict)
+  assert hits == 2 and calls == [3, 1]
+  np.testing.assert_array_equal(predicted, rows * 2)
+
+
+def test_missing_model(tmp_path):
+  cache = predict_cache.PredictCache(cache_dir=str(tmp_path / 'cache'))
+  model_paths = _model_paths(tmp_path)
+  os.remove(model_paths['model_pt'])
+
+  def _predict(rows):
+    raise AssertionError('predict_func called without a model')
+
+  assert cache.predict(np.zeros((2, 4)), model_paths, _predict) == (None, 0)
@@ -0,0 +1,103 @@
+'''
+retrain stats update, rescaling and retrain history:
+
+  pytest tests
+'''
+import os
+import sys
+import json
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from click.testing import CliRunner
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'py'))
+
+import bshapegen.vtx_io as vtx_io
+import bshapegen.retrain as retrain
+import bshapegen.build_model as build_model
+import bshapegen.infer_model as infer_model
+
+
+def _data(rows, seed=0, shift=0.0):
+  rng = np.random.default_rng(seed)
+  inputs = rng.normal(shift, 1.0 + shift, (rows, 6)).astype(np.float32)
+  outputs = np.tanh(inputs @ rng.normal(size=(6, 9))).astype(np.float32) + shift
+  return inputs, outputs
+
+
+def _stats(inputs, outputs):
+  return [stat for data in (inputs, outputs) for stat in build_model.featNorm(data)[1:]]
+
+
+def _predict(model, inputs, stats):
+  return infer_model.run_model(model, inputs, *[torch.FloatTensor(stat).reshape(1,-1) for stat in stats])
+
+
+@pytest.mark.parametrize('pca', [False, True])
+def test_rescale_model_exact(pca):
+  torch.manual_seed(0)
+  model = build_model.make_net(6, 9, 16)
+  if pca:
+    # folded PCA bases are bias-free first/last layers
+    model = nn.Sequential(nn.Linear(6, 6, bias=False), *model, nn.Linear(9, 9, bias=False))
+  model.eval()
+
+  old_inputs, old_outputs = _data(50)
+  new_inputs, new_outputs = _data(10, seed=1, shift=0.5)
+  old_stats = _stats(old_inputs, old_outputs)
+  input_stats = retrain.update_stats(old_stats[0], old_stats[1], len(old_inputs), new_inputs)
+  output_stats = retrain.update_stats(old_stats[2], old_stats[3], len(old_inputs), new_outputs)
+  new_stats = (input_stats.mean, input_stats.std, output_stats.mean, output_stats.std)
+
+  rows = np.concatenate([old_inputs, new_inputs])
+  before = _predict(model, rows, old_stats)
+  model = retrain.rescale_model(model, old_stats, new_stats)
+  np.testing.assert_allclose(_predict(model, rows, new_stats), before, rtol=1e-4, atol=1e-5)
+
+
+def test_concat_rows():
+  arrays = [np.arange(6, dtype=np.float32).reshape(3, 2),
+            np.arange(6, 10, dtype=np.float32).reshape(2, 2)]
+  rows = retrain.ConcatRows(arrays)
+  assert len(rows) == 5 and rows.shape == (5, 2)
+  np.testing.assert_array_equal(rows[[0, 2, 3, 4]], np.concatenate(arrays)[[0, 2, 3, 4]])
+
+
+def test_retrain_twice(tmp_path):
+  data = [_data(40), _data(8, seed=1, shift=0.5), _data(6, seed=2, shift=1.0)]
+  paths = []
+  for i, (inputs, outputs) in enumerate(data):
+    paths.append((str(tmp_path / ('in_%d.npy' % i)), str(tmp_path / ('out_%d.npy' % i))))
+    vtx_io.write_vtx(paths[i][0], inputs)
+    vtx_io.write_vtx(paths[i][1], outputs)
+
+  with open(tmp_path / 'make_model_params.json', 'w') as fp:
+    json.dump({'model_input_m':paths[0][0], 'model_output_m':paths[0][1]}, fp)
+  torch.manual_seed(0)
+  torch.save(build_model.make_net(6, 9, 16), str(tmp_path / 'model.pt'))
+  stat_names = ['in_mean', 'in_std', 'out_mean', 'out_std']
+  for name, stat in zip(stat_names, _stats(*data[0])):
+    vtx_io.write_vtx(str(tmp_path / (name + '.npy')), stat.reshape(1,-1))
+
+  model_pt = str(tmp_path / 'model.pt')
+  for suffix in ['', '_incr']:
+    stat_paths = [str(tmp_path / (name + suffix + '.npy')) for name in stat_names]
+    new_paths = paths[2 if suffix else 1]
+    result = CliRunner().invoke(retrain.retrain,
+                                [retrain.suffixed(model_pt, suffix)] + stat_paths + list(new_paths)
+                                + ['--epochs', '1', '--seed', '0'])
+    assert result.exit_code == 0, result.output
+
+  # the second retrain merged into stats of all 54 rows
+  with open(retrain.params_path(str(tmp_path / 'model_incr_incr.pt')), 'r') as fp:
+    params = json.load(fp)
+  assert params['row_count'] == 54
+  assert params['input_paths'] == [os.path.abspath(path[0]) for path in paths]
+
+  all_stats = _stats(*[np.concatenate(rows) for rows in zip(*data)])
+  for name, stat in zip(stat_names, all_stats):
+    np.testing.assert_allclose(vtx_io.load_vtx(str(tmp_path / (name + '_incr_incr.npy'))).reshape(-1),
+                               stat, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,48 @@
+'''
+shards.prefetch background thread:
+
+  pytest tests
+'''
+import os
+import sys
+import threading
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'py'))
+
+import bshapegen.shards as shards
+
+
+def test_prefetch_order():
+  assert list(shards.prefetch(range(10), size=2)) == list(range(10))
+  assert list(shards.prefetch(range(10), size=0)) == list(range(10))
+
+
+def test_prefetch_error():
+  def _items():
+    yield 0
+    raise ValueError('bad shard')
+
+  with pytest.raises(ValueError):
+    list(shards.prefetch(_items(), size=2))
+
+
+def test_prefetch_abandoned():
+  closed = threading.Event()
+  def _items():
+    try:
+      for i in range(1000):
+        yield i
+    finally:
+      closed.set()
+
+  threads = threading.active_count()
+  with pytest.raises(RuntimeError):
+    for item in shards.prefetch(_items(), size=2):
+      if item == 3:
+        raise RuntimeError('step failed')
+
+  # the producer was stopped, closed its source and joined
+  assert closed.is_set()
+  assert threading.active_count() == threads